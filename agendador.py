@@ -0,0 +1,309 @@
+import datetime as dt
+import logging
+import os
+import socket
+import threading
+import time
+from collections import namedtuple
+
+import psycopg2
+from psycopg2.extras import Json
+
+import metrics
+from config import Config
+from database import get_db_connection, nova_conexao
+
+# Agendador de tarefas periódicas (conciliação com o Asaas, boletos vencidos,
+# limpeza de arquivos órfãos, rollups de relatórios, cadastro no Asaas dos
+# clientes importados).
+#
+# Cada processo (worker do gunicorn ou `flask agendador`) roda um laço que
+# tenta pegar um advisory lock de sessão numa conexão própria, fora do pool,
+# aberta uma vez e mantida entre os ticks. Quem consegue é o líder e executa as
+# tarefas vencidas; os outros só tentam de novo no próximo tick, na mesma
+# conexão. Se o líder morre, a conexão cai, o Postgres solta o lock e outro
+# processo assume. Cada tarefa ainda pega um lock próprio durante
+# a execução, então `flask agendador --executar` nunca roda junto com o líder.
+#
+# O estado fica na tabela tarefas (próxima execução, duração, último erro,
+# contadores), que também permite desativar uma tarefa sem deploy.
+
+CLASSE_LOCK = 72019  # primeiro inteiro dos advisory locks do agendador
+CHAVE_LIDER = 0
+
+Tarefa = namedtuple("Tarefa", "nome funcao intervalo descricao")
+TAREFAS = {}
+
+EXECUCOES = metrics.counter("agendador_execucoes_total", "Execuções de tarefas, por resultado", ("tarefa", "resultado"))
+DURACAO = metrics.histogram(
+    "agendador_execucao_segundos", "Duração de cada execução de tarefa", ("tarefa",),
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+ULTIMO_SUCESSO = metrics.gauge("agendador_ultimo_sucesso_timestamp", "Unix time da última execução ok", ("tarefa",))
+LIDER = metrics.gauge("agendador_lider", "1 se este processo é o líder do agendador")
+
+
+def tarefa(nome, intervalo, descricao):
+    """Registra `funcao()` para rodar a cada `intervalo` segundos. O retorno (dict) vai para ultimo_resultado."""
+    def registrar(funcao):
+        TAREFAS[nome] = Tarefa(nome, funcao, intervalo, descricao)
+        return funcao
+    return registrar
+
+
+def identificacao():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def registrar_tarefas(cur):
+    """Cria as linhas das tarefas registradas e atualiza o intervalo (vindo do Config)."""
+    for t in TAREFAS.values():
+        cur.execute("""
+            INSERT INTO tarefas (nome, intervalo_segundos) VALUES (%s, %s)
+            ON CONFLICT (nome) DO UPDATE SET intervalo_segundos = EXCLUDED.intervalo_segundos
+        """, (t.nome, t.intervalo))
+
+
+def executar(conn, nome):
+    """Executa uma tarefa já registrada usando `conn` (autocommit) para o lock e o estado.
+
+    Retorna (status, resultado): status é "OK", "ERRO" ou None se outra execução
+    da mesma tarefa estava em andamento.
+    """
+    t = TAREFAS[nome]
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s)) AS ok", (CLASSE_LOCK, nome))
+        if not cur.fetchone()["ok"]:
+            return None, None
+        try:
+            cur.execute("""
+                UPDATE tarefas SET executando_desde = CURRENT_TIMESTAMP, executando_em = %s WHERE nome = %s
+            """, (identificacao(), nome))
+            inicio = time.perf_counter()
+            try:
+                resultado, erro = t.funcao(), None
+            except Exception as e:
+                resultado, erro = None, e
+                logging.exception("Tarefa %s falhou", nome)
+            duracao = time.perf_counter() - inicio
+            status = "ERRO" if erro else "OK"
+
+            DURACAO.observe(duracao, tarefa=nome)
+            EXECUCOES.inc(tarefa=nome, resultado=status.lower())
+            if not erro:
+                ULTIMO_SUCESSO.set(time.time(), tarefa=nome)
+            # Próxima execução conta a partir do início desta (ritmo fixo)
+            cur.execute("""
+                UPDATE tarefas
+                   SET executando_desde = NULL, executando_em = NULL,
+                       ultima_execucao = CURRENT_TIMESTAMP - make_interval(secs => %(duracao)s),
+                       proxima_execucao = CURRENT_TIMESTAMP - make_interval(secs => %(duracao)s)
+                                          + make_interval(secs => intervalo_segundos),
+                       ultima_duracao_ms = %(ms)s, ultimo_status = %(status)s, ultimo_erro = %(erro)s,
+                       ultimo_resultado = %(resultado)s,
+                       execucoes = execucoes + 1,
+                       falhas = falhas + %(falhou)s,
+                       falhas_seguidas = CASE WHEN %(falhou)s = 1 THEN falhas_seguidas + 1 ELSE 0 END
+                 WHERE nome = %(nome)s
+            """, {
+                "nome": nome, "duracao": duracao, "ms": int(duracao * 1000), "status": status,
+                "erro": repr(erro)[:2000] if erro else None,
+                "resultado": Json(resultado) if isinstance(resultado, dict) else None,
+                "falhou": 1 if erro else 0,
+            })
+            logging.info("Tarefa %s: %s em %.1fs %s", nome, status, duracao, resultado or "")
+            return status, resultado if not erro else erro
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", (CLASSE_LOCK, nome))
+    finally:
+        cur.close()
+
+
+def listar(cur):
+    cur.execute("""
+        SELECT nome, intervalo_segundos, ativa, proxima_execucao, executando_desde, executando_em,
+               ultima_execucao, ultima_duracao_ms, ultimo_status, ultimo_erro, ultimo_resultado,
+               execucoes, falhas, falhas_seguidas
+        FROM tarefas ORDER BY nome
+    """)
+    return cur.fetchall()
+
+
+# ====
+# Laço do líder
+# ====
+class Agendador:
+    """Laço de um processo. Roda numa thread do worker web ou via `flask agendador`."""
+
+    def __init__(self, tick=None):
+        self.tick = tick if tick is not None else Config.AGENDADOR_TICK
+        self._conn = None  # conexão do processo para o lock, líder ou não
+        self._lider = False
+        self._parar = threading.Event()
+
+    @property
+    def lider(self):
+        return self._lider
+
+    def parar(self):
+        self._parar.set()
+
+    def _soltar(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()  # fecha a sessão: se era o líder, o Postgres solta o lock
+            except psycopg2.Error:
+                pass
+            self._conn = None
+        if self._lider:
+            self._lider = False
+            LIDER.set(0)
+
+    def _garantir_lideranca(self):
+        if self._conn is not None and self._conn.closed:
+            self._soltar()
+        if self._conn is None:
+            self._conn = nova_conexao()
+        try:
+            with self._conn.cursor() as cur:
+                if self._lider:
+                    cur.execute("SELECT 1")  # sessão viva: o lock continua nosso
+                    return True
+                cur.execute("SELECT pg_try_advisory_lock(%s, %s) AS ok", (CLASSE_LOCK, CHAVE_LIDER))
+                if not cur.fetchone()["ok"]:
+                    return False
+                registrar_tarefas(cur)
+        except psycopg2.OperationalError:
+            logging.warning("Agendador perdeu a conexão (%s)", identificacao())
+            self._soltar()
+            return False
+        except Exception:
+            self._soltar()
+            raise
+        self._lider = True
+        LIDER.set(1)
+        logging.info("Agendador: %s é o líder", identificacao())
+        return True
+
+    def _vencidas(self):
+        with self._conn.cursor() as cur:
+            cur.execute("""
+                SELECT nome FROM tarefas
+                WHERE ativa AND proxima_execucao <= CURRENT_TIMESTAMP AND nome = ANY(%s)
+                ORDER BY proxima_execucao
+            """, (list(TAREFAS),))
+            return [r["nome"] for r in cur.fetchall()]
+
+    def passo(self):
+        """Um tick: garante (ou tenta) a liderança e executa as tarefas vencidas. Retorna quantas rodaram."""
+        if not self._garantir_lideranca():
+            return 0
+        rodadas = 0
+        for nome in self._vencidas():
+            if self._parar.is_set():
+                break
+            status, _ = executar(self._conn, nome)
+            rodadas += status is not None
+        return rodadas
+
+    def executar(self):
+        try:
+            while not self._parar.is_set():
+                try:
+                    self.passo()
+                except Exception:
+                    logging.exception("Erro no agendador")
+                    self._soltar()
+                self._parar.wait(self.tick)
+        finally:
+            self._soltar()
+
+
+_agendador = None
+_agendador_pid = None
+_agendador_lock = threading.Lock()
+
+
+def garantir_em_thread():
+    """Sobe (uma vez por processo, depois do fork) a thread do agendador."""
+    global _agendador, _agendador_pid
+    if not Config.AGENDADOR_THREAD or (_agendador is not None and _agendador_pid == os.getpid()):
+        return
+    with _agendador_lock:
+        if _agendador is None or _agendador_pid != os.getpid():
+            _agendador, _agendador_pid = Agendador(), os.getpid()
+            threading.Thread(target=_agendador.executar, name="agendador", daemon=True).start()
+
+
+# ====
+# Tarefas
+# ====
+@tarefa("conciliacao_boletos", Config.CONCILIACAO_INTERVALO,
+        "Sincroniza com o Asaas um lote das locações ativas sincronizadas há mais tempo")
+def _conciliacao_boletos():
+    import sync_boletos
+    if not Config.ASAAS_API_KEY:
+        return {"ignorada": "ASAAS_API_KEY não configurada"}
+    resultados = sync_boletos.sincronizar_incremental()
+    erros = [loc_id for loc_id, r in resultados.items() if isinstance(r, Exception)]
+    if resultados and len(erros) == len(resultados):
+        raise RuntimeError(f"Todas as {len(erros)} locação(ões) falharam; ex.: {resultados[erros[0]]!r}")
+    ok = [r for r in resultados.values() if not isinstance(r, Exception)]
+    return {
+        "locacoes": len(resultados), "erros": len(erros),
+        "inseridos": sum(r.inseridos for r in ok), "atualizados": sum(r.atualizados for r in ok),
+    }
+
+
+@tarefa("boletos_vencidos", Config.VENCIDOS_INTERVALO,
+        "Confere no Asaas os boletos PENDING que já passaram do vencimento")
+def _boletos_vencidos():
+    import sync_boletos
+    if not Config.ASAAS_API_KEY:
+        return {"ignorada": "ASAAS_API_KEY não configurada"}
+    resultado = sync_boletos.conferir_vencidos()
+    if resultado["conferidos"] and resultado["erros"] == resultado["conferidos"]:
+        raise RuntimeError(f"Nenhum dos {resultado['erros']} boleto(s) pôde ser consultado no Asaas")
+    return resultado
+
+
+@tarefa("arquivos_orfaos", Config.ORFAOS_INTERVALO,
+        "Apaga uploads sem referência e objetos sem registro, passada a carência")
+def _arquivos_orfaos():
+    import armazenamento
+    conn = get_db_connection()
+    try:
+        return armazenamento.limpar_orfaos(conn)
+    finally:
+        conn.close()
+
+
+@tarefa("utilizacao_frota", Config.RELATORIOS_INTERVALO,
+        "Atualiza o rollup diário de utilização da frota (relatorios.py)")
+def _utilizacao_frota():
+    import relatorios
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        dias = relatorios.atualizar_utilizacao(cur)
+        conn.commit()
+        return {"dias": dias, "ate": dt.date.today().isoformat()}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+@tarefa("clientes_asaas", Config.CLIENTES_ASAAS_INTERVALO,
+        "Cadastra no Asaas, em lote, os clientes novos de importações (importacao.py)")
+def _clientes_asaas():
+    import importacao
+    if not Config.ASAAS_API_KEY:
+        return {"ignorada": "ASAAS_API_KEY não configurada"}
+    resultado = importacao.enviar_clientes_asaas(Config.CLIENTES_ASAAS_LOTE)
+    if resultado["erros"] and not (resultado["criados"] or resultado["vinculados"]):
+        raise RuntimeError(f"Nenhum dos {resultado['erros']} cliente(s) pôde ser cadastrado no Asaas")
+    return resultado
@@ -3,6 +3,9 @@ from flask_login import LoginManager, UserMixin
 import os
 
 from config import Config
+import agendador
+import database
+import instrumentacao
 from routes.auth_routes import auth_bp
 from routes.clientes_routes import clientes_bp
 from routes.motos_routes import motos_bp
@@ -10,11 +13,43 @@ from routes.locacoes_routes import locacoes_bp
 from routes.servicos_routes import servicos_bp
 from routes.webhook_routes import webhook_bp
 from routes.dashboard_routes import dashboard_bp
+from routes.metrics_routes import metrics_bp
+from routes.exportacao_routes import exportacao_bp
+from routes.relatorios_routes import relatorios_bp
+from routes.importacao_routes import importacao_bp
 
 # Inicialização
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Pool de conexões: a conexão do request volta ao pool no teardown
+database.init_app(app)
+
+# Tempo de cada request, SQL e chamadas ao Asaas em /metrics; SQL lenta no log
+instrumentacao.init_app(app)
+
+# Threads de fundo (fila do webhook; outbox do Asaas; agendador, uma thread por
+# worker e só o líder executa): sobem no boot de cada worker do gunicorn
+# (post_worker_init em gunicorn.conf.py), para um worker recém-criado drenar o
+# que ficou pendente ou em backoff sem esperar um novo evento; em outros
+# servidores (flask run), no primeiro request. Com --preload, uma thread criada
+# no import morreria no fork.
+_threads_pid = None
+
+def iniciar_threads():
+    global _threads_pid
+    if _threads_pid == os.getpid():
+        return
+    _threads_pid = os.getpid()
+    import asaas_outbox
+    import webhook_queue
+    from routes.webhook_routes import processar_evento
+    webhook_queue.garantir_worker_em_thread(processar_evento)
+    asaas_outbox.garantir_worker_em_thread()
+    agendador.garantir_em_thread()
+
+app.before_request(iniciar_threads)
+
 # Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -42,6 +77,10 @@ app.register_blueprint(motos_bp)
 app.register_blueprint(locacoes_bp)
 app.register_blueprint(servicos_bp)
 app.register_blueprint(webhook_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(exportacao_bp)
+app.register_blueprint(relatorios_bp)
+app.register_blueprint(importacao_bp)
 
 # Criar pastas de upload logo na inicialização do app (Flask 3.x removeu before_first_request)
 upload_folder = app.config.get("UPLOAD_FOLDER", "uploads")
@@ -56,6 +95,22 @@ import click
 from flask.cli import with_appcontext
 from database import get_db_connection
 
+def _avisar_sobreposicoes(cur):
+    # schema.sql não cria excl_locacoes_moto_periodo enquanto houver locações sobrepostas
+    import disponibilidade
+    cur.execute("SELECT 1 FROM pg_constraint WHERE conname = 'excl_locacoes_moto_periodo'")
+    if cur.fetchone():
+        return
+    pares = disponibilidade.sobreposicoes(cur)
+    click.echo(
+        "⚠️  Restrição de sobreposição de locações não criada: estas locações ativas da mesma moto "
+        "se sobrepõem. Cancele ou ajuste as datas e rode init-db de novo."
+    )
+    for par in pares:
+        click.echo(f"   - {disponibilidade.descrever_sobreposicao(par)}")
+    if len(pares) == disponibilidade.LIMITE_PADRAO:
+        click.echo(f"   (mostrando só os primeiros {len(pares)})")
+
 @click.command("init-db")
 @with_appcontext
 def init_db_command():
@@ -68,6 +123,21 @@ def init_db_command():
             cur.execute(sql_code)
         conn.commit()
         click.echo("✅ Banco de dados inicializado com sucesso!")
+        # Eventos antigos do webhook sem id: a chave de deduplicação é o hash do Python
+        import webhook_queue
+        if webhook_queue.preencher_chaves_legadas(cur):
+            conn.commit()
+        # Banco anterior ao ledger: os triggers só valem daqui em diante, o histórico vem de boletos
+        cur.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM financeiro_mensal)
+               AND EXISTS (SELECT 1 FROM boletos) AS vazio
+        """)
+        if cur.fetchone()["vazio"]:
+            import financeiro
+            locacoes = financeiro.reconstruir(cur)
+            conn.commit()
+            click.echo(f"✅ Ledger financeiro preenchido a partir dos boletos ({locacoes} locações atualizadas)")
+        _avisar_sobreposicoes(cur)
     except Exception as e:
         conn.rollback()
         click.echo(f"❌ Erro ao inicializar o banco: {e}")
@@ -76,4 +146,330 @@ def init_db_command():
         conn.close()
 
 # Registra o comando personalizado no Flask CLI
-app.cli.add_command(init_db_command)
\ No newline at end of file
+app.cli.add_command(init_db_command)
+
+@click.command("sync-boletos")
+@click.option("--locacao", "locacao_id", type=int, help="Sincroniza só esta locação")
+@click.option("--workers", type=int, default=None, help="Assinaturas buscadas em paralelo")
+def sync_boletos_command(locacao_id, workers):
+    """Sincroniza boletos do Asaas (todas as locações ativas, ou uma com --locacao)"""
+    import sync_boletos
+
+    if locacao_id:
+        locacoes = {locacao_id: None}
+        try:
+            locacoes[locacao_id] = sync_boletos.sincronizar_locacao(locacao_id)
+        except Exception as e:
+            locacoes[locacao_id] = e
+    else:
+        locacoes = sync_boletos.sincronizar_ativas(max_workers=workers)
+
+    erros = 0
+    for loc_id, resultado in sorted(locacoes.items()):
+        if isinstance(resultado, Exception):
+            erros += 1
+            click.echo(f"❌ Locação {loc_id}: {resultado}")
+        else:
+            click.echo(f"✅ Locação {loc_id}: {resultado.inseridos} inseridos, {resultado.atualizados} atualizados")
+    click.echo(f"{len(locacoes)} locação(ões) processada(s), {erros} com erro.")
+
+app.cli.add_command(sync_boletos_command)
+
+@click.command("rebuild-financeiro")
+@click.option("--verificar", is_flag=True, help="Só confere o ledger com os boletos, sem reconstruir")
+def rebuild_financeiro_command(verificar):
+    """Confere (e reconstrói) o ledger financeiro a partir da tabela boletos"""
+    import dashboard_metrics
+    import financeiro
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        divergencias = financeiro.divergencias(cur)
+        for loc_id, mes, campo, atual, esperado in divergencias[:50]:
+            if loc_id is None:
+                click.echo(f"⚠️  Semana {mes:%Y-%m-%d} {campo}: ledger={atual} boletos={esperado}")
+                continue
+            onde = f"{mes:%Y-%m}" if mes else "total"
+            click.echo(f"⚠️  Locação {loc_id} ({onde}) {campo}: ledger={atual} boletos={esperado}")
+        if len(divergencias) > 50:
+            click.echo(f"... e mais {len(divergencias) - 50} divergência(s).")
+        if not divergencias:
+            click.echo("✅ Ledger financeiro confere com os boletos.")
+            return
+        if verificar:
+            conn.rollback()
+            raise SystemExit(1)
+
+        locacoes = financeiro.reconstruir(cur)
+        conn.commit()
+        dashboard_metrics.invalidate()
+        click.echo(f"✅ Ledger reconstruído ({locacoes} locação(ões) com totais corrigidos).")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+app.cli.add_command(rebuild_financeiro_command)
+
+@click.command("atualizar-relatorios")
+@click.option("--reconstruir", is_flag=True, help="Recalcula a utilização da frota desde o início")
+def atualizar_relatorios_command(reconstruir):
+    """Atualiza a utilização diária da frota (incremental; ver relatorios.py)"""
+    import relatorios
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        dias = relatorios.atualizar_utilizacao(cur, reconstruir=reconstruir)
+        conn.commit()
+        click.echo(f"✅ {dias} dia(s) de utilização recalculado(s).")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+app.cli.add_command(atualizar_relatorios_command)
+
+@click.command("processar-imagens")
+@click.option("--todas", is_flag=True, help="Reprocessa também as fotos que já têm variantes")
+def processar_imagens_command(todas):
+    """Gera miniaturas/WebP das fotos de motos ainda sem variantes"""
+    import imagens
+
+    if not imagens.disponivel():
+        click.echo("❌ Pillow não está instalado.")
+        raise SystemExit(1)
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT id, arquivo FROM moto_imagens" + ("" if todas else " WHERE variantes IS NULL") + " ORDER BY id"
+        )
+        pendentes = [(r["id"], r["arquivo"]) for r in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+    imagens.processar_em_background(pendentes)
+    imagens.encerrar()
+    click.echo(f"✅ {len(pendentes)} foto(s) processada(s).")
+
+app.cli.add_command(processar_imagens_command)
+
+@click.command("migrar-uploads")
+def migrar_uploads_command():
+    """Move arquivos do esquema antigo (nome solto em uploads/<pasta>) para o armazenamento por conteúdo"""
+    import armazenamento
+
+    conn = get_db_connection()
+    try:
+        migrados, faltando = armazenamento.migrar_legados(conn)
+    finally:
+        conn.close()
+    click.echo(f"✅ {migrados} arquivo(s) migrado(s), {faltando} não encontrado(s).")
+    if migrados:
+        click.echo("Rode `flask processar-imagens` para gerar as variantes das fotos migradas.")
+
+app.cli.add_command(migrar_uploads_command)
+
+@click.command("webhook-worker")
+@click.option("--uma-vez", is_flag=True, help="Esvazia a fila e sai (útil em cron/one-off)")
+def webhook_worker_command(uma_vez):
+    """Consome a fila de eventos do webhook Asaas (alternativa à thread dentro do worker web)"""
+    import webhook_queue
+    from routes.webhook_routes import processar_evento
+
+    store = webhook_queue.PostgresStore()
+    if uma_vez:
+        total = 0
+        while True:
+            lidos = webhook_queue.processar_lote(store, processar_evento)
+            if not lidos:
+                break
+            total += lidos
+        click.echo(f"✅ {total} evento(s) processado(s).")
+        return
+
+    click.echo("Consumindo fila do webhook (Ctrl+C para sair)...")
+    worker = webhook_queue.Worker(store, processar_evento)
+    try:
+        worker.executar()
+    except KeyboardInterrupt:
+        worker.parar()
+
+app.cli.add_command(webhook_worker_command)
+
+@click.command("webhook-replay")
+@click.option("--de", type=click.DateTime(), help="Recebidos a partir de (AAAA-MM-DD[ HH:MM:SS])")
+@click.option("--ate", type=click.DateTime(), help="Recebidos antes de (exclusivo)")
+@click.option("--falhos", is_flag=True, help="Só os eventos DEAD (que esgotaram as tentativas)")
+@click.option("--evento", help="Só um tipo de evento, ex.: PAYMENT_RECEIVED")
+@click.option("--simular", is_flag=True, help="Só mostra quantos eventos voltariam para a fila")
+@click.option("--processar", is_flag=True, help="Depois de devolver à fila, processa tudo aqui mesmo")
+def webhook_replay_command(de, ate, falhos, evento, simular, processar):
+    """Devolve à fila do webhook eventos já processados ou que falharam, por período ou em bloco"""
+    import webhook_queue
+    from routes.webhook_routes import processar_evento
+
+    if not (de or ate or falhos):
+        raise click.UsageError("Informe --de/--ate ou --falhos.")
+    store = webhook_queue.PostgresStore()
+    resultado = store.reprocessar(de=de, ate=ate, falhos=falhos, evento=evento, simular=simular)
+    verbo = "voltariam" if simular else "voltaram"
+    click.echo(f"{'🔎' if simular else '✅'} {resultado['reprocessados']} evento(s) {verbo} para a fila.")
+    if resultado["superados"]:
+        click.echo(f"   {resultado['superados']} ignorado(s): o pagamento já tem evento mais novo aplicado.")
+    if simular or not processar:
+        return
+
+    total = 0
+    while True:
+        lidos = webhook_queue.processar_lote(store, processar_evento)
+        if not lidos:
+            break
+        total += lidos
+    click.echo(f"✅ {total} evento(s) processado(s).")
+
+app.cli.add_command(webhook_replay_command)
+
+@click.command("asaas-outbox")
+@click.option("--uma-vez", is_flag=True, help="Envia o que estiver na fila e sai")
+@click.option("--listar", is_flag=True, help="Mostra a fila por status e as operações que falharam")
+@click.option("--reenviar", is_flag=True, help="Devolve à fila todas as operações DEAD")
+def asaas_outbox_command(uma_vez, listar, reenviar):
+    """Envia ao Asaas as operações de assinatura pendentes (alternativa à thread dentro do worker web)"""
+    import asaas_outbox
+
+    if listar or reenviar:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            if reenviar:
+                click.echo(f"✅ {asaas_outbox.reenviar(cur)} operação(ões) devolvida(s) à fila.")
+                conn.commit()
+            if listar:
+                cur.execute("""
+                    SELECT status, operacao, COUNT(*) AS total FROM asaas_outbox
+                    GROUP BY status, operacao ORDER BY status, operacao
+                """)
+                for r in cur.fetchall():
+                    click.echo(f"{r['status']:<8} {r['operacao']:<10} {r['total']}")
+                cur.execute("""
+                    SELECT id, locacao_id, operacao, tentativas, ultimo_erro FROM asaas_outbox
+                    WHERE status = 'DEAD' ORDER BY id
+                """)
+                for r in cur.fetchall():
+                    click.echo(f"❌ #{r['id']} locação {r['locacao_id']} {r['operacao']} "
+                               f"({r['tentativas']} tentativa(s)): {r['ultimo_erro']}")
+        finally:
+            cur.close()
+            conn.close()
+        return
+
+    if uma_vez:
+        click.echo(f"✅ {asaas_outbox.processar_pendentes()} operação(ões) enviada(s).")
+        return
+
+    click.echo("Enviando o outbox do Asaas (Ctrl+C para sair)...")
+    worker = asaas_outbox.Worker()
+    try:
+        worker.executar()
+    except KeyboardInterrupt:
+        worker.parar()
+
+app.cli.add_command(asaas_outbox_command)
+
+@click.command("agendador")
+@click.option("--listar", is_flag=True, help="Mostra as tarefas, última execução e próxima")
+@click.option("--executar", "executar_nome", metavar="TAREFA", help="Executa uma tarefa agora e sai")
+@click.option("--ativar", metavar="TAREFA", help="Reativa uma tarefa")
+@click.option("--desativar", metavar="TAREFA", help="Desativa uma tarefa (o líder deixa de executá-la)")
+def agendador_command(listar, executar_nome, ativar, desativar):
+    """Roda o agendador de tarefas em primeiro plano (sidecar), ou administra as tarefas"""
+    conn = database.nova_conexao()
+    try:
+        with conn.cursor() as cur:
+            agendador.registrar_tarefas(cur)
+            for nome in filter(None, (executar_nome, ativar, desativar)):
+                if nome not in agendador.TAREFAS:
+                    raise click.BadParameter(f"tarefa desconhecida: {nome} (use {', '.join(sorted(agendador.TAREFAS))})")
+            if ativar or desativar:
+                cur.execute("UPDATE tarefas SET ativa = %s WHERE nome = %s", (bool(ativar), ativar or desativar))
+                click.echo(f"✅ Tarefa {ativar or desativar} {'ativada' if ativar else 'desativada'}.")
+            if listar:
+                for t in agendador.listar(cur):
+                    estado = "executando em " + t["executando_em"] if t["executando_desde"] else (t["ultimo_status"] or "nunca rodou")
+                    click.echo(
+                        f"{'✅' if t['ativa'] else '⏸️ '} {t['nome']:<22} a cada {t['intervalo_segundos']}s  "
+                        f"última: {t['ultima_execucao'] or '-'} ({t['ultima_duracao_ms'] or 0} ms, {estado})  "
+                        f"próxima: {t['proxima_execucao']:%Y-%m-%d %H:%M:%S}  "
+                        f"falhas: {t['falhas']} ({t['falhas_seguidas']} seguidas)"
+                    )
+                    if t["ultimo_status"] == "ERRO":
+                        click.echo(f"    erro: {t['ultimo_erro']}")
+        if executar_nome:
+            status, resultado = agendador.executar(conn, executar_nome)
+            if status is None:
+                click.echo(f"⚠️  {executar_nome} já está em execução em outro processo.")
+            else:
+                click.echo(f"{'✅' if status == 'OK' else '❌'} {executar_nome}: {resultado}")
+        if listar or executar_nome or ativar or desativar:
+            return
+    finally:
+        conn.close()
+
+    import logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    click.echo("Agendador rodando (Ctrl+C para sair); só executa enquanto for o líder...")
+    ciclo = agendador.Agendador()
+    try:
+        ciclo.executar()
+    except KeyboardInterrupt:
+        ciclo.parar()
+
+app.cli.add_command(agendador_command)
+
+@click.command("importar")
+@click.argument("tipo", type=click.Choice(["motos", "clientes"]))
+@click.argument("arquivo", type=click.File("rb"))
+@click.option("--simular", is_flag=True, help="Valida e mostra os totais sem gravar nada")
+@click.option("--asaas", is_flag=True, help="Enfileira os clientes novos para cadastro no Asaas (tarefa clientes_asaas)")
+@click.option("--relatorio", type=click.Path(dir_okay=False, writable=True),
+              help="Grava as linhas recusadas neste CSV (pode ser corrigido e reimportado)")
+def importar_command(tipo, arquivo, simular, asaas, relatorio):
+    """Importa motos ou clientes de uma planilha CSV (ex.: flask importar motos frota.csv)"""
+    import importacao
+
+    conn = get_db_connection()
+    try:
+        r = importacao.importar(conn, tipo, arquivo, nome_arquivo=os.path.basename(arquivo.name),
+                                origem="cli", asaas=asaas, simular=simular)
+    except importacao.ImportacaoInvalida as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+
+    titulo = "🔎 Simulação" if simular else f"✅ Importação #{r['id']}"
+    click.echo(
+        f"{titulo}: {r['linhas']} linha(s), "
+        f"{r['inseridos']} nova(s), {r['atualizados']} atualizada(s), {r['inalterados']} sem alteração, "
+        f"{r['erros']} com erro ({r['duracao_ms']} ms)"
+    )
+    if r["asaas_enfileirados"]:
+        click.echo(f"   {r['asaas_enfileirados']} cliente(s) na fila do Asaas.")
+    for e in r["lista_erros"][:20]:
+        click.echo(f"❌ linha {e.linha} ({e.campo}): {e.mensagem}")
+    if r["erros"] > 20:
+        click.echo(f"   ... e mais {r['erros'] - 20}.")
+    if relatorio and r["lista_erros"]:
+        with open(relatorio, "w", encoding="utf-8", newline="") as saida:
+            importacao.relatorio_csv(r["lista_erros"], saida)
+        click.echo(f"Relatório de erros: {relatorio}")
+
+app.cli.add_command(importar_command)
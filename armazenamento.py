@@ -0,0 +1,477 @@
+import datetime as dt
+import hashlib
+import hmac
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import quote, urlencode, urlsplit
+from xml.etree import ElementTree
+
+import requests
+from flask import Response, abort, send_file
+
+import metrics
+from config import Config
+
+# Armazenamento de arquivos enviados (contratos, documentos, CNH, fotos).
+#
+# O upload é copiado em blocos para um temporário enquanto o SHA-256 é
+# calculado, sem carregar o arquivo inteiro em memória. O arquivo é
+# endereçado pelo conteúdo (chave "ab/abcdef....pdf"): o mesmo conteúdo
+# enviado duas vezes ocupa o disco uma vez só, e nomes iguais não se
+# sobrescrevem. A tabela arquivos guarda tamanho, tipo MIME e hash. As
+# colunas que referenciam arquivos (contrato_arquivo, documento_arquivo,
+# habilitacao_arquivo, moto_imagens.arquivo) guardam a chave.
+#
+# Backends: disco local (STORAGE_BACKEND=local) ou qualquer serviço
+# compatível com S3 (STORAGE_BACKEND=s3; em desenvolvimento, fake_s3.py).
+# A entrega para o navegador (ETag, Range, X-Accel-Redirect) fica em entrega.py.
+
+BLOCO = 64 * 1024
+
+ASSINATURAS = (
+    (b"%PDF-", "application/pdf"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+EXTENSOES = {
+    "application/pdf": ".pdf",
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+
+# Arquivos gravados antes deste módulo: nome solto numa subpasta de UPLOAD_FOLDER
+PASTAS_LEGADAS = {
+    "contratos": (("locacoes", "contrato_arquivo"), ("motos", "documento_arquivo")),
+    "habilitacoes": (("clientes", "habilitacao_arquivo"),),
+    "motos": (("moto_imagens", "arquivo"),),
+}
+
+Arquivo = namedtuple("Arquivo", "sha256 chave tamanho mime_type novo")
+
+# Só objetos com cara de chave (ou temporários) entram na limpeza; o resto do bucket/pasta é de outra pessoa.
+# Também é o que pode virar caminho no disco ou URL no S3 (nada de "..", "/" a mais ou caminho absoluto)
+_CHAVE = re.compile(r"(?:[0-9a-f]{2}/[0-9a-f]{64}(?:\.[\w-]+)*|tmp/\w[\w.-]*)")
+
+# Colunas que guardam chaves de arquivos (ver limpar_orfaos)
+REFERENCIAS = (
+    ("locacoes", "contrato_arquivo"),
+    ("motos", "documento_arquivo"),
+    ("motos", "imagem"),
+    ("clientes", "habilitacao_arquivo"),
+    ("moto_imagens", "arquivo"),
+)
+
+GRAVADOS = metrics.counter("arquivos_gravados_total", "Uploads gravados no armazenamento, por resultado", ("resultado",))
+BYTES = metrics.counter("arquivos_bytes_total", "Bytes recebidos em uploads")
+REMOVIDOS = metrics.counter("arquivos_orfaos_removidos_total", "Arquivos órfãos apagados, por origem", ("origem",))
+
+
+def detectar_mime(inicio, nome_original=None, mime_informado=None):
+    """Tipo MIME pelos primeiros bytes; se não reconhecer, pelo nome e, por último, pelo que o cliente informou."""
+    for assinatura, mime in ASSINATURAS:
+        if inicio.startswith(assinatura):
+            return mime
+    if inicio[:4] == b"RIFF" and inicio[8:12] == b"WEBP":
+        return "image/webp"
+    if nome_original:
+        adivinhado = mimetypes.guess_type(nome_original)[0]
+        if adivinhado:
+            return adivinhado
+    return mime_informado or "application/octet-stream"
+
+
+def chave_para(sha256, mime_type):
+    ext = EXTENSOES.get(mime_type) or mimetypes.guess_extension(mime_type) or ""
+    return f"{sha256[:2]}/{sha256}{ext}"
+
+
+def legado(chave):
+    """Chaves sem "/" são nomes do esquema antigo (arquivo solto numa subpasta)."""
+    return bool(chave) and "/" not in chave
+
+
+def chave_valida(chave):
+    """Chave de um objeto do armazenamento (temporários em tmp/ não contam); chaves vindas de URL passam por aqui."""
+    return bool(chave) and not chave.startswith("tmp/") and _CHAVE.fullmatch(chave) is not None
+
+
+def _conferir(chave):
+    if not chave or _CHAVE.fullmatch(chave) is None:
+        raise ValueError(f"Chave de arquivo inválida: {chave!r}")
+    return chave
+
+
+# ====
+# Backends
+# ====
+class LocalBackend:
+    nome = "local"
+
+    def __init__(self, raiz):
+        self.raiz = os.path.abspath(raiz)
+        self.tmp = os.path.join(self.raiz, "tmp")
+        os.makedirs(self.tmp, exist_ok=True)
+
+    def caminho(self, chave):
+        return os.path.join(self.raiz, *_conferir(chave).split("/"))
+
+    def temporario(self):
+        # Mesmo sistema de arquivos do destino: guardar() é um rename atômico
+        return tempfile.NamedTemporaryFile(dir=self.tmp, delete=False)
+
+    def guardar(self, origem, chave, sha256, mime_type):
+        destino = self.caminho(chave)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(origem, destino)
+
+    def existe(self, chave):
+        return os.path.exists(self.caminho(chave))
+
+    def remover(self, chave):
+        try:
+            os.remove(self.caminho(chave))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def caminho_local(self, chave):
+        yield self.caminho(chave)
+
+    def listar(self):
+        """Gera (chave, modificado_em UTC) de todos os objetos, inclusive temporários em tmp/."""
+        for pasta, _, nomes in os.walk(self.raiz):
+            for nome in nomes:
+                caminho = os.path.join(pasta, nome)
+                try:
+                    mtime = os.path.getmtime(caminho)
+                except FileNotFoundError:
+                    continue
+                chave = os.path.relpath(caminho, self.raiz).replace(os.sep, "/")
+                yield chave, dt.datetime.fromtimestamp(mtime, dt.timezone.utc)
+
+    def resposta(self, chave, mime_type, etag, nome_download=None, intervalo=None):
+        # send_file trata If-None-Match/If-Range/Range com o ETag informado
+        caminho = self.caminho(chave)
+        if not os.path.isfile(caminho):
+            abort(404)
+        return send_file(caminho, mimetype=mime_type, download_name=nome_download, etag=etag, conditional=True)
+
+
+class S3Backend:
+    """Objetos num bucket compatível com S3, assinados com SigV4 usando só requests."""
+
+    nome = "s3"
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region="us-east-1"):
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key or ""
+        self.secret_key = secret_key or ""
+        self.region = region
+        self.session = requests.Session()
+        self.timeout = (5, 60)
+
+    def _url(self, chave):
+        return f"{self.endpoint}/{self.bucket}/{quote(_conferir(chave), safe='/')}"
+
+    def _assinar(self, metodo, url, payload_sha256, extras=None):
+        partes = urlsplit(url)
+        agora = dt.datetime.now(dt.timezone.utc)
+        amz_date = agora.strftime("%Y%m%dT%H%M%SZ")
+        dia = amz_date[:8]
+        headers = {
+            "host": partes.netloc,
+            "x-amz-content-sha256": payload_sha256,
+            "x-amz-date": amz_date,
+        }
+        headers.update({k.lower(): v for k, v in (extras or {}).items()})
+        assinados = sorted(headers)
+        canonica = "\n".join([
+            metodo, partes.path or "/", partes.query,
+            "".join(f"{k}:{str(headers[k]).strip()}\n" for k in assinados),
+            ";".join(assinados), payload_sha256,
+        ])
+        escopo = f"{dia}/{self.region}/s3/aws4_request"
+        texto = "\n".join(["AWS4-HMAC-SHA256", amz_date, escopo, hashlib.sha256(canonica.encode()).hexdigest()])
+        chave = ("AWS4" + self.secret_key).encode()
+        for parte in (dia, self.region, "s3", "aws4_request"):
+            chave = hmac.new(chave, parte.encode(), hashlib.sha256).digest()
+        assinatura = hmac.new(chave, texto.encode(), hashlib.sha256).hexdigest()
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{escopo}, "
+            f"SignedHeaders={';'.join(assinados)}, Signature={assinatura}"
+        )
+        del headers["host"]  # o requests preenche
+        return headers
+
+    def _chamar(self, metodo, chave, payload_sha256=hashlib.sha256(b"").hexdigest(), extras=None, **kwargs):
+        url = self._url(chave)
+        headers = self._assinar(metodo, url, payload_sha256, extras)
+        return self.session.request(metodo, url, headers=headers, timeout=self.timeout, **kwargs)
+
+    def listar(self):
+        """Gera (chave, modificado_em UTC) de todos os objetos do bucket (ListObjectsV2, 1000 por página)."""
+        ns = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+        token = None
+        while True:
+            params = {"list-type": "2"}
+            if token:
+                params["continuation-token"] = token
+            # Query canônica do SigV4: parâmetros ordenados e codificados
+            url = f"{self.endpoint}/{self.bucket}?" + urlencode(sorted(params.items()), quote_via=quote, safe="-_.~")
+            resp = self.session.get(url, headers=self._assinar("GET", url, hashlib.sha256(b"").hexdigest()),
+                                    timeout=self.timeout)
+            if resp.status_code != 200:
+                raise IOError(f"S3 LIST {self.bucket}: {resp.status_code} {resp.text[:200]}")
+            raiz = ElementTree.fromstring(resp.content)
+            for item in raiz.iter(f"{ns}Contents"):
+                modificado = dt.datetime.strptime(item.findtext(f"{ns}LastModified")[:19], "%Y-%m-%dT%H:%M:%S")
+                yield item.findtext(f"{ns}Key"), modificado.replace(tzinfo=dt.timezone.utc)
+            token = raiz.findtext(f"{ns}NextContinuationToken")
+            if raiz.findtext(f"{ns}IsTruncated") != "true" or not token:
+                return
+
+    def temporario(self):
+        return tempfile.NamedTemporaryFile(delete=False)
+
+    def guardar(self, origem, chave, sha256, mime_type):
+        with open(origem, "rb") as f:
+            resp = self._chamar("PUT", chave, sha256, {"content-type": mime_type}, data=f)
+        if resp.status_code >= 300:
+            raise IOError(f"S3 PUT {chave}: {resp.status_code} {resp.text[:200]}")
+        os.remove(origem)
+
+    def existe(self, chave):
+        return self._chamar("HEAD", chave).status_code == 200
+
+    def remover(self, chave):
+        resp = self._chamar("DELETE", chave)
+        if resp.status_code >= 300 and resp.status_code != 404:
+            raise IOError(f"S3 DELETE {chave}: {resp.status_code}")
+
+    @contextmanager
+    def caminho_local(self, chave):
+        resp = self._chamar("GET", chave, stream=True)
+        if resp.status_code != 200:
+            raise FileNotFoundError(chave)
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(chave)[1])
+        try:
+            with tmp:
+                for bloco in resp.iter_content(BLOCO):
+                    tmp.write(bloco)
+            yield tmp.name
+        finally:
+            os.remove(tmp.name)
+
+    def resposta(self, chave, mime_type, etag, nome_download=None, intervalo=None):
+        # O Range vai direto para o S3, que devolve 206 + Content-Range
+        extras = {"range": intervalo} if intervalo else None
+        resp = self._chamar("GET", chave, extras=extras, stream=True)
+        if resp.status_code == 404:
+            abort(404)
+        if resp.status_code == 416:
+            abort(416)
+        if resp.status_code not in (200, 206):
+            abort(502)
+        headers = {"Accept-Ranges": "bytes"}
+        for nome in ("Content-Length", "Content-Range"):
+            if resp.headers.get(nome):
+                headers[nome] = resp.headers[nome]
+        if nome_download:
+            headers["Content-Disposition"] = f'inline; filename="{nome_download}"'
+        saida = Response(resp.iter_content(BLOCO), status=resp.status_code, mimetype=mime_type, headers=headers)
+        saida.set_etag(etag)
+        return saida
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if Config.STORAGE_BACKEND == "s3":
+                    _backend = S3Backend(
+                        Config.S3_ENDPOINT_URL, Config.S3_BUCKET,
+                        Config.S3_ACCESS_KEY, Config.S3_SECRET_KEY, Config.S3_REGION,
+                    )
+                else:
+                    _backend = LocalBackend(Config.STORAGE_LOCAL_DIR)
+    return _backend
+
+
+# ====
+# API
+# ====
+def salvar(cur, stream, nome_original=None, mime_type=None):
+    """Grava o conteúdo de `stream` e registra em arquivos. Retorna Arquivo.
+
+    Quem chama grava a chave na tabela de destino e faz o commit; se a
+    transação falhar, o objeto fica sem registro e a limpeza de órfãos o remove.
+    """
+    backend = get_backend()
+    sha = hashlib.sha256()
+    tamanho = 0
+    inicio = b""
+    tmp = backend.temporario()
+    try:
+        with tmp:
+            while True:
+                bloco = stream.read(BLOCO)
+                if not bloco:
+                    break
+                if len(inicio) < 16:
+                    inicio += bloco[:16 - len(inicio)]
+                sha.update(bloco)
+                tmp.write(bloco)
+                tamanho += len(bloco)
+
+        sha256 = sha.hexdigest()
+        mime = detectar_mime(inicio, nome_original, mime_type)
+        cur.execute("""
+            INSERT INTO arquivos (sha256, chave, tamanho, mime_type, nome_original, backend)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (sha256) DO UPDATE SET ultimo_uso = CURRENT_TIMESTAMP
+            RETURNING chave, mime_type, (xmax = 0) AS novo
+        """, (sha256, chave_para(sha256, mime), tamanho, mime, nome_original, backend.nome))
+        row = cur.fetchone()
+
+        if row["novo"] or not backend.existe(row["chave"]):
+            backend.guardar(tmp.name, row["chave"], sha256, row["mime_type"])
+        GRAVADOS.inc(resultado="novo" if row["novo"] else "duplicado")
+        BYTES.inc(tamanho)
+        return Arquivo(sha256, row["chave"], tamanho, row["mime_type"], row["novo"])
+    finally:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+
+
+def salvar_caminho(cur, caminho, nome_original=None):
+    with open(caminho, "rb") as f:
+        return salvar(cur, f, nome_original or os.path.basename(caminho))
+
+
+def caminho_local(chave):
+    """Context manager com um caminho no disco para ler o arquivo (baixa do S3 se preciso)."""
+    return get_backend().caminho_local(chave)
+
+
+def migrar_legados(conn):
+    """Copia arquivos do esquema antigo para o armazenamento e troca os nomes pelas chaves."""
+    cur = conn.cursor()
+    migrados = faltando = 0
+    try:
+        for pasta, colunas in PASTAS_LEGADAS.items():
+            for tabela, coluna in colunas:
+                cur.execute(
+                    f"SELECT id, {coluna} AS nome FROM {tabela} "
+                    f"WHERE {coluna} IS NOT NULL AND position('/' in {coluna}) = 0"
+                )
+                for row in cur.fetchall():
+                    caminho = os.path.join(Config.UPLOAD_FOLDER, pasta, row["nome"])
+                    if not os.path.isfile(caminho):
+                        faltando += 1
+                        logging.warning("Arquivo legado não encontrado: %s", caminho)
+                        continue
+                    arquivo = salvar_caminho(cur, caminho, row["nome"])
+                    extra = ", variantes = NULL" if tabela == "moto_imagens" else ""
+                    cur.execute(f"UPDATE {tabela} SET {coluna} = %s{extra} WHERE id = %s", (arquivo.chave, row["id"]))
+                    conn.commit()
+                    migrados += 1
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return migrados, faltando
+
+
+# ====
+# Limpeza de órfãos
+# ====
+def _referenciadas_sql():
+    # Chaves em uso: colunas simples + todas as variantes das fotos (JSON {nome: {jpeg, webp, ...}})
+    partes = [f"SELECT {coluna} FROM {tabela} WHERE {coluna} IS NOT NULL" for tabela, coluna in REFERENCIAS]
+    partes.append("""
+        SELECT v #>> '{}' FROM moto_imagens,
+               jsonb_path_query(variantes, '$.*.* ? (@.type() == "string")') AS v
+        WHERE variantes IS NOT NULL
+    """)
+    return " UNION ".join(partes)
+
+
+def limpar_orfaos(conn, carencia_horas=None, simular=False):
+    """Apaga arquivos que nenhuma tabela referencia e objetos do backend sem linha em arquivos.
+
+    Só entra o que está parado há mais de `carencia_horas` (ultimo_uso, ou a
+    data do objeto): um upload em andamento grava o objeto e a linha antes do
+    commit que grava a referência. Cada linha é apagada na mesma transação em
+    que o objeto é removido; um salvar() concorrente do mesmo conteúdo espera
+    o commit e regrava o objeto. Retorna {"registrados", "soltos", "bytes"}.
+    """
+    carencia = dt.timedelta(hours=Config.ORFAOS_CARENCIA_HORAS if carencia_horas is None else carencia_horas)
+    backend = get_backend()
+    resultado = {"registrados": 0, "soltos": 0, "bytes": 0}
+    cur = conn.cursor()
+    try:
+        # 1) Linhas de arquivos sem referência
+        cur.execute(f"""
+            SELECT a.sha256, a.chave, a.tamanho FROM arquivos a
+            WHERE COALESCE(a.ultimo_uso, a.created_at) < CURRENT_TIMESTAMP - %s
+              AND a.chave NOT IN ({_referenciadas_sql()})
+        """, (carencia,))
+        for row in cur.fetchall():
+            if simular:
+                resultado["registrados"] += 1
+                resultado["bytes"] += row["tamanho"]
+                continue
+            # Reconfere sob lock da linha: pode ter ganhado referência ou uso desde a listagem
+            cur.execute(f"""
+                DELETE FROM arquivos
+                WHERE sha256 = %s AND COALESCE(ultimo_uso, created_at) < CURRENT_TIMESTAMP - %s
+                  AND chave NOT IN ({_referenciadas_sql()})
+                RETURNING chave
+            """, (row["sha256"], carencia))
+            if cur.fetchone():
+                backend.remover(row["chave"])
+                conn.commit()
+                resultado["registrados"] += 1
+                resultado["bytes"] += row["tamanho"]
+                REMOVIDOS.inc(origem="registro")
+            else:
+                conn.rollback()
+
+        # 2) Objetos sem linha (transação do upload falhou depois de guardar, temporários esquecidos)
+        limite = dt.datetime.now(dt.timezone.utc) - carencia
+        antigos = [chave for chave, modificado in backend.listar() if modificado < limite and _CHAVE.fullmatch(chave)]
+        for inicio in range(0, len(antigos), 1000):
+            lote = antigos[inicio:inicio + 1000]
+            cur.execute("SELECT chave FROM arquivos WHERE chave = ANY(%s)", (lote,))
+            registradas = {r["chave"] for r in cur.fetchall()}
+            conn.rollback()
+            for chave in lote:
+                if chave in registradas:
+                    continue
+                if not simular:
+                    backend.remover(chave)
+                    REMOVIDOS.inc(origem="solto")
+                resultado["soltos"] += 1
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return resultado
@@ -0,0 +1,178 @@
+import logging
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentacao
+import metrics
+from config import Config
+
+# Cliente HTTP único para a API do Asaas.
+#
+# Uma Session por processo com pool de conexões keep-alive (sem novo handshake
+# TLS a cada chamada), timeouts consistentes, retry com backoff exponencial
+# para chamadas idempotentes e um token bucket compartilhado por todos os
+# chamadores do worker. Cada chamada alimenta o histograma asaas_request_seconds.
+
+RETRY_STATUS = {429, 502, 503, 504}
+IDEMPOTENTES = {"GET", "HEAD", "PUT", "DELETE"}
+
+LATENCIA = metrics.histogram(
+    "asaas_request_seconds", "Latência das chamadas ao Asaas por endpoint",
+    ("method", "endpoint", "status"),
+)
+RETRIES = metrics.counter("asaas_retries_total", "Novas tentativas de chamadas ao Asaas", ("method", "endpoint"))
+
+
+class AsaasError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"Asaas respondeu {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class RateLimiter:
+    """Token bucket: no máximo `rate` requisições/s, com rajadas de até `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self._tokens = self.burst
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (agora - self._ultimo) * self.rate)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.rate
+            time.sleep(espera)
+
+
+# Compartilhado por todas as instâncias do cliente no processo
+limiter = RateLimiter(Config.ASAAS_RATE_LIMIT)
+
+_ID_SEGMENTO = re.compile(r"^[a-z]{2,4}_\w+$|\d")
+
+
+def _endpoint(path):
+    # /subscriptions/sub_abc123/cancel -> /subscriptions/{id}/cancel (cardinalidade baixa nas métricas)
+    partes = [("{id}" if _ID_SEGMENTO.search(p) else p) for p in path.split("?")[0].split("/")]
+    return "/".join(partes) or "/"
+
+
+class AsaasClient:
+    def __init__(self, base_url=None, api_key=None, timeout=None, retries=None, backoff=None):
+        self.base_url = (base_url or Config.ASAAS_BASE_URL).rstrip("/")
+        self.timeout = timeout or (Config.ASAAS_CONNECT_TIMEOUT, Config.ASAAS_READ_TIMEOUT)
+        self.retries = Config.ASAAS_RETRIES if retries is None else retries
+        self.backoff = Config.ASAAS_BACKOFF if backoff is None else backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=Config.ASAAS_POOL_MAXSIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "accept": "application/json",
+            "access_token": api_key if api_key is not None else (Config.ASAAS_API_KEY or ""),
+        })
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        """Faz a chamada e devolve o requests.Response (quem chama decide o que é erro)."""
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENTES
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = _endpoint(path)
+        tentativas = self.retries + 1 if idempotent else 1
+
+        for tentativa in range(tentativas):
+            limiter.acquire()
+            inicio = time.perf_counter()
+            try:
+                resp = self.session.request(method, self.base_url + path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                instrumentacao.somar("asaas", time.perf_counter() - inicio)
+                LATENCIA.observe(time.perf_counter() - inicio, method=method, endpoint=endpoint, status="erro")
+                if tentativa + 1 >= tentativas:
+                    raise
+                espera = self.backoff * (2 ** tentativa)
+            else:
+                instrumentacao.somar("asaas", time.perf_counter() - inicio)
+                LATENCIA.observe(time.perf_counter() - inicio, method=method, endpoint=endpoint, status=resp.status_code)
+                if resp.status_code not in RETRY_STATUS or tentativa + 1 >= tentativas:
+                    return resp
+                espera = _retry_after(resp) or self.backoff * (2 ** tentativa)
+
+            RETRIES.inc(method=method, endpoint=endpoint)
+            logging.warning("Asaas %s %s: nova tentativa em %.1fs", method, endpoint, espera)
+            time.sleep(espera)
+
+    def get(self, path, params=None, **kwargs):
+        return self.request("GET", path, params=params, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        return self.request("POST", path, json=json, **kwargs)
+
+    def put(self, path, json=None, **kwargs):
+        return self.request("PUT", path, json=json, **kwargs)
+
+    def paginate(self, path, params=None, limit=100):
+        """Gera todos os itens de uma listagem do Asaas, seguindo offset/hasMore."""
+        params = dict(params or {}, limit=limit)
+        offset = 0
+        while True:
+            params["offset"] = offset
+            resp = self.get(path, params=params)
+            if resp.status_code != 200:
+                raise AsaasError(resp.status_code, resp.text)
+            data = resp.json()
+            itens = data.get("data", []) if isinstance(data, dict) else []
+            yield from itens
+            if not itens or not data.get("hasMore"):
+                return
+            offset += len(itens)
+
+
+def _retry_after(resp):
+    try:
+        return min(float(resp.headers.get("Retry-After", "")), 60.0)
+    except ValueError:
+        return None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AsaasClient()
+    return _client
+
+
+def get(path, params=None, **kwargs):
+    return get_client().get(path, params=params, **kwargs)
+
+
+def post(path, json=None, **kwargs):
+    return get_client().post(path, json=json, **kwargs)
+
+
+def put(path, json=None, **kwargs):
+    return get_client().put(path, json=json, **kwargs)
+
+
+def paginate(path, params=None, limit=100):
+    return get_client().paginate(path, params=params, limit=limit)
@@ -0,0 +1,264 @@
+import logging
+import time
+
+from psycopg2.extras import Json
+
+import asaas_client
+import consumidor
+import metrics
+from config import Config
+from database import get_db_connection
+
+# Outbox das assinaturas no Asaas.
+#
+# Criar, editar e cancelar locação gravam a mudança local e uma linha em
+# asaas_outbox na mesma transação, e o request responde sem esperar o Asaas.
+# Um worker (thread do worker web, que sobe no boot com app.iniciar_threads, ou
+# `flask asaas-outbox`) envia as operações uma por transação, em ordem por
+# locação: só a pendente mais antiga de cada locação é elegível, como na fila
+# do webhook. As rotas ainda acordam a thread depois do commit.
+#
+# A linha guarda só o tipo da operação; o corpo é montado do estado atual da
+# locação no envio, então edições seguidas convergem para o último estado.
+# Criar usa externalReference "locacao:<id>" como chave de idempotência: antes
+# de cada tentativa procura uma assinatura com essa referência (a anterior pode
+# ter criado e caído antes do commit) e só cria se não achar. Atualizar e
+# cancelar já são idempotentes.
+#
+# Rede, 429 e 5xx voltam com backoff exponencial; outros 4xx (dados recusados
+# pelo Asaas) e o fim das tentativas deixam a operação DEAD, que aparece na
+# tela da locação com a opção de reenviar.
+
+CRIAR, ATUALIZAR, CANCELAR = "CRIAR", "ATUALIZAR", "CANCELAR"
+
+ENVIOS = metrics.counter(
+    "asaas_outbox_envios_total", "Operações do outbox enviadas ao Asaas, por resultado", ("operacao", "resultado")
+)
+ATRASO = metrics.histogram(
+    "asaas_outbox_atraso_segundos", "Tempo entre gravar a operação e concluí-la no Asaas", ("operacao",),
+    buckets=(0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0),
+)
+
+
+class ErroPermanente(Exception):
+    """O Asaas recusou a operação (4xx): tentar de novo não resolve."""
+
+
+def referencia(locacao_id):
+    return f"locacao:{locacao_id}"
+
+
+def backoff(tentativas):
+    return consumidor.backoff(tentativas, Config.OUTBOX_BACKOFF_BASE)
+
+
+def enfileirar(cur, locacao_id, operacao):
+    """Grava a operação na transação de quem chama; depois do commit, chame garantir_worker_em_thread()."""
+    cur.execute("INSERT INTO asaas_outbox (locacao_id, operacao) VALUES (%s, %s)", (locacao_id, operacao))
+
+
+def reenviar(cur, locacao_id=None):
+    """Devolve à fila as operações DEAD (de uma locação ou todas). Retorna quantas."""
+    cur.execute("""
+        UPDATE asaas_outbox
+           SET status = 'PENDING', tentativas = 0, proxima_tentativa = CURRENT_TIMESTAMP, ultimo_erro = NULL
+         WHERE status = 'DEAD' AND (%(locacao)s::int IS NULL OR locacao_id = %(locacao)s)
+    """, {"locacao": locacao_id})
+    return cur.rowcount
+
+
+def pendencias(cur, locacao_id):
+    """Operações ainda não concluídas da locação (para a tela de edição)."""
+    cur.execute("""
+        SELECT id, operacao, status, tentativas, ultimo_erro, proxima_tentativa, created_at
+        FROM asaas_outbox
+        WHERE locacao_id = %s AND status <> 'DONE'
+        ORDER BY id
+    """, (locacao_id,))
+    return cur.fetchall()
+
+
+# ====
+# Envio
+# ====
+def _json(resp):
+    if resp.status_code in (200, 201):
+        return resp.json()
+    if resp.status_code in asaas_client.RETRY_STATUS or resp.status_code >= 500:
+        raise asaas_client.AsaasError(resp.status_code, resp.text)
+    raise ErroPermanente(f"Asaas respondeu {resp.status_code}: {resp.text[:1000]}")
+
+
+def _corpo(loc):
+    corpo = {
+        "value": float(loc["valor"]),
+        "cycle": loc["frequencia_pagamento"],  # 'WEEKLY' ou 'MONTHLY'
+        "nextDueDate": loc["data_inicio"].isoformat(),
+    }
+    if loc["data_fim"]:
+        corpo["endDate"] = loc["data_fim"].isoformat()
+    return corpo
+
+
+def _criar(cur, loc):
+    if loc["asaas_subscription_id"]:
+        return {"ignorada": "locação já tem assinatura"}
+    if loc["cancelado"]:
+        return {"ignorada": "locação cancelada antes do envio"}
+    if not loc["asaas_customer_id"]:
+        raise ErroPermanente("Cliente sem integração Asaas (asaas_id ausente)")
+
+    ref = referencia(loc["id"])
+    existentes = _json(asaas_client.get("/subscriptions", params={"externalReference": ref})).get("data") or []
+    existentes = [s for s in existentes if not s.get("deleted")]
+    if existentes:
+        assinatura = existentes[0]
+    else:
+        assinatura = _json(asaas_client.post("/subscriptions", json=dict(
+            _corpo(loc),
+            customer=loc["asaas_customer_id"],
+            billingType="BOLETO",
+            description=f"Locação moto {loc['moto_modelo']} - {loc['moto_placa']} ({loc['cliente_nome']})",
+            externalReference=ref,
+        )))
+    if not assinatura.get("id"):
+        raise RuntimeError(f"Resposta do Asaas sem id da assinatura: {assinatura}")
+
+    cur.execute(
+        "UPDATE locacoes SET asaas_subscription_id = %s WHERE id = %s AND asaas_subscription_id IS NULL",
+        (assinatura["id"], loc["id"]),
+    )
+    return {"assinatura": assinatura["id"], "reaproveitada": bool(existentes)}
+
+
+def _atualizar(cur, loc):
+    sid = loc["asaas_subscription_id"]
+    if not sid:
+        # A criação (pendente ou reenviada) já vai com o estado atual
+        return {"ignorada": "locação sem assinatura"}
+    if loc["cancelado"]:
+        return {"ignorada": "locação cancelada"}
+    corpo = _corpo(loc)
+    resp = asaas_client.post(f"/subscriptions/{sid}", json=corpo, idempotent=True)
+    if resp.status_code not in (200, 201) and resp.status_code not in asaas_client.RETRY_STATUS:
+        resp = asaas_client.put(f"/subscriptions/{sid}", json=corpo)
+    _json(resp)
+    return {"assinatura": sid}
+
+
+def _cancelar(cur, loc):
+    sid = loc["asaas_subscription_id"]
+    if not sid:
+        return {"ignorada": "locação sem assinatura"}
+    resp = asaas_client.post(f"/subscriptions/{sid}/cancel", idempotent=True)
+    if resp.status_code == 404:
+        return {"ignorada": "assinatura não existe no Asaas"}
+    _json(resp)
+    return {"assinatura": sid}
+
+
+OPERACOES = {CRIAR: _criar, ATUALIZAR: _atualizar, CANCELAR: _cancelar}
+
+
+def processar_um():
+    """Envia a próxima operação elegível numa transação própria. Retorna False se não havia nenhuma."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        # Cabeça de fila de cada locação; SKIP LOCKED deixa vários workers em paralelo
+        cur.execute("""
+            SELECT o.id, o.locacao_id, o.operacao, o.tentativas,
+                   EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - o.created_at) AS idade
+            FROM asaas_outbox o
+            WHERE o.status = 'PENDING'
+              AND o.proxima_tentativa <= CURRENT_TIMESTAMP
+              AND NOT EXISTS (
+                  SELECT 1 FROM asaas_outbox a
+                  WHERE a.locacao_id = o.locacao_id AND a.status = 'PENDING' AND a.id < o.id
+              )
+            ORDER BY o.id
+            LIMIT 1
+            FOR UPDATE OF o SKIP LOCKED
+        """)
+        op = cur.fetchone()
+        if op is None:
+            conn.commit()
+            return False
+
+        cur.execute("""
+            SELECT l.id, l.data_inicio, l.data_fim, l.valor, l.frequencia_pagamento, l.cancelado,
+                   l.asaas_subscription_id, c.asaas_id AS asaas_customer_id, c.nome AS cliente_nome,
+                   m.modelo AS moto_modelo, m.placa AS moto_placa
+            FROM locacoes l
+            JOIN clientes c ON c.id = l.cliente_id
+            JOIN motos m ON m.id = l.moto_id
+            WHERE l.id = %s
+        """, (op["locacao_id"],))
+        loc = cur.fetchone()
+
+        inicio = time.perf_counter()
+        cur.execute("SAVEPOINT asaas_outbox")
+        try:
+            resultado = OPERACOES[op["operacao"]](cur, loc) if loc else {"ignorada": "locação removida"}
+            cur.execute("RELEASE SAVEPOINT asaas_outbox")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT asaas_outbox")
+            tentativas = op["tentativas"] + 1
+            permanente = isinstance(e, ErroPermanente)
+            status = "DEAD" if permanente or tentativas >= Config.OUTBOX_MAX_TENTATIVAS else "PENDING"
+            cur.execute("""
+                UPDATE asaas_outbox
+                   SET status = %s, tentativas = %s, ultimo_erro = %s,
+                       proxima_tentativa = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                 WHERE id = %s
+            """, (status, tentativas, str(e)[:2000] if permanente else repr(e)[:2000], backoff(tentativas), op["id"]))
+            ENVIOS.inc(operacao=op["operacao"], resultado="dead" if status == "DEAD" else "retry")
+            nivel = logging.ERROR if status == "DEAD" else logging.WARNING
+            logging.log(nivel, "Outbox Asaas: %s da locação %s falhou (%s, tentativa %s): %s",
+                        op["operacao"], op["locacao_id"], status, tentativas, e)
+        else:
+            cur.execute("""
+                UPDATE asaas_outbox
+                   SET status = 'DONE', tentativas = tentativas + 1, ultimo_erro = NULL,
+                       resultado = %s, processado_em = CURRENT_TIMESTAMP
+                 WHERE id = %s
+            """, (Json(resultado), op["id"]))
+            ENVIOS.inc(operacao=op["operacao"], resultado="ok")
+            ATRASO.observe(float(op["idade"]) + time.perf_counter() - inicio, operacao=op["operacao"])
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def processar_pendentes(limite=None):
+    """Envia operações até a fila esvaziar (ou `limite`). Retorna quantas foram tentadas."""
+    total = 0
+    while (limite is None or total < limite) and processar_um():
+        total += 1
+    return total
+
+
+# ====
+# Worker
+# ====
+class Worker(consumidor.Worker):
+    """Laço do envio. Roda numa thread do próprio worker web ou via `flask asaas-outbox`."""
+
+    descricao = "envio do outbox do Asaas"
+
+    def __init__(self, intervalo=None):
+        super().__init__(processar_um, intervalo if intervalo is not None else Config.OUTBOX_POLL_INTERVAL)
+
+
+_thread = consumidor.ThreadPorProcesso("asaas-outbox", Worker)
+
+
+def garantir_worker_em_thread():
+    """Sobe (uma vez por processo) a thread de envio e a acorda."""
+    if Config.OUTBOX_WORKER_THREAD:
+        _thread.garantir()
@@ -0,0 +1,574 @@
+# benchmark.py
+# Benchmark reprodutível dos endpoints principais.
+#
+#   python benchmark.py seed --multiplicador 10 --limpar     # dados sintéticos (DB_* / DATABASE_URL)
+#   python benchmark.py run --requisicoes 300 --concorrencia 8
+#   python benchmark.py run --url http://127.0.0.1:8000      # contra um servidor já no ar (gunicorn)
+#   python benchmark.py compare benchmarks/abc1234.json benchmarks/def5678.json
+#   python benchmark.py perfis --latencia-asaas 1 --perfil sync --perfil gthread --perfil gevent
+#
+# O run sobe o fake_asaas numa thread e aponta ASAAS_BASE_URL para ele, então
+# nada sai para o sandbox. Sem --url as requisições passam pelo test client do
+# Flask (sem rede, mede só a aplicação + banco); com --url vão por HTTP com
+# login admin/admin. O resultado (p50/p95/p99, throughput, erros por endpoint,
+# commit e tamanho da base) vai para benchmarks/<commit>.json.
+#
+# O perfis sobe o gunicorn com cada perfil de gunicorn.conf.py e mede uma
+# página rápida enquanto outros clientes ficam presos em rotas que esperam o
+# Asaas (fake com latência). Resultado em benchmarks/perfis-<commit>.json.
+import argparse
+import datetime as dt
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+ENDPOINTS = ["/", "/locacoes/", "/clientes/", "/motos/", "/webhook/asaas"]
+
+# Por unidade de --multiplicador
+BASE = {"clientes": 500, "motos": 500, "locacoes": 400}  # uma moto por locação, sem sobreposição
+BOLETOS_POR_LOCACAO = 52  # um ano de parcelas semanais
+
+TABELAS_BENCH = ("servicos_locacao", "boletos", "financeiro_mensal", "locacoes", "moto_imagens", "motos", "clientes")
+
+
+# ====
+# Base sintética
+# ====
+def seed(multiplicador, limpar=False, aplicar_schema=False):
+    from database import get_db_connection
+
+    n = {k: v * multiplicador for k, v in BASE.items()}
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        if aplicar_schema:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql"), encoding="utf-8") as f:
+                cur.execute(f.read())
+
+        cur.execute("SELECT COUNT(*) AS total FROM clientes")
+        if cur.fetchone()["total"] and not limpar:
+            raise SystemExit("A base já tem clientes; use --limpar para apagar tudo antes de popular.")
+        if limpar:
+            cur.execute(f"TRUNCATE {', '.join(TABELAS_BENCH)} RESTART IDENTITY CASCADE")
+
+        # Tudo via generate_series: determinístico e sem ida e volta por linha
+        cur.execute("""
+            INSERT INTO clientes (nome, email, telefone, cpf, endereco, asaas_id)
+            SELECT 'Cliente ' || (ARRAY['Ana','Bruno','Carla','Diego','Elaine','Fábio','Gabriela','Hugo'])[1 + i %% 8]
+                       || ' ' || (ARRAY['Silva','Souza','Oliveira','Santos','Lima','Costa'])[1 + i %% 6] || ' ' || i,
+                   'cliente' || i || '@exemplo.com',
+                   '(11) 9' || lpad((i * 7919 %% 100000000)::text, 8, '0'),
+                   regexp_replace(lpad(i::text, 11, '0'), '(\\d{3})(\\d{3})(\\d{3})(\\d{2})', '\\1.\\2.\\3-\\4'),
+                   'Rua ' || i || ', São Paulo',
+                   'cus_bench_' || i
+            FROM generate_series(1, %(clientes)s) i
+        """, n)
+        cur.execute("""
+            INSERT INTO motos (placa, modelo, ano, disponivel, created_at)
+            SELECT 'BEN' || lpad(i::text, 4, '0'),
+                   (ARRAY['CG 160','Fazer 250','Biz 125','Factor 150','PCX 160'])[1 + i %% 5],
+                   2015 + i %% 10,
+                   i > %(locacoes)s OR i %% 5 = 0,
+                   current_date - 400  -- frota já existia antes da locação mais antiga
+            FROM generate_series(1, %(motos)s) i
+        """, n)
+        cur.execute("""
+            INSERT INTO locacoes (cliente_id, moto_id, data_inicio, data_fim, cancelado, valor,
+                                  frequencia_pagamento, asaas_subscription_id, pagamento_status)
+            SELECT 1 + (i - 1) %% %(clientes)s,
+                   i,
+                   current_date - (i * 13 %% 365),
+                   CASE WHEN i %% 5 = 0 THEN current_date - (i * 13 %% 365) + (i %% 30) END,
+                   i %% 5 = 0,
+                   150 + (i %% 5) * 25,
+                   CASE WHEN i %% 4 = 0 THEN 'MONTHLY' ELSE 'WEEKLY' END,
+                   'sub_bench_' || i,
+                   'PENDING'
+            FROM generate_series(1, %(locacoes)s) i
+        """, n)
+        cur.execute("""
+            INSERT INTO boletos (locacao_id, asaas_payment_id, status, valor, valor_pago, boleto_url,
+                                 descricao, data_vencimento, data_pagamento)
+            SELECT l.id, 'pay_bench_' || l.id || '_' || p.n,
+                   CASE WHEN v.venc >= current_date THEN 'PENDING'
+                        WHEN (l.id + p.n) %% 7 = 0 THEN 'OVERDUE'
+                        ELSE 'RECEIVED' END,
+                   l.valor,
+                   CASE WHEN v.venc < current_date AND (l.id + p.n) %% 7 <> 0 THEN l.valor ELSE 0 END,
+                   'https://fake.asaas/b/' || l.id || '/' || p.n,
+                   'Parcela ' || (p.n + 1),
+                   v.venc,
+                   CASE WHEN v.venc < current_date AND (l.id + p.n) %% 7 <> 0 THEN v.venc END
+            FROM locacoes l
+            CROSS JOIN generate_series(0, %(boletos)s - 1) AS p(n)
+            CROSS JOIN LATERAL (
+                SELECT l.data_inicio + p.n * CASE WHEN l.frequencia_pagamento = 'MONTHLY' THEN 30 ELSE 7 END AS venc
+            ) v
+        """, dict(n, boletos=BOLETOS_POR_LOCACAO))
+        conn.commit()
+        cur.execute("ANALYZE")
+        conn.commit()
+        return contagens(cur)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def contagens(cur):
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM clientes) AS clientes, (SELECT COUNT(*) FROM motos) AS motos,
+               (SELECT COUNT(*) FROM locacoes) AS locacoes, (SELECT COUNT(*) FROM boletos) AS boletos
+    """)
+    return dict(cur.fetchone())
+
+
+def _eventos_webhook(quantidade, semente=42):
+    """Payloads PAYMENT_* para boletos existentes (o webhook real só aceita assinaturas conhecidas)."""
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT b.asaas_payment_id, l.asaas_subscription_id, b.valor, b.data_vencimento
+            FROM boletos b JOIN locacoes l ON l.id = b.locacao_id
+            WHERE l.asaas_subscription_id IS NOT NULL
+            ORDER BY b.id
+            LIMIT 2000
+        """)
+        boletos = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+    if not boletos:
+        return []
+
+    rnd = random.Random(semente)
+    # Cada evento com id próprio, como no Asaas: sem id, os repetidos cairiam na deduplicação
+    rodada = uuid.uuid4().hex[:12]
+    eventos = []
+    for n in range(quantidade):
+        b = rnd.choice(boletos)
+        evento, status = rnd.choice([
+            ("PAYMENT_RECEIVED", "RECEIVED"), ("PAYMENT_OVERDUE", "OVERDUE"), ("PAYMENT_UPDATED", "PENDING"),
+        ])
+        eventos.append({
+            "id": f"evt_bench_{rodada}_{n}",
+            "event": evento,
+            "payment": {
+                "id": b["asaas_payment_id"], "subscription": b["asaas_subscription_id"], "status": status,
+                "value": float(b["valor"] or 0), "netValue": float(b["valor"] or 0),
+                "dueDate": b["data_vencimento"].isoformat() if b["data_vencimento"] else None,
+                "paymentDate": dt.date.today().isoformat() if status == "RECEIVED" else None,
+            },
+        })
+    return eventos
+
+
+# ====
+# Execução
+# ====
+def _percentil(ordenados, p):
+    # Nearest-rank: sem interpolação, estável entre execuções
+    if not ordenados:
+        return None
+    k = max(0, min(len(ordenados), math.ceil(p / 100 * len(ordenados))) - 1)
+    return ordenados[k]
+
+
+def _resumo(tempos, erros, duracao):
+    ordenados = sorted(tempos)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+    return {
+        "requisicoes": len(tempos),
+        "erros": erros,
+        "throughput_rps": round(len(tempos) / duracao, 2) if duracao else None,
+        "p50_ms": ms(_percentil(ordenados, 50)),
+        "p95_ms": ms(_percentil(ordenados, 95)),
+        "p99_ms": ms(_percentil(ordenados, 99)),
+        "media_ms": ms(sum(ordenados) / len(ordenados)) if ordenados else None,
+        "max_ms": ms(ordenados[-1]) if ordenados else None,
+    }
+
+
+class _ClienteTeste:
+    """Test client do Flask já autenticado (um por thread)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        with self.client.session_transaction() as s:
+            s["_user_id"] = "1"
+            s["_fresh"] = True
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post_json(self, path, dados):
+        return self.client.post(path, json=dados).status_code
+
+
+class _ClienteHttp:
+    """Sessão HTTP contra um servidor já no ar, logada como admin/admin."""
+
+    def __init__(self, url):
+        import requests
+
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        resp = self.session.post(self.url + "/auth/login", data={"email": "admin", "senha": "admin"}, allow_redirects=False)
+        if resp.status_code not in (302, 303):
+            raise SystemExit(f"Login em {self.url} falhou (HTTP {resp.status_code}).")
+
+    def get(self, path):
+        return self.session.get(self.url + path, allow_redirects=False).status_code
+
+    def post_json(self, path, dados):
+        return self.session.post(self.url + path, json=dados, allow_redirects=False).status_code
+
+
+def _medir_endpoint(fabrica, path, requisicoes, concorrencia, aquecimento, eventos):
+    clientes = [fabrica() for _ in range(concorrencia)]
+    fila = iter(range(requisicoes))
+    fila_lock = threading.Lock()
+    tempos, erros = [], [0]
+    resultado_lock = threading.Lock()
+
+    def chamar(cliente, i):
+        if path.startswith("/webhook/"):
+            return cliente.post_json(path, eventos[i % len(eventos)] if eventos else {})
+        return cliente.get(path)
+
+    for i in range(aquecimento):
+        chamar(clientes[0], i)
+
+    def trabalhador(cliente):
+        while True:
+            with fila_lock:
+                i = next(fila, None)
+            if i is None:
+                return
+            inicio = time.perf_counter()
+            try:
+                status = chamar(cliente, i)
+            except Exception:
+                status = None
+            decorrido = time.perf_counter() - inicio
+            with resultado_lock:
+                tempos.append(decorrido)
+                if status is None or status >= 400:
+                    erros[0] += 1
+
+    threads = [threading.Thread(target=trabalhador, args=(c,)) for c in clientes]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return _resumo(tempos, erros[0], time.perf_counter() - inicio)
+
+
+def iniciar_fake_asaas(porta, latencia=0.0):
+    """Sobe o fake_asaas numa thread e devolve a base URL."""
+    from werkzeug.serving import make_server
+
+    import fake_asaas
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # uma linha por chamada afogaria o resultado
+    servidor = make_server("127.0.0.1", porta, fake_asaas.create_app(latencia=latencia), threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_port}/api/v3"
+
+
+def _commit():
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+        sujo = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "."], stderr=subprocess.DEVNULL) != 0
+        return sha + ("-dirty" if sujo else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+def run(args):
+    # Antes de importar o app: Config lê o ambiente na importação
+    os.environ["ASAAS_BASE_URL"] = iniciar_fake_asaas(args.porta_asaas, args.latencia_asaas)
+    os.environ.setdefault("ASAAS_API_KEY", "fake")
+    if args.sem_cache:
+        os.environ["DASHBOARD_CACHE_TTL"] = "0"
+    os.environ.setdefault("DB_POOL_MAX", str(max(10, args.concorrencia + 2)))
+    os.environ.setdefault("AGENDADOR_THREAD", "0")  # conciliação rodando no meio da medição distorce tudo
+
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        base = contagens(cur)
+    finally:
+        cur.close()
+        conn.close()
+    eventos = _eventos_webhook(args.requisicoes + args.aquecimento)
+
+    if args.url:
+        fabrica = lambda: _ClienteHttp(args.url)  # noqa: E731
+    else:
+        import app as aplicacao
+        fabrica = lambda: _ClienteTeste(aplicacao.app)  # noqa: E731
+
+    resultados = {}
+    for path in args.endpoint or ENDPOINTS:
+        resultados[path] = _medir_endpoint(fabrica, path, args.requisicoes, args.concorrencia, args.aquecimento, eventos)
+        r = resultados[path]
+        print(f"{path:<20} {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']:>8} ms  "
+              f"p95 {r['p95_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  erros {r['erros']}")
+
+    saida = {
+        "commit": _commit(),
+        "data": dt.datetime.now().isoformat(timespec="seconds"),
+        "modo": args.url or "test_client",
+        "python": platform.python_version(),
+        "requisicoes": args.requisicoes,
+        "concorrencia": args.concorrencia,
+        "cache_dashboard": not args.sem_cache,
+        "latencia_asaas": args.latencia_asaas,
+        "base": base,
+        "endpoints": resultados,
+    }
+    caminho = args.saida or os.path.join("benchmarks", f"{saida['commit']}.json")
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(saida, f, indent=2, ensure_ascii=False)
+    print(f"Resultado salvo em {caminho}")
+    return saida
+
+
+# ====
+# Perfis do gunicorn com o Asaas lento
+# ====
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _subir_gunicorn(perfil, workers, ambiente):
+    """Sobe `gunicorn -c gunicorn.conf.py` com o perfil e espera responder. Devolve (processo, url)."""
+    import requests
+
+    porta = _porta_livre()
+    env = dict(os.environ, GUNICORN_PERFIL=perfil, GUNICORN_WORKERS=str(workers), **ambiente)
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{porta}", "app:app"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    url = f"http://127.0.0.1:{porta}"
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise SystemExit(f"gunicorn ({perfil}) saiu com código {processo.returncode}:\n{processo.stderr.read()[-2000:]}")
+        try:
+            requests.get(url + "/auth/login", timeout=1)
+            return processo, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    processo.kill()
+    raise SystemExit(f"gunicorn ({perfil}) não respondeu em 30s")
+
+
+def _carga(clientes, caminhos, total=None, parar=None):
+    """Cada cliente numa thread: `total` requisições ao todo, ou até `parar` ser sinalizado."""
+    contador = iter(range(total)) if total is not None else itertools.count()
+    trava = threading.Lock()
+    tempos, erros = [], [0]
+
+    def trabalhador(cliente):
+        while parar is None or not parar.is_set():
+            with trava:
+                i = next(contador, None)
+            if i is None:
+                return
+            inicio = time.perf_counter()
+            try:
+                status = cliente.get(caminhos[i % len(caminhos)])
+            except Exception:
+                status = None
+            with trava:
+                tempos.append(time.perf_counter() - inicio)
+                if status is None or status >= 400:
+                    erros[0] += 1
+
+    threads = [threading.Thread(target=trabalhador, args=(c,)) for c in clientes]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    return threads, lambda: _resumo(tempos, erros[0], time.perf_counter() - inicio)
+
+
+def perfis(args):
+    os.environ.setdefault("AGENDADOR_THREAD", "0")
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        base = contagens(cur)
+        cur.execute("""
+            SELECT id FROM locacoes WHERE asaas_subscription_id IS NOT NULL AND cancelado = FALSE
+            ORDER BY id LIMIT %s
+        """, (max(args.lentas * 4, 1),))
+        lentos = [f"/locacoes/{r['id']}/sincronizar_boletos" for r in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+    if not lentos:
+        raise SystemExit("Nenhuma locação com assinatura; rode `python benchmark.py seed` antes.")
+
+    ambiente = {
+        "ASAAS_BASE_URL": iniciar_fake_asaas(args.porta_asaas, args.latencia_asaas),
+        "ASAAS_API_KEY": "fake",
+        "ASAAS_RATE_LIMIT": "1000",  # mede o servidor, não o token bucket
+        "AGENDADOR_THREAD": "0",
+        "WEBHOOK_WORKER_THREAD": "0",
+    }
+    resultados = {}
+    for perfil in args.perfil or ["sync", "gthread"]:
+        processo, url = _subir_gunicorn(perfil, args.workers, ambiente)
+        try:
+            # Todos logados antes da carga: com sync o login também ficaria na fila
+            clientes_lentos = [_ClienteHttp(url) for _ in range(args.lentas)]
+            clientes_rapidos = [_ClienteHttp(url) for _ in range(args.concorrencia)]
+            for _ in range(args.aquecimento):
+                clientes_rapidos[0].get(args.rapido)
+
+            parar = threading.Event()
+            threads_lentas, resumo_lento = _carga(clientes_lentos, lentos, parar=parar)
+            time.sleep(min(args.latencia_asaas, 2.0))  # deixa as rotas lentas ocuparem os workers
+            threads_rapidas, resumo_rapido = _carga(clientes_rapidos, [args.rapido], total=args.requisicoes)
+            for t in threads_rapidas:
+                t.join()
+            rapido = resumo_rapido()
+            parar.set()
+            for t in threads_lentas:
+                t.join()
+            resultados[perfil] = {"rapido": rapido, "lento": resumo_lento()}
+        finally:
+            processo.send_signal(signal.SIGTERM)
+            try:
+                processo.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+
+        r, l = resultados[perfil]["rapido"], resultados[perfil]["lento"]
+        print(f"{perfil:<8} {args.rapido}: {r['throughput_rps']:>7} req/s  p50 {r['p50_ms']:>8} ms  "
+              f"p95 {r['p95_ms']:>8} ms  erros {r['erros']}  |  Asaas: {l['throughput_rps']:>6} req/s  "
+              f"p50 {l['p50_ms']:>8} ms  erros {l['erros']}")
+
+    saida = {
+        "commit": _commit(),
+        "data": dt.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "workers": args.workers,
+        "latencia_asaas": args.latencia_asaas,
+        "clientes_lentos": args.lentas,
+        "concorrencia": args.concorrencia,
+        "rapido": args.rapido,
+        "base": base,
+        "perfis": resultados,
+    }
+    caminho = args.saida or os.path.join("benchmarks", f"perfis-{saida['commit']}.json")
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(saida, f, indent=2, ensure_ascii=False)
+    print(f"Resultado salvo em {caminho}")
+    return saida
+
+
+def compare(antes_path, depois_path, tolerancia):
+    """Compara dois resultados; sai com código 1 se algum p95 piorou além da tolerância (%)."""
+    with open(antes_path, encoding="utf-8") as f:
+        antes = json.load(f)
+    with open(depois_path, encoding="utf-8") as f:
+        depois = json.load(f)
+    if antes.get("base") != depois.get("base"):
+        print(f"⚠️  Bases diferentes: {antes.get('base')} x {depois.get('base')}")
+
+    regressoes = 0
+    print(f"{'endpoint':<20} {'p95 antes':>10} {'p95 depois':>11} {'var':>8} {'req/s antes':>12} {'req/s depois':>13}")
+    for path, d in depois["endpoints"].items():
+        a = antes["endpoints"].get(path)
+        if not a or not a.get("p95_ms") or d.get("p95_ms") is None:
+            continue
+        variacao = (d["p95_ms"] - a["p95_ms"]) / a["p95_ms"] * 100
+        marca = ""
+        if variacao > tolerancia:
+            regressoes += 1
+            marca = "  ❌ regressão"
+        print(f"{path:<20} {a['p95_ms']:>10} {d['p95_ms']:>11} {variacao:>+7.1f}% "
+              f"{a['throughput_rps']:>12} {d['throughput_rps']:>13}{marca}")
+    return regressoes
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Benchmark dos endpoints principais do MotoRental")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_seed = sub.add_parser("seed", help="Popula a base com dados sintéticos")
+    p_seed.add_argument("--multiplicador", type=int, default=1,
+                        help=f"Escala da base (1 = {BASE['clientes']} clientes, {BASE['locacoes']} locações, "
+                             f"{BASE['locacoes'] * BOLETOS_POR_LOCACAO} boletos)")
+    p_seed.add_argument("--limpar", action="store_true", help="Apaga clientes/motos/locações/boletos antes (TRUNCATE)")
+    p_seed.add_argument("--schema", action="store_true", help="Aplica schema.sql antes de popular")
+
+    p_run = sub.add_parser("run", help="Mede os endpoints e grava o JSON")
+    p_run.add_argument("--requisicoes", type=int, default=200, help="Requisições medidas por endpoint")
+    p_run.add_argument("--concorrencia", type=int, default=4, help="Clientes simultâneos")
+    p_run.add_argument("--aquecimento", type=int, default=10, help="Requisições descartadas antes de medir")
+    p_run.add_argument("--endpoint", action="append", help="Mede só este caminho (pode repetir)")
+    p_run.add_argument("--url", help="Servidor já no ar (ex.: http://127.0.0.1:8000); sem isso usa o test client")
+    p_run.add_argument("--sem-cache", action="store_true", help="Dashboard sem cache (DASHBOARD_CACHE_TTL=0)")
+    p_run.add_argument("--porta-asaas", type=int, default=5055, help="Porta do fake_asaas (0 = qualquer livre)")
+    p_run.add_argument("--latencia-asaas", type=float, default=0.0, help="Atraso artificial do fake_asaas (s)")
+    p_run.add_argument("--saida", help="Arquivo JSON (padrão: benchmarks/<commit>.json)")
+
+    p_cmp = sub.add_parser("compare", help="Compara dois resultados JSON")
+    p_cmp.add_argument("antes")
+    p_cmp.add_argument("depois")
+    p_cmp.add_argument("--tolerancia", type=float, default=10.0, help="Piora aceitável do p95, em %%")
+
+    p_perfis = sub.add_parser("perfis", help="Compara perfis do gunicorn com o Asaas lento")
+    p_perfis.add_argument("--perfil", action="append", choices=("sync", "gthread", "gevent"),
+                          help="Perfil a medir (pode repetir; padrão: sync e gthread)")
+    p_perfis.add_argument("--workers", type=int, default=2, help="Workers do gunicorn (fixo, para comparar)")
+    p_perfis.add_argument("--latencia-asaas", type=float, default=1.0, help="Atraso do fake_asaas por chamada (s)")
+    p_perfis.add_argument("--lentas", type=int, default=8, help="Clientes presos em rotas que chamam o Asaas")
+    p_perfis.add_argument("--rapido", default="/motos/", help="Página medida enquanto isso")
+    p_perfis.add_argument("--requisicoes", type=int, default=100, help="Requisições medidas na página rápida")
+    p_perfis.add_argument("--concorrencia", type=int, default=4, help="Clientes da página rápida")
+    p_perfis.add_argument("--aquecimento", type=int, default=5, help="Requisições descartadas antes de medir")
+    p_perfis.add_argument("--porta-asaas", type=int, default=0, help="Porta do fake_asaas (0 = qualquer livre)")
+    p_perfis.add_argument("--saida", help="Arquivo JSON (padrão: benchmarks/perfis-<commit>.json)")
+
+    args = parser.parse_args()
+    if args.comando == "seed":
+        print(json.dumps(seed(args.multiplicador, args.limpar, args.schema)))
+    elif args.comando == "run":
+        run(args)
+    elif args.comando == "perfis":
+        perfis(args)
+    else:
+        sys.exit(1 if compare(args.antes, args.depois, args.tolerancia) else 0)
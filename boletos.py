@@ -0,0 +1,85 @@
+from collections import namedtuple
+
+from psycopg2.extras import execute_values
+
+# Persistência de boletos (payments do Asaas), compartilhada pelo webhook e
+# pela sincronização manual. Grava em lote com INSERT ... ON CONFLICT, então
+# escritores concorrentes no mesmo asaas_payment_id não disputam mais o
+# SELECT-then-INSERT, e 100 pagamentos custam 1 ou 2 idas ao banco.
+# Os totais financeiros (locacoes.valor_pago, financeiro_mensal) são mantidos
+# pelos triggers de boletos; ver financeiro.py.
+
+PAGOS = ("RECEIVED", "CONFIRMED", "RECEIVED_IN_CASH")
+
+PAGE_SIZE = 100
+
+Resultado = namedtuple("Resultado", "inseridos atualizados locacoes sem_locacao")
+
+_UPSERT_SQL = """
+    INSERT INTO boletos (locacao_id, asaas_payment_id, status, valor, valor_pago,
+                         boleto_url, descricao, data_vencimento, data_pagamento)
+    VALUES %s
+    ON CONFLICT (asaas_payment_id) DO UPDATE
+       SET status=EXCLUDED.status, valor=EXCLUDED.valor, valor_pago=EXCLUDED.valor_pago,
+           boleto_url=EXCLUDED.boleto_url, descricao=EXCLUDED.descricao,
+           data_vencimento=EXCLUDED.data_vencimento, data_pagamento=EXCLUDED.data_pagamento
+    RETURNING locacao_id, (xmax = 0) AS inserido
+"""
+
+
+def resolver_locacoes(cur, subscription_ids, cache=None):
+    """Mapeia asaas_subscription_id -> locacao_id numa única consulta, reaproveitando o cache."""
+    cache = {} if cache is None else cache
+    faltando = [s for s in set(subscription_ids) if s and s not in cache]
+    if faltando:
+        cur.execute(
+            "SELECT id, asaas_subscription_id FROM locacoes WHERE asaas_subscription_id = ANY(%s)",
+            (faltando,),
+        )
+        for row in cur.fetchall():
+            cache[row["asaas_subscription_id"]] = row["id"]
+        for s in faltando:
+            cache.setdefault(s, None)
+    return cache
+
+
+def salvar_boletos(cur, payments, locacao_id=None, cache=None):
+    """Insere/atualiza uma lista de payments do Asaas.
+
+    Sem locacao_id, a locação é descoberta pela assinatura de cada payment;
+    payments cuja assinatura não tem locação local voltam em sem_locacao e
+    não são gravados.
+    """
+    # O mesmo payment duas vezes no lote quebraria o ON CONFLICT; vale o último
+    por_id = {}
+    for p in payments:
+        if p.get("id"):
+            por_id[p["id"]] = p
+
+    if locacao_id is None:
+        cache = resolver_locacoes(cur, [p.get("subscription") for p in por_id.values()], cache)
+
+    valores, sem_locacao = [], []
+    for p in por_id.values():
+        loc_id = locacao_id if locacao_id is not None else cache.get(p.get("subscription"))
+        if loc_id is None:
+            sem_locacao.append(p["id"])
+            continue
+        valores.append((
+            loc_id, p["id"], p.get("status"), p.get("value"), p.get("netValue"),
+            p.get("bankSlipUrl"), p.get("description"), p.get("dueDate"), p.get("paymentDate"),
+        ))
+
+    inseridos = atualizados = 0
+    locacoes = set()
+    if valores:
+        rows = execute_values(cur, _UPSERT_SQL, valores, page_size=PAGE_SIZE, fetch=True)
+        for row in rows:
+            locacoes.add(row["locacao_id"])
+            if row["inserido"]:
+                inseridos += 1
+            else:
+                atualizados += 1
+
+    return Resultado(inseridos, atualizados, locacoes, sem_locacao)
+
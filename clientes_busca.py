@@ -0,0 +1,76 @@
+import re
+
+# Busca de clientes por nome, email, CPF ou telefone.
+#
+# Nome e email usam ILIKE '%termo%' (índices trigram idx_clientes_*_trgm);
+# CPF e telefone são comparados só pelos dígitos (colunas geradas cpf_digitos
+# e telefone_digitos), então "123.456" e "123456" acham o mesmo cliente.
+# O resultado é ordenado por relevância (CPF exato, nome/email exato, prefixo
+# do nome, prefixo de alguma palavra, resto) e paginado.
+
+POR_PAGINA = 50
+MIN_DIGITOS = 3
+
+_NAO_DIGITO = re.compile(r"\D")
+_SO_NUMERICO = re.compile(r"^[\d\s().+/-]+$")
+
+_COLUNAS = "c.id, c.nome, c.email, c.telefone, c.cpf, c.data_nascimento, c.endereco, c.observacoes"
+
+
+def _escapar_like(termo):
+    return termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def buscar(cur, termo, limite=POR_PAGINA, offset=0):
+    """Retorna (clientes, tem_mais). Sem termo, lista por nome."""
+    termo = (termo or "").strip()
+    if not termo:
+        cur.execute(f"""
+            SELECT {_COLUNAS} FROM clientes c
+            ORDER BY c.nome, c.id
+            LIMIT %s OFFSET %s
+        """, (limite + 1, offset))
+        rows = cur.fetchall()
+        return rows[:limite], len(rows) > limite
+
+    digitos = _NAO_DIGITO.sub("", termo)
+    if not _SO_NUMERICO.match(termo) or len(digitos) < MIN_DIGITOS:
+        digitos = ""  # termo textual: não compara com CPF/telefone
+    like = _escapar_like(termo)
+
+    cur.execute(f"""
+        SELECT {_COLUNAS}
+        FROM clientes c
+        WHERE c.nome ILIKE %(contem)s
+           OR c.email::text ILIKE %(contem)s
+           OR (%(digitos)s <> '' AND (c.cpf_digitos LIKE %(digitos_prefixo)s
+                                      OR c.telefone_digitos LIKE %(digitos_contem)s))
+        ORDER BY CASE
+                   WHEN %(digitos)s <> '' AND c.cpf_digitos = %(digitos)s THEN 0
+                   WHEN lower(c.nome) = lower(%(termo)s) OR lower(c.email::text) = lower(%(termo)s) THEN 1
+                   WHEN c.nome ILIKE %(prefixo)s THEN 2
+                   WHEN c.nome ILIKE %(palavra)s THEN 3
+                   ELSE 4
+                 END,
+                 c.nome, c.id
+        LIMIT %(limite)s OFFSET %(offset)s
+    """, {
+        "termo": termo,
+        "contem": f"%{like}%",
+        "prefixo": f"{like}%",
+        "palavra": f"% {like}%",
+        "digitos": digitos,
+        "digitos_prefixo": f"{digitos}%",
+        "digitos_contem": f"%{digitos}%",
+        "limite": limite + 1,
+        "offset": offset,
+    })
+    rows = cur.fetchall()
+    return rows[:limite], len(rows) > limite
+
+
+def texto_typeahead(cliente):
+    """Rótulo curto para autocompletar: nome e, se houver, CPF."""
+    if cliente.get("cpf"):
+        return f"{cliente['nome']} - {cliente['cpf']}"
+    return cliente["nome"]
@@ -12,7 +12,84 @@ class Config:
     DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
     DB_SSLMODE = os.getenv("DB_SSLMODE", "require")
 
+    # Pool de conexões (por worker do gunicorn)
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # segundos esperando conexão livre
+    DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))  # SELECT 1 após N s ociosa
+
     # Asaas
     ASAAS_API_KEY = os.getenv("ASAAS_API_KEY")
     ASAAS_BASE_URL = os.getenv("ASAAS_BASE_URL", "https://sandbox.asaas.com/api/v3")
-    ASAAS_WEBHOOK_SECRET = os.getenv("ASAAS_WEBHOOK_SECRET")
\ No newline at end of file
+    ASAAS_WEBHOOK_SECRET = os.getenv("ASAAS_WEBHOOK_SECRET")
+    ASAAS_RATE_LIMIT = float(os.getenv("ASAAS_RATE_LIMIT", "5"))  # requisições/s por worker
+    ASAAS_CONNECT_TIMEOUT = float(os.getenv("ASAAS_CONNECT_TIMEOUT", "5"))
+    ASAAS_READ_TIMEOUT = float(os.getenv("ASAAS_READ_TIMEOUT", "30"))
+    ASAAS_RETRIES = int(os.getenv("ASAAS_RETRIES", "3"))  # só chamadas idempotentes
+    ASAAS_BACKOFF = float(os.getenv("ASAAS_BACKOFF", "0.5"))  # segundos, dobra a cada tentativa
+    ASAAS_POOL_MAXSIZE = int(os.getenv("ASAAS_POOL_MAXSIZE", "10"))  # conexões keep-alive por worker
+    ASAAS_SYNC_WORKERS = int(os.getenv("ASAAS_SYNC_WORKERS", "4"))  # assinaturas buscadas em paralelo
+
+    # Fila do webhook (ver webhook_queue.py)
+    WEBHOOK_WORKER_THREAD = os.getenv("WEBHOOK_WORKER_THREAD", "1") == "1"  # consumidor dentro do worker web
+    WEBHOOK_LOTE = int(os.getenv("WEBHOOK_LOTE", "50"))
+    WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "5"))
+    WEBHOOK_MAX_TENTATIVAS = int(os.getenv("WEBHOOK_MAX_TENTATIVAS", "8"))
+    WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", "10"))  # segundos, dobra a cada falha
+
+    # Outbox das assinaturas no Asaas (ver asaas_outbox.py)
+    OUTBOX_WORKER_THREAD = os.getenv("OUTBOX_WORKER_THREAD", "1") == "1"  # envio dentro do worker web
+    OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+    OUTBOX_MAX_TENTATIVAS = int(os.getenv("OUTBOX_MAX_TENTATIVAS", "10"))
+    OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))  # segundos, dobra a cada falha
+
+    # Agendador de tarefas periódicas (ver agendador.py); só o worker líder executa
+    AGENDADOR_THREAD = os.getenv("AGENDADOR_THREAD", "1") == "1"  # agendador dentro do worker web
+    AGENDADOR_TICK = float(os.getenv("AGENDADOR_TICK", "30"))  # segundos entre verificações
+    CONCILIACAO_INTERVALO = int(os.getenv("CONCILIACAO_INTERVALO", "900"))
+    CONCILIACAO_LOTE = int(os.getenv("CONCILIACAO_LOTE", "100"))  # locações por execução
+    VENCIDOS_INTERVALO = int(os.getenv("VENCIDOS_INTERVALO", "3600"))
+    VENCIDOS_LOTE = int(os.getenv("VENCIDOS_LOTE", "500"))  # boletos conferidos por execução
+    VENCIDOS_CARENCIA_DIAS = int(os.getenv("VENCIDOS_CARENCIA_DIAS", "1"))  # o Asaas marca no dia seguinte
+    ORFAOS_INTERVALO = int(os.getenv("ORFAOS_INTERVALO", "86400"))
+    ORFAOS_CARENCIA_HORAS = float(os.getenv("ORFAOS_CARENCIA_HORAS", "24"))  # uploads recentes ficam
+    RELATORIOS_INTERVALO = int(os.getenv("RELATORIOS_INTERVALO", "3600"))
+    CLIENTES_ASAAS_INTERVALO = int(os.getenv("CLIENTES_ASAAS_INTERVALO", "300"))
+    CLIENTES_ASAAS_LOTE = int(os.getenv("CLIENTES_ASAAS_LOTE", "50"))  # clientes importados enviados por execução
+    CLIENTES_ASAAS_BACKOFF_BASE = float(os.getenv("CLIENTES_ASAAS_BACKOFF_BASE", "60"))  # segundos, dobra a cada falha
+
+    # Importação de motos e clientes por CSV (ver importacao.py)
+    IMPORTACAO_MAX_ERROS = int(os.getenv("IMPORTACAO_MAX_ERROS", "1000"))  # acima disso o arquivo é recusado
+
+    # Dashboard: segundos que os indicadores ficam em cache em cada worker
+    DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+
+    # Cache das projeções de referência de clientes e motos (ver referencias.py)
+    REFERENCIAS_CACHE_TTL = float(os.getenv("REFERENCIAS_CACHE_TTL", "60"))
+    REFERENCIAS_CACHE_MAX = int(os.getenv("REFERENCIAS_CACHE_MAX", "2000"))  # entradas no LRU de cada worker
+    REFERENCIAS_CACHE_COMPARTILHADO = os.getenv("REFERENCIAS_CACHE_COMPARTILHADO", "")  # SQLite comum aos workers
+
+    # Uploads (contratos, habilitações, fotos de motos)
+    UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
+
+    # Armazenamento endereçado por conteúdo (ver armazenamento.py): "local" ou "s3"
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+    STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", os.path.join(UPLOAD_FOLDER, "objetos"))
+    S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "http://127.0.0.1:5056")  # fake_s3.py em desenvolvimento
+    S3_BUCKET = os.getenv("S3_BUCKET", "motorental")
+    S3_REGION = os.getenv("S3_REGION", "us-east-1")
+    S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY")
+    S3_SECRET_KEY = os.getenv("S3_SECRET_KEY")
+
+    # Entrega dos arquivos (ver entrega.py): "app", "nginx" (X-Accel-Redirect) ou "sendfile" (X-Sendfile)
+    ARQUIVOS_ENTREGA = os.getenv("ARQUIVOS_ENTREGA", "app")
+    ARQUIVOS_ACCEL_PREFIXO = os.getenv("ARQUIVOS_ACCEL_PREFIXO", "/_arquivos")
+
+    # Fotos de motos (ver imagens.py)
+    IMAGEM_WORKERS = int(os.getenv("IMAGEM_WORKERS", "2"))  # processos gerando variantes
+    IMAGEM_QUALIDADE = int(os.getenv("IMAGEM_QUALIDADE", "82"))  # JPEG/WebP das variantes
+
+    # Métricas (/metrics). Sem token configurado, a rota exige login.
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+    # Comandos SQL a partir deste tempo vão para o log "motorental.sql" (parâmetros redigidos)
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
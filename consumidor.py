@@ -0,0 +1,63 @@
+import logging
+import os
+import threading
+
+# Peças comuns dos consumidores em background (fila do webhook, outbox do
+# Asaas): o laço que processa enquanto houver trabalho e dorme até o próximo
+# poll ou até alguém acordá-lo, a thread única por processo (refeita no
+# processo filho depois do fork do gunicorn) e o backoff exponencial das
+# tentativas que falharam.
+
+BACKOFF_TETO = 3600  # segundos
+
+
+def backoff(tentativas, base):
+    """Espera antes da próxima tentativa: `base` segundos, dobrando a cada falha, até uma hora."""
+    return min(base * (2 ** max(tentativas - 1, 0)), BACKOFF_TETO)
+
+
+class Worker:
+    """Chama `passo()` enquanto ele disser que fez algo; senão dorme `intervalo` segundos (ou até acordar())."""
+
+    descricao = "consumidor"
+
+    def __init__(self, passo, intervalo):
+        self.passo = passo
+        self.intervalo = intervalo
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+
+    def acordar(self):
+        self._acordar.set()
+
+    def parar(self):
+        self._parar.set()
+        self._acordar.set()
+
+    def executar(self):
+        while not self._parar.is_set():
+            try:
+                if self.passo():
+                    continue  # ainda pode haver fila: emenda o próximo
+            except Exception:
+                logging.exception("Erro no %s", self.descricao)
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+
+class ThreadPorProcesso:
+    """Sobe (uma vez por processo) a thread de um Worker criado por `criar()` e a acorda a cada chamada."""
+
+    def __init__(self, nome, criar):
+        self.nome = nome
+        self.criar = criar
+        self.worker = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def garantir(self):
+        with self._lock:
+            if self.worker is None or self._pid != os.getpid():
+                self.worker, self._pid = self.criar(), os.getpid()
+                threading.Thread(target=self.worker.executar, name=self.nome, daemon=True).start()
+        self.worker.acordar()
@@ -0,0 +1,70 @@
+import datetime as dt
+import threading
+import time
+
+from config import Config
+from database import get_db_connection
+
+# Indicadores do dashboard calculados numa única ida ao banco e guardados em
+# memória por DASHBOARD_CACHE_TTL segundos. O cache é por worker: escritas
+# (webhook, locações, clientes, motos) chamam invalidate() no worker que as
+# atendeu; os demais workers enxergam a mudança quando o TTL expira.
+
+_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM clientes) AS total_clientes,
+        (SELECT COUNT(*) FROM motos) AS total_motos,
+        l.locacoes_ativas, l.locacoes_canceladas,
+        f.boletos_pendentes, f.boletos_pagados, f.receita_mes, f.inadimplentes
+    FROM (
+        SELECT COUNT(*) FILTER (WHERE cancelado = FALSE) AS locacoes_ativas,
+               COUNT(*) FILTER (WHERE cancelado = TRUE) AS locacoes_canceladas
+        FROM locacoes
+    ) l, (
+        -- Ledger pré-agregado (financeiro.py): uma linha por locação/mês em vez de todos os boletos
+        SELECT COALESCE(SUM(qtd_pendentes + qtd_vencidos), 0) AS boletos_pendentes,
+               COALESCE(SUM(qtd_pagos), 0) AS boletos_pagados,
+               COALESCE(SUM(valor_pago) FILTER (WHERE mes = %(mes)s), 0) AS receita_mes,
+               COALESCE(SUM(qtd_vencidos), 0) AS inadimplentes
+        FROM financeiro_mensal
+    ) f
+"""
+
+_lock = threading.Lock()
+_cache = {"expira": 0.0, "dia": None, "valores": None}
+
+
+def _calcular(hoje):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(_SQL, {"mes": hoje.replace(day=1)})
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+
+    return {k: (row[k] or 0) for k in (
+        "total_clientes", "total_motos", "locacoes_ativas", "locacoes_canceladas",
+        "boletos_pendentes", "boletos_pagados", "receita_mes", "inadimplentes",
+    )}
+
+
+def get_metrics():
+    hoje = dt.date.today()
+    agora = time.monotonic()
+    valores = _cache["valores"]
+    if valores is not None and _cache["dia"] == hoje and agora < _cache["expira"]:
+        return dict(valores)
+
+    # Um único cálculo por vez: requisições simultâneas esperam e reaproveitam o resultado
+    with _lock:
+        if _cache["valores"] is not None and _cache["dia"] == hoje and time.monotonic() < _cache["expira"]:
+            return dict(_cache["valores"])
+        valores = _calcular(hoje)
+        _cache.update(valores=valores, dia=hoje, expira=time.monotonic() + Config.DASHBOARD_CACHE_TTL)
+        return dict(valores)
+
+
+def invalidate():
+    _cache["expira"] = 0.0
@@ -0,0 +1,119 @@
+import datetime as dt
+
+# Disponibilidade da frota por período.
+#
+# Cada locação guarda seu período em locacoes.periodo (daterange '[]' gerado de
+# data_inicio/data_fim; sem data_fim o período é aberto). A restrição
+# excl_locacoes_moto_periodo (GiST em moto_id + periodo, só locações não
+# canceladas) impede duas locações da mesma moto com períodos sobrepostos, e o
+# mesmo índice responde "quais motos estão livres de X a Y" num único anti-join.
+#
+# motos.disponivel deixou de ser ligado/desligado pelas locações: agora só
+# indica se a moto está liberada para locação (ex.: desligar durante manutenção).
+
+LIMITE_PADRAO = 50
+
+
+def _periodo_sql(inicio_param="inicio", fim_param="fim"):
+    return f"daterange(%({inicio_param})s::date, %({fim_param})s::date, '[]')"
+
+
+def motos_livres(cur, inicio, fim=None, termo="", limite=LIMITE_PADRAO):
+    """Motos liberadas e sem locação ativa no período [inicio, fim] (fim None = sem data de fim).
+
+    Retorna (motos, total), com total contando todas as livres que casam com o termo.
+    """
+    termo = (termo or "").strip()
+    cur.execute(f"""
+        SELECT m.id, m.modelo, m.placa, m.ano, COUNT(*) OVER () AS total
+        FROM motos m
+        WHERE m.disponivel = TRUE
+          AND (%(termo)s = '' OR m.placa LIKE %(placa)s OR m.modelo ILIKE %(modelo)s)
+          AND NOT EXISTS (
+              SELECT 1 FROM locacoes l
+              WHERE l.moto_id = m.id AND l.cancelado = FALSE
+                AND l.periodo && {_periodo_sql()}
+          )
+        ORDER BY m.modelo, m.placa
+        LIMIT %(limite)s
+    """, {
+        "inicio": inicio, "fim": fim, "termo": termo, "limite": limite,
+        "placa": termo.upper().replace("%", "") + "%", "modelo": f"%{termo}%",
+    })
+    motos = cur.fetchall()
+    return motos, (motos[0]["total"] if motos else 0)
+
+
+def conflitos(cur, moto_id, inicio, fim=None, ignorar_locacao=None):
+    """Locações ativas da moto que se sobrepõem a [inicio, fim]."""
+    cur.execute(f"""
+        SELECT l.id, l.data_inicio, l.data_fim, c.nome AS cliente_nome
+        FROM locacoes l
+        JOIN clientes c ON c.id = l.cliente_id
+        WHERE l.moto_id = %(moto_id)s AND l.cancelado = FALSE
+          AND l.periodo && {_periodo_sql()}
+          AND l.id <> COALESCE(%(ignorar)s, 0)
+        ORDER BY l.data_inicio
+    """, {"moto_id": moto_id, "inicio": inicio, "fim": fim, "ignorar": ignorar_locacao})
+    return cur.fetchall()
+
+
+def sobreposicoes(cur, limite=LIMITE_PADRAO):
+    """Pares de locações ativas da mesma moto com períodos sobrepostos (dados antigos à restrição)."""
+    cur.execute("""
+        SELECT a.moto_id, m.placa, a.id AS locacao_a, b.id AS locacao_b,
+               a.data_inicio AS inicio_a, a.data_fim AS fim_a, b.data_inicio AS inicio_b, b.data_fim AS fim_b
+        FROM locacoes a
+        JOIN locacoes b ON b.moto_id = a.moto_id AND b.id > a.id
+                       AND b.cancelado = FALSE AND b.periodo && a.periodo
+        JOIN motos m ON m.id = a.moto_id
+        WHERE a.cancelado = FALSE
+        ORDER BY a.moto_id, a.id, b.id
+        LIMIT %s
+    """, (limite,))
+    return cur.fetchall()
+
+
+def agenda(cur, moto_id, de, ate):
+    """Períodos ocupados da moto dentro da janela [de, ate] e os intervalos livres entre eles."""
+    cur.execute(f"""
+        SELECT l.id, l.data_inicio, l.data_fim, c.nome AS cliente_nome
+        FROM locacoes l
+        JOIN clientes c ON c.id = l.cliente_id
+        WHERE l.moto_id = %(moto_id)s AND l.cancelado = FALSE
+          AND l.periodo && {_periodo_sql("de", "ate")}
+        ORDER BY l.data_inicio
+    """, {"moto_id": moto_id, "de": de, "ate": ate})
+    ocupados = cur.fetchall()
+
+    livres, cursor = [], de
+    for loc in ocupados:
+        if loc["data_inicio"] > cursor:
+            livres.append({"inicio": cursor, "fim": loc["data_inicio"] - dt.timedelta(days=1)})
+        if loc["data_fim"] is None:
+            cursor = None
+            break
+        cursor = max(cursor, loc["data_fim"] + dt.timedelta(days=1))
+    if cursor is not None and cursor <= ate:
+        livres.append({"inicio": cursor, "fim": ate})
+    return ocupados, livres
+
+
+def _fmt_data(d):
+    return d.strftime("%d/%m/%Y") if d else "sem data de fim"
+
+
+def descrever_sobreposicao(par):
+    """'moto ABC1D23: locação #12 (01/02/2025 a 10/02/2025) x locação #15 (05/02/2025 a sem data de fim)'."""
+    return (
+        f"moto {par['placa']}: locação #{par['locacao_a']} ({_fmt_data(par['inicio_a'])} a {_fmt_data(par['fim_a'])})"
+        f" x locação #{par['locacao_b']} ({_fmt_data(par['inicio_b'])} a {_fmt_data(par['fim_b'])})"
+    )
+
+
+def descrever_conflitos(conflitos_):
+    """Texto curto para flash: 'locação #12 (Fulano, 01/02/2025 a 10/02/2025)'."""
+    return "; ".join(
+        f"locação #{c['id']} ({c['cliente_nome']}, {_fmt_data(c['data_inicio'])} a {_fmt_data(c['data_fim'])})"
+        for c in conflitos_
+    )
@@ -0,0 +1,92 @@
+import mimetypes
+import os
+
+from flask import Response, abort, request, send_from_directory
+
+import armazenamento
+import metrics
+from config import Config
+
+# Entrega de arquivos enviados (contratos, documentos, CNH, fotos).
+#
+# Arquivos do armazenamento são endereçados pelo conteúdo, então nunca mudam:
+# o ETag é o próprio SHA-256 (forte) e o Cache-Control é longo e "immutable".
+# Um If-None-Match com o hash responde 304 sem tocar no disco nem no S3, e
+# pedidos com Range (PDFs grandes) recebem 206. A autorização continua nas
+# rotas (login_required); daqui em diante só importa como os bytes saem:
+#
+#   ARQUIVOS_ENTREGA=app       o próprio worker envia (padrão)
+#   ARQUIVOS_ENTREGA=nginx     X-Accel-Redirect para ARQUIVOS_ACCEL_PREFIXO, ex.:
+#                                location /_arquivos/ { internal; alias /caminho/do/STORAGE_LOCAL_DIR/; }
+#   ARQUIVOS_ENTREGA=sendfile  X-Sendfile com o caminho absoluto (Apache/lighttpd)
+#
+# Com STORAGE_BACKEND=s3 os bytes sempre passam pelo worker (Range é repassado ao S3).
+
+CACHE_IMUTAVEL = 365 * 24 * 3600
+
+ENTREGUES = metrics.counter("arquivos_entregues_total", "Arquivos entregues, por modo", ("modo",))
+
+
+def etag_da_chave(chave):
+    # "ab/abcdef....pdf" -> "abcdef..."
+    return os.path.basename(chave).split(".", 1)[0]
+
+
+def _cabecalhos(resp, etag, nome_download=None):
+    resp.set_etag(etag)
+    # private: o conteúdo exige login, então só o navegador guarda
+    resp.cache_control.private = True
+    resp.cache_control.public = False
+    resp.cache_control.no_cache = None
+    resp.cache_control.max_age = CACHE_IMUTAVEL
+    resp.cache_control.immutable = True
+    if nome_download and "Content-Disposition" not in resp.headers:
+        resp.headers["Content-Disposition"] = f'inline; filename="{nome_download}"'
+    return resp
+
+
+def enviar(chave, nome_download=None, pasta_legada=None):
+    """Response com o arquivo da chave; nomes do esquema antigo são lidos de pasta_legada."""
+    if not chave:
+        abort(404)
+
+    if armazenamento.legado(chave):
+        # Nome antigo pode ser sobrescrito: só validação condicional, sem cache longo
+        if not pasta_legada:
+            abort(404)
+        ENTREGUES.inc(modo="legado")
+        return send_from_directory(os.path.join(Config.UPLOAD_FOLDER, pasta_legada), chave, conditional=True)
+
+    # A chave vai para o caminho no disco, o X-Accel-Redirect e a URL do S3: só o formato do armazenamento
+    if not armazenamento.chave_valida(chave):
+        abort(404)
+
+    etag = etag_da_chave(chave)
+    mime_type = mimetypes.guess_type(chave)[0] or "application/octet-stream"
+
+    if request.if_none_match.contains(etag):
+        ENTREGUES.inc(modo="304")
+        return _cabecalhos(Response(status=304), etag)
+
+    backend = armazenamento.get_backend()
+    modo = Config.ARQUIVOS_ENTREGA
+    if backend.nome == "local" and modo in ("nginx", "sendfile"):
+        caminho = backend.caminho(chave)
+        if not os.path.isfile(caminho):
+            abort(404)
+        resp = Response(mimetype=mime_type)
+        if modo == "nginx":
+            resp.headers["X-Accel-Redirect"] = f"{Config.ARQUIVOS_ACCEL_PREFIXO.rstrip('/')}/{chave}"
+        else:
+            resp.headers["X-Sendfile"] = caminho
+        ENTREGUES.inc(modo=modo)
+        return _cabecalhos(resp, etag, nome_download)
+
+    # If-Range com outro ETag: o cliente tem uma versão diferente, manda o arquivo inteiro
+    intervalo = request.headers.get("Range")
+    if intervalo and request.if_range.etag and request.if_range.etag != etag:
+        intervalo = None
+
+    resp = backend.resposta(chave, mime_type, etag, nome_download, intervalo)
+    ENTREGUES.inc(modo="app")
+    return _cabecalhos(resp, etag, nome_download)
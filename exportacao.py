@@ -0,0 +1,391 @@
+import csv
+import datetime as dt
+import io
+import re
+import zipfile
+from collections import namedtuple
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+import metrics
+
+# Exportação de planilhas (CSV e XLSX) em streaming.
+#
+# As linhas saem de um cursor nomeado (server-side): o Postgres entrega
+# LOTE linhas por vez e cada lote já vira bytes da resposta, então a memória
+# do worker não cresce com o tamanho da tabela. O XLSX é montado à mão (zip
+# sem seek, com data descriptors) para não depender de openpyxl nem de
+# arquivo temporário; passando de LINHAS_POR_ABA a planilha ganha novas abas.
+
+LOTE = 2000
+LINHAS_POR_ABA = 1_048_575  # limite do Excel, menos o cabeçalho
+BLOCO = 64 * 1024
+
+EXPORTADAS = metrics.counter("exportacoes_linhas_total", "Linhas exportadas em planilhas", ("tabela", "formato"))
+
+Coluna = namedtuple("Coluna", "titulo campo tipo")  # tipo: texto, inteiro, dinheiro, data, datahora
+
+
+class Exportacao:
+    """Uma tabela exportável: colunas, SELECT base e os filtros que aceita."""
+
+    def __init__(self, nome, colunas, sql, data_col, status_col=None, ordem="1"):
+        self.nome = nome
+        self.colunas = colunas
+        self.sql = sql
+        self.data_col = data_col
+        self.status_col = status_col
+        self.ordem = ordem
+
+    def consulta(self, filtros):
+        where, params = [], []
+        if filtros.get("de"):
+            where.append(f"{self.data_col} >= %s")
+            params.append(filtros["de"])
+        if filtros.get("ate"):
+            where.append(f"{self.data_col} < %s")
+            params.append(filtros["ate"] + dt.timedelta(days=1))
+        if self.status_col and filtros.get("status"):
+            where.append(f"{self.status_col} = ANY(%s)")
+            params.append(list(filtros["status"]))
+        for coluna, valor in self._extras(filtros):
+            where.append(coluna)
+            params.append(valor)
+        sql = self.sql + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {self.ordem}"
+        return sql, params
+
+    def _extras(self, filtros):
+        return []
+
+
+class _ExportacaoLocacoes(Exportacao):
+    def _extras(self, filtros):
+        # Mesmos filtros da listagem de locações
+        if filtros.get("situacao") == "ativas":
+            yield "l.cancelado = %s", False
+        elif filtros.get("situacao") == "canceladas":
+            yield "l.cancelado = %s", True
+        if filtros.get("cliente"):
+            yield "c.nome ILIKE %s", f"%{filtros['cliente']}%"
+        if filtros.get("placa"):
+            yield "m.placa LIKE %s", filtros["placa"].upper().replace("%", "") + "%"
+        if filtros.get("frequencia"):
+            yield "l.frequencia_pagamento = %s", filtros["frequencia"]
+
+
+class _ExportacaoBoletos(Exportacao):
+    def _extras(self, filtros):
+        if filtros.get("locacao_id"):
+            yield "b.locacao_id = %s", filtros["locacao_id"]
+
+
+EXPORTACOES = {
+    "locacoes": _ExportacaoLocacoes(
+        "locacoes",
+        [
+            Coluna("ID", "id", "inteiro"),
+            Coluna("Cliente", "cliente_nome", "texto"),
+            Coluna("CPF", "cliente_cpf", "texto"),
+            Coluna("Moto", "moto_modelo", "texto"),
+            Coluna("Placa", "moto_placa", "texto"),
+            Coluna("Início", "data_inicio", "data"),
+            Coluna("Fim", "data_fim", "data"),
+            Coluna("Frequência", "frequencia_pagamento", "texto"),
+            Coluna("Valor", "valor", "dinheiro"),
+            Coluna("Status", "pagamento_status", "texto"),
+            Coluna("Valor pago", "valor_pago", "dinheiro"),
+            Coluna("Valor pendente", "valor_pendente", "dinheiro"),
+            Coluna("Valor vencido", "valor_vencido", "dinheiro"),
+            Coluna("Cancelada", "cancelado", "texto"),
+            Coluna("Assinatura Asaas", "asaas_subscription_id", "texto"),
+        ],
+        """
+            SELECT l.id, c.nome AS cliente_nome, c.cpf AS cliente_cpf, m.modelo AS moto_modelo, m.placa AS moto_placa,
+                   l.data_inicio, l.data_fim, l.frequencia_pagamento, l.valor, l.pagamento_status,
+                   l.valor_pago, l.valor_pendente, l.valor_vencido,
+                   CASE WHEN l.cancelado THEN 'Sim' ELSE 'Não' END AS cancelado, l.asaas_subscription_id
+            FROM locacoes l
+            JOIN clientes c ON c.id = l.cliente_id
+            JOIN motos m ON m.id = l.moto_id
+        """,
+        data_col="l.data_inicio", status_col="l.pagamento_status", ordem="l.id",
+    ),
+    "boletos": _ExportacaoBoletos(
+        "boletos",
+        [
+            Coluna("ID", "id", "inteiro"),
+            Coluna("Locação", "locacao_id", "inteiro"),
+            Coluna("Cliente", "cliente_nome", "texto"),
+            Coluna("CPF", "cliente_cpf", "texto"),
+            Coluna("Placa", "moto_placa", "texto"),
+            Coluna("Descrição", "descricao", "texto"),
+            Coluna("Vencimento", "data_vencimento", "data"),
+            Coluna("Valor", "valor", "dinheiro"),
+            Coluna("Status", "status", "texto"),
+            Coluna("Pagamento", "data_pagamento", "data"),
+            Coluna("Valor pago", "valor_pago", "dinheiro"),
+            Coluna("ID Asaas", "asaas_payment_id", "texto"),
+            Coluna("Boleto", "boleto_url", "texto"),
+        ],
+        """
+            SELECT b.id, b.locacao_id, c.nome AS cliente_nome, c.cpf AS cliente_cpf, m.placa AS moto_placa,
+                   b.descricao, b.data_vencimento, b.valor, b.status, b.data_pagamento, b.valor_pago,
+                   b.asaas_payment_id, b.boleto_url
+            FROM boletos b
+            JOIN locacoes l ON l.id = b.locacao_id
+            JOIN clientes c ON c.id = l.cliente_id
+            JOIN motos m ON m.id = l.moto_id
+        """,
+        data_col="b.data_vencimento", status_col="b.status", ordem="b.id",
+    ),
+    "clientes": Exportacao(
+        "clientes",
+        [
+            Coluna("ID", "id", "inteiro"),
+            Coluna("Nome", "nome", "texto"),
+            Coluna("CPF", "cpf", "texto"),
+            Coluna("E-mail", "email", "texto"),
+            Coluna("Telefone", "telefone", "texto"),
+            Coluna("Endereço", "endereco", "texto"),
+            Coluna("Nascimento", "data_nascimento", "data"),
+            Coluna("ID Asaas", "asaas_id", "texto"),
+            Coluna("Cadastro", "created_at", "datahora"),
+        ],
+        """
+            SELECT id, nome, cpf, email, telefone, endereco, data_nascimento, asaas_id, created_at
+            FROM clientes
+        """,
+        data_col="created_at", ordem="id",
+    ),
+}
+
+
+def abrir_cursor(conn, exportacao, filtros):
+    """Declara o cursor nomeado já com a consulta (erros de SQL aparecem antes do streaming)."""
+    sql, params = exportacao.consulta(filtros)
+    cur = conn.cursor(name=f"exportar_{exportacao.nome}")
+    cur.itersize = LOTE
+    cur.execute(sql, params)
+    return cur
+
+
+def linhas(cur):
+    """Itera o cursor nomeado (LOTE linhas por ida ao banco) e fecha no fim."""
+    try:
+        yield from cur
+    finally:
+        cur.close()
+
+
+# ====
+# CSV
+# ====
+_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _valor_csv(valor, tipo):
+    if valor is None:
+        return ""
+    if tipo == "dinheiro" or isinstance(valor, Decimal):
+        return f"{valor:.2f}".replace(".", ",")  # Excel em pt-BR lê vírgula decimal
+    if tipo == "data":
+        return valor.isoformat()
+    if tipo == "datahora":
+        return valor.isoformat(sep=" ", timespec="seconds")
+    texto = str(valor)
+    # Evita que a planilha interprete o conteúdo como fórmula
+    return "'" + texto if texto.startswith(_FORMULA) else texto
+
+
+def gerar_csv(colunas, rows, tabela):
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=";", lineterminator="\r\n")
+    buf.write("\ufeff")  # BOM: o Excel abre em UTF-8 com os acentos certos
+    w.writerow([c.titulo for c in colunas])
+    total = 0
+    for row in rows:
+        w.writerow([_valor_csv(row[c.campo], c.tipo) for c in colunas])
+        total += 1
+        if buf.tell() >= BLOCO:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+    EXPORTADAS.inc(total, tabela=tabela, formato="csv")
+
+
+# ====
+# XLSX
+# ====
+class _Saida:
+    """Destino do zip sem seek: acumula os bytes até o gerador repassá-los à resposta."""
+
+    def __init__(self):
+        self._partes = []
+        self.tamanho = 0
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self.tamanho += len(dados)
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados = b"".join(self._partes)
+        self._partes = []
+        self.tamanho = 0
+        return dados
+
+
+_EPOCA_EXCEL = dt.datetime(1899, 12, 30)
+_CONTROLE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# Índices em cellXfs de _ESTILOS
+_ESTILO = {"data": 1, "datahora": 2, "dinheiro": 3}
+_ESTILO_CABECALHO = 4
+
+_ESTILOS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy hh:mm"/></numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="5">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+_INICIO_ABA = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    "</sheetView></sheetViews><sheetData>"
+)
+_FIM_ABA = "</sheetData></worksheet>"
+
+
+def _texto_xlsx(texto):
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_CONTROLE.sub("", texto))}</t></is></c>'
+
+
+def _celula_xlsx(valor, tipo):
+    if valor is None:
+        return "<c/>"
+    if tipo in ("data", "datahora") and isinstance(valor, (dt.date, dt.datetime)):
+        if not isinstance(valor, dt.datetime):
+            valor = dt.datetime.combine(valor, dt.time())
+        serial = (valor.replace(tzinfo=None) - _EPOCA_EXCEL).total_seconds() / 86400
+        return f'<c s="{_ESTILO[tipo]}"><v>{serial:.6f}</v></c>'
+    if tipo in ("inteiro", "dinheiro") and isinstance(valor, (int, float, Decimal)):
+        estilo = f' s="{_ESTILO["dinheiro"]}"' if tipo == "dinheiro" else ""
+        return f"<c{estilo}><v>{valor}</v></c>"
+    return _texto_xlsx(str(valor))
+
+
+def _linha_cabecalho(colunas):
+    celulas = "".join(
+        f'<c t="inlineStr" s="{_ESTILO_CABECALHO}"><is><t>{escape(c.titulo)}</t></is></c>' for c in colunas
+    )
+    return f"<row>{celulas}</row>"
+
+
+def _arquivos_finais(abas):
+    planilhas = "".join(
+        f'<sheet name="{escape(nome)}" sheetId="{i}" r:id="rId{i}"/>' for i, nome in enumerate(abas, 1)
+    )
+    rels_abas = "".join(
+        f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>' for i in range(1, len(abas) + 1)
+    )
+    tipos_abas = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(abas) + 1)
+    )
+    n = len(abas) + 1
+    return {
+        "xl/workbook.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f"<sheets>{planilhas}</sheets></workbook>"
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'{rels_abas}<Relationship Id="rId{n}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/styles.xml": _ESTILOS,
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>'
+        ),
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f"{tipos_abas}</Types>"
+        ),
+    }
+
+
+def gerar_xlsx(colunas, rows, tabela):
+    saida = _Saida()
+    cabecalho = _linha_cabecalho(colunas).encode("utf-8")
+    abas = []
+    total = 0
+    with zipfile.ZipFile(saida, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        aba = None
+        na_aba = 0
+        for row in rows:
+            if aba is None or na_aba >= LINHAS_POR_ABA:
+                if aba is not None:
+                    aba.write(_FIM_ABA.encode("utf-8"))
+                    aba.close()
+                abas.append(tabela if not abas else f"{tabela} ({len(abas) + 1})")
+                # force_zip64: o tamanho da aba não é conhecido de antemão
+                aba = zf.open(f"xl/worksheets/sheet{len(abas)}.xml", "w", force_zip64=True)
+                aba.write(_INICIO_ABA.encode("utf-8") + cabecalho)
+                na_aba = 0
+            celulas = "".join(_celula_xlsx(row[c.campo], c.tipo) for c in colunas)
+            aba.write(f"<row>{celulas}</row>".encode("utf-8"))
+            na_aba += 1
+            total += 1
+            if saida.tamanho >= BLOCO:
+                yield saida.esvaziar()
+
+        if aba is None:  # nenhuma linha: só o cabeçalho
+            abas.append(tabela)
+            with zf.open("xl/worksheets/sheet1.xml", "w") as vazia:
+                vazia.write(_INICIO_ABA.encode("utf-8") + cabecalho + _FIM_ABA.encode("utf-8"))
+        else:
+            aba.write(_FIM_ABA.encode("utf-8"))
+            aba.close()
+
+        for nome, conteudo in _arquivos_finais(abas).items():
+            zf.writestr(nome, conteudo)
+    yield saida.esvaziar()
+    EXPORTADAS.inc(total, tabela=tabela, formato="xlsx")
+
+
+FORMATOS = {
+    "csv": (gerar_csv, "text/csv; charset=utf-8"),
+    "xlsx": (gerar_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
@@ -0,0 +1,161 @@
+# fake_asaas.py
+# Servidor local que imita a API v3 do Asaas (customers, subscriptions, payments)
+# para desenvolvimento, sincronizações e benchmarks sem tocar no sandbox.
+#
+#   python fake_asaas.py --port 5055
+#   export ASAAS_BASE_URL=http://127.0.0.1:5055/api/v3 ASAAS_API_KEY=fake
+import datetime as dt
+import itertools
+import os
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+
+def create_app(payments_por_assinatura=None, latencia=None):
+    app = Flask(__name__)
+    payments_por_assinatura = int(
+        payments_por_assinatura if payments_por_assinatura is not None
+        else os.environ.get("FAKE_ASAAS_PAYMENTS", "130")
+    )
+    latencia = float(latencia if latencia is not None else os.environ.get("FAKE_ASAAS_LATENCIA", "0"))
+
+    lock = threading.Lock()
+    seq = itertools.count(1)
+    customers = {}
+    subscriptions = {}
+    payments = {}  # subscription_id -> [payment]
+
+    def _gerar_payments(sub_id, valor=100.0, ciclo="WEEKLY", inicio=None):
+        inicio = inicio or dt.date(2024, 1, 1)
+        passo = dt.timedelta(days=7 if ciclo == "WEEKLY" else 30)
+        hoje = dt.date.today()
+        lista = []
+        for i in range(payments_por_assinatura):
+            venc = inicio + passo * i
+            pago = venc < hoje and i % 5 != 0
+            lista.append({
+                "id": f"pay_{sub_id}_{i}",
+                "subscription": sub_id,
+                "status": "RECEIVED" if pago else ("OVERDUE" if venc < hoje else "PENDING"),
+                "value": valor,
+                "netValue": round(valor * 0.98, 2),
+                "bankSlipUrl": f"https://fake.asaas/b/{sub_id}/{i}",
+                "description": f"Parcela {i + 1}",
+                "dueDate": venc.isoformat(),
+                "paymentDate": venc.isoformat() if pago else None,
+            })
+        return lista
+
+    def _pagina(itens):
+        limit = min(request.args.get("limit", 10, type=int), 100)
+        offset = request.args.get("offset", 0, type=int)
+        fatia = itens[offset:offset + limit]
+        return jsonify({
+            "object": "list", "hasMore": offset + limit < len(itens),
+            "totalCount": len(itens), "limit": limit, "offset": offset, "data": fatia,
+        })
+
+    # Falhas sob demanda (testes): app.config["INTERCEPTAR"] = função(request) que
+    # devolve uma resposta no lugar da rota (ex.: ("erro", 503)) ou None para seguir;
+    # pode dormir para simular timeout.
+    app.config["INTERCEPTAR"] = None
+
+    # Sem checagem do cabeçalho access_token: o servidor de desenvolvimento do
+    # werkzeug descarta cabeçalhos com "_" no nome.
+    @app.before_request
+    def _simular_latencia():
+        if latencia:
+            time.sleep(latencia)
+        interceptar = app.config["INTERCEPTAR"]
+        if interceptar is not None:
+            return interceptar(request)
+
+    @app.get("/api/v3/customers")
+    def listar_customers():
+        itens = list(customers.values())
+        if request.args.get("cpfCnpj"):
+            itens = [c for c in itens if c.get("cpfCnpj") == request.args["cpfCnpj"]]
+        if request.args.get("email"):
+            itens = [c for c in itens if (c.get("email") or "").lower() == request.args["email"].lower()]
+        return _pagina(itens)
+
+    @app.post("/api/v3/customers")
+    def criar_customer():
+        body = request.get_json(force=True) or {}
+        with lock:
+            cid = f"cus_{next(seq):06d}"
+            customers[cid] = dict(body, id=cid, object="customer")
+        return jsonify(customers[cid])
+
+    @app.get("/api/v3/subscriptions")
+    def listar_subscriptions():
+        itens = list(subscriptions.values())
+        for filtro in ("externalReference", "customer"):
+            if request.args.get(filtro):
+                itens = [s for s in itens if s.get(filtro) == request.args[filtro]]
+        return _pagina(itens)
+
+    @app.post("/api/v3/subscriptions")
+    def criar_subscription():
+        body = request.get_json(force=True) or {}
+        if body.get("customer") not in customers and not str(body.get("customer", "")).startswith("cus_"):
+            return jsonify({"errors": [{"code": "invalid_customer", "description": "Cliente inválido"}]}), 400
+        with lock:
+            sid = f"sub_{next(seq):06d}"
+            subscriptions[sid] = dict(body, id=sid, status="ACTIVE", object="subscription")
+        return jsonify(subscriptions[sid])
+
+    @app.route("/api/v3/subscriptions/<sid>", methods=["POST", "PUT"])
+    def atualizar_subscription(sid):
+        body = request.get_json(force=True, silent=True) or {}
+        with lock:
+            sub = subscriptions.setdefault(sid, {"id": sid, "status": "ACTIVE", "object": "subscription"})
+            sub.update(body)
+        return jsonify(sub)
+
+    @app.post("/api/v3/subscriptions/<sid>/cancel")
+    def cancelar_subscription(sid):
+        with lock:
+            sub = subscriptions.setdefault(sid, {"id": sid, "object": "subscription"})
+            sub["status"] = "INACTIVE"
+        return jsonify(sub)
+
+    @app.get("/api/v3/payments")
+    def listar_payments():
+        sid = request.args.get("subscription")
+        if not sid:
+            itens = [p for lista in payments.values() for p in lista]
+        else:
+            with lock:
+                if sid not in payments:
+                    sub = subscriptions.get(sid, {})
+                    payments[sid] = _gerar_payments(sid, float(sub.get("value") or 100), sub.get("cycle", "WEEKLY"))
+                itens = payments[sid]
+        return _pagina(itens)
+
+    @app.get("/api/v3/payments/<pid>")
+    def obter_payment(pid):
+        # Ids gerados aqui são pay_<assinatura>_<n>: gera a assinatura se ainda não foi listada
+        sid = pid[len("pay_"):].rsplit("_", 1)[0] if pid.startswith("pay_") else None
+        with lock:
+            if sid and sid not in payments:
+                sub = subscriptions.get(sid, {})
+                payments[sid] = _gerar_payments(sid, float(sub.get("value") or 100), sub.get("cycle", "WEEKLY"))
+            for p in payments.get(sid, ()):
+                if p["id"] == pid:
+                    return jsonify(p)
+        return jsonify({"errors": [{"code": "not_found", "description": "Cobrança não encontrada"}]}), 404
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--payments", type=int, default=None, help="Payments gerados por assinatura")
+    parser.add_argument("--latencia", type=float, default=None, help="Atraso artificial por requisição (s)")
+    args = parser.parse_args()
+    create_app(args.payments, args.latencia).run(port=args.port, threaded=True)
@@ -0,0 +1,98 @@
+# fake_s3.py
+# Servidor local que imita o básico de um bucket S3 (PUT/GET/HEAD/DELETE de
+# objetos, ListObjectsV2, endereçamento por caminho) para testar STORAGE_BACKEND=s3.
+#
+#   python fake_s3.py --port 5056 --dir /tmp/fake-s3
+#   export STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://127.0.0.1:5056
+import datetime as dt
+import os
+from xml.sax.saxutils import escape
+
+from flask import Flask, Response, abort, request, send_file
+from werkzeug.security import safe_join
+
+
+def create_app(diretorio=None):
+    app = Flask(__name__)
+    diretorio = os.path.abspath(diretorio or os.environ.get("FAKE_S3_DIR", "fake-s3"))
+
+    # Sem validar a assinatura SigV4: só confere que ela veio
+    @app.before_request
+    def _exigir_assinatura():
+        if not request.headers.get("Authorization", "").startswith("AWS4-HMAC-SHA256 "):
+            abort(403)
+
+    def _caminho(bucket, chave):
+        caminho = safe_join(diretorio, bucket, chave)
+        if caminho is None:
+            abort(400)
+        return caminho
+
+    @app.get("/<bucket>")
+    def listar_objetos(bucket):
+        # ListObjectsV2 sem prefixo/delimitador; o continuation-token é a última chave da página
+        raiz = _caminho(bucket, "")
+        chaves = []
+        for pasta, _, nomes in os.walk(raiz):
+            chaves += [os.path.relpath(os.path.join(pasta, n), raiz).replace(os.sep, "/")
+                       for n in nomes if not n.endswith(".part")]
+        chaves.sort()
+        depois = request.args.get("continuation-token", "")
+        maximo = min(request.args.get("max-keys", 1000, type=int), 1000)
+        pagina = [c for c in chaves if c > depois][:maximo]
+        truncado = bool(pagina) and pagina[-1] != chaves[-1]
+        itens = "".join(
+            "<Contents><Key>%s</Key><LastModified>%s</LastModified><Size>%d</Size></Contents>" % (
+                escape(c),
+                dt.datetime.fromtimestamp(os.path.getmtime(os.path.join(raiz, c)), dt.timezone.utc)
+                .strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                os.path.getsize(os.path.join(raiz, c)),
+            )
+            for c in pagina
+        )
+        proximo = "<NextContinuationToken>%s</NextContinuationToken>" % escape(pagina[-1]) if truncado else ""
+        corpo = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            "<Name>%s</Name><KeyCount>%d</KeyCount><IsTruncated>%s</IsTruncated>%s%s</ListBucketResult>"
+        ) % (escape(bucket), len(pagina), "true" if truncado else "false", proximo, itens)
+        return Response(corpo, mimetype="application/xml")
+
+    @app.put("/<bucket>/<path:chave>")
+    def put_objeto(bucket, chave):
+        caminho = _caminho(bucket, chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        tmp = caminho + ".part"
+        with open(tmp, "wb") as f:
+            while True:
+                bloco = request.stream.read(64 * 1024)
+                if not bloco:
+                    break
+                f.write(bloco)
+        os.replace(tmp, caminho)
+        return Response(status=200, headers={"ETag": '"ok"'})
+
+    @app.route("/<bucket>/<path:chave>", methods=["GET", "HEAD"])
+    def get_objeto(bucket, chave):
+        caminho = _caminho(bucket, chave)
+        if not os.path.isfile(caminho):
+            abort(404)
+        return send_file(caminho, conditional=True)
+
+    @app.delete("/<bucket>/<path:chave>")
+    def delete_objeto(bucket, chave):
+        caminho = _caminho(bucket, chave)
+        if os.path.isfile(caminho):
+            os.remove(caminho)
+        return Response(status=204)
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--dir", default=None, help="Pasta onde os objetos são gravados")
+    args = parser.parse_args()
+    create_app(args.dir).run(port=args.port, threaded=True)
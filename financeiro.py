@@ -0,0 +1,120 @@
+# Agregados financeiros materializados.
+#
+# financeiro_mensal guarda, por locação e mês, os valores e quantidades de
+# boletos pagos, pendentes e vencidos; locacoes.valor_pago/valor_pendente/
+# valor_vencido guardam os totais da locação. Os dois são mantidos por delta
+# pelos triggers de boletos (schema.sql), então webhook e sincronização não
+# precisam recalcular nada. Os mesmos triggers mantêm receita_semanal (receita
+# por semana do pagamento, usada em relatorios.py). Este módulo só lê o ledger e, quando preciso,
+# confere/reconstrói tudo a partir da tabela boletos (`flask rebuild-financeiro`).
+
+CAMPOS = ("valor_pago", "valor_pendente", "valor_vencido", "qtd_pagos", "qtd_pendentes", "qtd_vencidos")
+
+_ESPERADO_SQL = """
+    SELECT b.locacao_id,
+           financeiro_mes(b.status, b.data_vencimento, b.data_pagamento, b.created_at) AS mes,
+           COALESCE(SUM(COALESCE(b.valor_pago, 0)) FILTER (WHERE b.status IN ('RECEIVED','CONFIRMED','RECEIVED_IN_CASH')), 0) AS valor_pago,
+           COALESCE(SUM(COALESCE(b.valor, 0)) FILTER (WHERE b.status = 'PENDING'), 0) AS valor_pendente,
+           COALESCE(SUM(COALESCE(b.valor, 0)) FILTER (WHERE b.status = 'OVERDUE'), 0) AS valor_vencido,
+           COUNT(*) FILTER (WHERE b.status IN ('RECEIVED','CONFIRMED','RECEIVED_IN_CASH')) AS qtd_pagos,
+           COUNT(*) FILTER (WHERE b.status = 'PENDING') AS qtd_pendentes,
+           COUNT(*) FILTER (WHERE b.status = 'OVERDUE') AS qtd_vencidos
+    FROM boletos b
+    GROUP BY 1, 2
+"""
+
+_SEMANAL_SQL = """
+    SELECT financeiro_semana(data_vencimento, data_pagamento, created_at) AS semana,
+           SUM(COALESCE(valor_pago, 0)) AS valor_pago, COUNT(*) AS qtd_pagos
+    FROM boletos
+    WHERE status IN ('RECEIVED','CONFIRMED','RECEIVED_IN_CASH')
+    GROUP BY 1
+"""
+
+
+def divergencias(cur):
+    """Compara o ledger e os totais das locações com a tabela boletos.
+
+    Retorna uma lista de (locacao_id, mes, campo, no_ledger, esperado);
+    mes é None para os totais em locacoes e locacao_id é None para receita_semanal
+    (mes traz a semana).
+    """
+    cur.execute(f"""
+        WITH esperado AS ({_ESPERADO_SQL})
+        SELECT COALESCE(e.locacao_id, f.locacao_id) AS locacao_id,
+               COALESCE(e.mes, f.mes) AS mes,
+               {", ".join(f"COALESCE(f.{c}, 0) AS atual_{c}, COALESCE(e.{c}, 0) AS esperado_{c}" for c in CAMPOS)}
+        FROM esperado e
+        FULL JOIN financeiro_mensal f ON f.locacao_id = e.locacao_id AND f.mes = e.mes
+        WHERE {" OR ".join(f"COALESCE(f.{c}, 0) <> COALESCE(e.{c}, 0)" for c in CAMPOS)}
+        ORDER BY 1, 2
+    """)
+    resultado = []
+    for row in cur.fetchall():
+        for c in CAMPOS:
+            if row[f"atual_{c}"] != row[f"esperado_{c}"]:
+                resultado.append((row["locacao_id"], row["mes"], c, row[f"atual_{c}"], row[f"esperado_{c}"]))
+
+    totais = CAMPOS[:3]
+    cur.execute(f"""
+        WITH esperado AS (
+            SELECT locacao_id, {", ".join(f"SUM({c}) AS {c}" for c in totais)}
+            FROM ({_ESPERADO_SQL}) m
+            GROUP BY locacao_id
+        )
+        SELECT l.id AS locacao_id,
+               {", ".join(f"COALESCE(l.{c}, 0) AS atual_{c}, COALESCE(e.{c}, 0) AS esperado_{c}" for c in totais)}
+        FROM locacoes l
+        LEFT JOIN esperado e ON e.locacao_id = l.id
+        WHERE {" OR ".join(f"COALESCE(l.{c}, 0) <> COALESCE(e.{c}, 0)" for c in totais)}
+        ORDER BY l.id
+    """)
+    for row in cur.fetchall():
+        for c in totais:
+            if row[f"atual_{c}"] != row[f"esperado_{c}"]:
+                resultado.append((row["locacao_id"], None, c, row[f"atual_{c}"], row[f"esperado_{c}"]))
+
+    cur.execute(f"""
+        SELECT COALESCE(e.semana, s.semana) AS semana,
+               COALESCE(s.valor_pago, 0) AS atual_valor_pago, COALESCE(e.valor_pago, 0) AS esperado_valor_pago,
+               COALESCE(s.qtd_pagos, 0) AS atual_qtd_pagos, COALESCE(e.qtd_pagos, 0) AS esperado_qtd_pagos
+        FROM ({_SEMANAL_SQL}) e
+        FULL JOIN receita_semanal s ON s.semana = e.semana
+        WHERE COALESCE(s.valor_pago, 0) <> COALESCE(e.valor_pago, 0) OR COALESCE(s.qtd_pagos, 0) <> COALESCE(e.qtd_pagos, 0)
+        ORDER BY 1
+    """)
+    for row in cur.fetchall():
+        for c in ("valor_pago", "qtd_pagos"):
+            if row[f"atual_{c}"] != row[f"esperado_{c}"]:
+                resultado.append((None, row["semana"], f"semanal_{c}", row[f"atual_{c}"], row[f"esperado_{c}"]))
+    return resultado
+
+
+def reconstruir(cur):
+    """Refaz o ledger e os totais das locações a partir de boletos (quem chama faz o commit)."""
+    # Bloqueia escritas em boletos até o commit, para nenhum delta se perder no meio
+    cur.execute("LOCK TABLE boletos IN SHARE MODE")
+    cur.execute("DELETE FROM financeiro_mensal")
+    cur.execute("DELETE FROM receita_semanal")
+    cur.execute(f"INSERT INTO receita_semanal (semana, valor_pago, qtd_pagos) {_SEMANAL_SQL}")
+    cur.execute(f"""
+        INSERT INTO financeiro_mensal (locacao_id, mes, {", ".join(CAMPOS)})
+        SELECT locacao_id, mes, {", ".join(CAMPOS)} FROM ({_ESPERADO_SQL}) e
+    """)
+    cur.execute("""
+        UPDATE locacoes l
+           SET valor_pago = COALESCE(t.valor_pago, 0),
+               valor_pendente = COALESCE(t.valor_pendente, 0),
+               valor_vencido = COALESCE(t.valor_vencido, 0)
+          FROM locacoes l2
+          LEFT JOIN (
+              SELECT locacao_id, SUM(valor_pago) AS valor_pago,
+                     SUM(valor_pendente) AS valor_pendente, SUM(valor_vencido) AS valor_vencido
+              FROM financeiro_mensal
+              GROUP BY locacao_id
+          ) t ON t.locacao_id = l2.id
+         WHERE l.id = l2.id
+           AND (COALESCE(l.valor_pago, 0), l.valor_pendente, l.valor_vencido)
+               IS DISTINCT FROM (COALESCE(t.valor_pago, 0), COALESCE(t.valor_pendente, 0), COALESCE(t.valor_vencido, 0))
+    """)
+    return cur.rowcount
@@ -0,0 +1,147 @@
+# gunicorn.conf.py
+# Perfil de produção do gunicorn (lido automaticamente por `gunicorn app:app`).
+#
+# As rotas que ainda falam com o Asaas no request (criar/buscar cliente,
+# sincronizar boletos) ficam até ASAAS_READ_TIMEOUT esperando a rede. Com
+# workers sync cada uma delas prende um processo inteiro; os perfis abaixo
+# deixam o worker atender outros requests enquanto isso:
+#
+#   GUNICORN_PERFIL=gthread (padrão)  GUNICORN_THREADS threads por worker
+#   GUNICORN_PERFIL=gevent            GUNICORN_CONEXOES greenlets por worker (requer gevent e psycogreen)
+#   GUNICORN_PERFIL=sync              um request por processo (comportamento antigo)
+#
+# Workers: WEB_CONCURRENCY ou GUNICORN_WORKERS; sem isso, autoajuste pela cota
+# de CPU do contêiner (cgroup) limitado pela memória disponível dividida por
+# GUNICORN_MEMORIA_WORKER_MB. O app é carregado no master (preload) e dividido
+# por copy-on-write; pool do banco, cliente do Asaas e threads de fundo já são
+# recriados por pid depois do fork.
+#
+# O pool do banco (DB_POOL_MAX) e o keep-alive do Asaas (ASAAS_POOL_MAXSIZE) são
+# por worker e, se não vierem do ambiente, acompanham a concorrência do perfil:
+# a conexão do request fica presa a ele até o fim, inclusive durante a chamada
+# ao Asaas. Total no Postgres: workers x DB_POOL_MAX (+1 do líder do agendador).
+#
+# gevent: o monkey patch acontece aqui, antes do preload importar requests e
+# psycopg2, e o psycogreen torna o psycopg2 cooperativo. Nesse modo o
+# psycopg2 não aceita COPY (copy_expert), e código que o use precisa de
+# alternativa.
+import math
+import os
+
+PERFIS = ("gthread", "gevent", "sync")
+
+
+def _ler(caminho):
+    try:
+        with open(caminho, encoding="ascii") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpus_disponiveis():
+    """Núcleos que o processo pode usar: cota do cgroup (v2 ou v1) ou afinidade."""
+    cota = _ler("/sys/fs/cgroup/cpu.max")
+    if cota and not cota.startswith("max"):
+        limite, periodo = cota.split()
+        return max(1, math.ceil(int(limite) / int(periodo)))
+    limite, periodo = _ler("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _ler("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if limite and periodo and int(limite) > 0:
+        return max(1, math.ceil(int(limite) / int(periodo)))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memoria_disponivel_mb():
+    """Limite de memória do cgroup, ou a RAM total quando não há limite (ou é maior que ela)."""
+    total = None
+    for linha in (_ler("/proc/meminfo") or "").splitlines():
+        if linha.startswith("MemTotal:"):
+            total = int(linha.split()[1]) // 1024
+    for caminho in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        limite = _ler(caminho)
+        if limite and limite.isdigit():
+            limite = int(limite) // (1024 * 1024)
+            total = min(total, limite) if total else limite
+            break
+    return total
+
+
+def workers_automaticos(perfil, cpus, memoria_mb, memoria_worker_mb):
+    # Processos com threads/greenlets já esperam I/O em paralelo: gevent só precisa de um por núcleo (+1)
+    por_cpu = cpus + 1 if perfil == "gevent" else 2 * cpus + 1
+    if not memoria_mb:
+        return por_cpu
+    # Uma fatia fica para o master (app pré-carregado) e os processos de fotos
+    por_memoria = (memoria_mb - memoria_worker_mb) // memoria_worker_mb
+    return max(1, min(por_cpu, por_memoria))
+
+
+perfil = os.getenv("GUNICORN_PERFIL", "gthread").lower()
+if perfil not in PERFIS:
+    raise RuntimeError(f"GUNICORN_PERFIL inválido: {perfil!r} (use {', '.join(PERFIS)})")
+
+if perfil == "gevent":
+    try:
+        from gevent import monkey
+        from psycogreen.gevent import patch_psycopg
+    except ImportError as e:
+        raise RuntimeError("GUNICORN_PERFIL=gevent requer os pacotes gevent e psycogreen") from e
+    monkey.patch_all()
+    patch_psycopg()
+
+_cpus = cpus_disponiveis()
+_memoria = memoria_disponivel_mb()
+_memoria_worker = int(os.getenv("GUNICORN_MEMORIA_WORKER_MB", "256"))
+
+workers = int(
+    os.getenv("GUNICORN_WORKERS")
+    or os.getenv("WEB_CONCURRENCY")
+    or workers_automaticos(perfil, _cpus, _memoria, _memoria_worker)
+)
+worker_class = perfil
+threads = int(os.getenv("GUNICORN_THREADS", "8")) if perfil == "gthread" else 1
+worker_connections = int(os.getenv("GUNICORN_CONEXOES", "100"))
+
+# Concorrência por worker -> pools por worker (só se o ambiente não definiu)
+if perfil == "gthread":
+    os.environ.setdefault("DB_POOL_MAX", str(threads + 3))  # +3: consumidor do webhook, outbox do Asaas e agendador
+    os.environ.setdefault("ASAAS_POOL_MAXSIZE", str(threads))
+elif perfil == "gevent":
+    # Greenlets acima do pool esperam uma conexão (DB_POOL_TIMEOUT); o Postgres não aguenta 100 por worker
+    os.environ.setdefault("DB_POOL_MAX", os.getenv("GUNICORN_DB_POOL", "20"))
+    os.environ.setdefault("ASAAS_POOL_MAXSIZE", os.getenv("GUNICORN_DB_POOL", "20"))
+
+# Com vários workers, o cache de referências (referencias.py) divide versões e valores por um SQLite em tmpfs
+if workers > 1 and os.path.isdir("/dev/shm"):
+    os.environ.setdefault("REFERENCIAS_CACHE_COMPARTILHADO", "/dev/shm/motorental-referencias.sqlite3")
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# No gthread/gevent o timeout é o heartbeat do worker; no sync tem de cobrir a chamada mais lenta ao Asaas
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))  # atrás do proxy do Render
+# Recicla workers aos poucos (vazamentos de memória de libs nativas); jitter evita reiniciar todos juntos
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+# Heartbeat em tmpfs: disco lento do contêiner não deve parecer worker travado
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+accesslog = os.getenv("GUNICORN_ACCESSLOG") or None
+
+
+def when_ready(server):
+    server.log.info(
+        "Perfil %s: %s worker(s) x %s, DB_POOL_MAX=%s por worker (CPUs: %s, memória: %s MB)",
+        perfil, workers, threads if perfil == "gthread" else (worker_connections if perfil == "gevent" else 1),
+        os.environ.get("DB_POOL_MAX", "padrão"), _cpus, _memoria or "?",
+    )
+
+
+def post_worker_init(worker):
+    # App já carregado (no master, com preload): sobe as threads de fundo deste worker
+    # já no boot, e não só no primeiro request (app.iniciar_threads)
+    from app import iniciar_threads
+    iniciar_threads()
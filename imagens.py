@@ -0,0 +1,176 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from psycopg2.extras import Json
+
+import armazenamento
+import metrics
+from config import Config
+from database import get_db_connection
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # sem Pillow as fotos ficam só com o original
+    Image = ImageOps = None
+
+# Pipeline das fotos de motos.
+#
+# O upload grava o original no armazenamento e devolve a resposta; um pool de
+# processos (IMAGEM_WORKERS) aplica a rotação indicada no EXIF, regrava o
+# original sem EXIF e gera as variantes de VARIANTES em JPEG e WebP. Tudo
+# volta para o armazenamento (endereçado por conteúdo) e as chaves vão para
+# moto_imagens.arquivo/variantes; enquanto variantes estiver NULL os
+# templates usam o original. O original com EXIF fica órfão e sai na
+# limpeza de arquivos.
+
+VARIANTES = (("thumb", 320), ("medio", 800), ("grande", 1600))
+FORMATOS = (("jpeg", "jpg"), ("webp", "webp"))
+
+PROCESSADAS = metrics.counter("imagens_processadas_total", "Fotos de motos processadas, por resultado", ("resultado",))
+DURACAO = metrics.histogram("imagens_processamento_segundos", "Tempo do envio ao fim do processamento de uma foto")
+
+
+def disponivel():
+    return Image is not None
+
+
+def _rgb(im):
+    if im.mode in ("RGB", "L"):
+        return im
+    if im.mode in ("RGBA", "LA", "P"):
+        im = im.convert("RGBA")
+        fundo = Image.new("RGB", im.size, (255, 255, 255))
+        fundo.paste(im, mask=im.split()[-1])
+        return fundo
+    return im.convert("RGB")
+
+
+def gerar_variantes(origem, destino, qualidade=82):
+    """Roda num processo do pool. Grava em `destino` o original sem EXIF e as variantes.
+
+    Retorna {"original": caminho, "thumb": {"jpeg": caminho, "webp": caminho, "largura": .., "altura": ..}, ...}.
+    """
+    with Image.open(origem) as aberta:
+        formato = aberta.format
+        im = ImageOps.exif_transpose(aberta)
+        im.load()
+
+    # Original sem EXIF (o Pillow só grava EXIF quando pedido)
+    if formato == "PNG":
+        original = os.path.join(destino, "original.png")
+        im.save(original, "PNG", optimize=True)
+    else:
+        im = _rgb(im)
+        original = os.path.join(destino, "original.jpg")
+        im.save(original, "JPEG", quality=90, optimize=True)
+
+    rgb = _rgb(im)
+    resultado = {"original": original}
+    for nome, lado in VARIANTES:
+        copia = rgb.copy()
+        copia.thumbnail((lado, lado), Image.LANCZOS)
+        variante = {"largura": copia.width, "altura": copia.height}
+        for fmt, ext in FORMATOS:
+            caminho = os.path.join(destino, f"{nome}.{ext}")
+            if fmt == "webp":
+                copia.save(caminho, "WEBP", quality=qualidade, method=4)
+            else:
+                copia.save(caminho, "JPEG", quality=qualidade, optimize=True, progressive=True)
+            variante[fmt] = caminho
+        resultado[nome] = variante
+        if max(rgb.size) <= lado:
+            break  # variantes maiores seriam cópias desta
+    return resultado
+
+
+# ====
+# Pool de processos
+# ====
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn: o worker web tem threads (pool de conexões, fila do webhook), e fork com threads é frágil
+            _pool = ProcessPoolExecutor(
+                max_workers=Config.IMAGEM_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def _registrar(imagem_id, pasta, inicio, fut):
+    # Chamado pela thread do executor quando o processo termina
+    DURACAO.observe(time.monotonic() - inicio)
+    conn = None
+    try:
+        gerado = fut.result()
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            original = armazenamento.salvar_caminho(cur, gerado.pop("original")).chave
+            variantes = {}
+            for nome, v in gerado.items():
+                variantes[nome] = dict(v, **{fmt: armazenamento.salvar_caminho(cur, v[fmt]).chave for fmt, _ in FORMATOS})
+            cur.execute(
+                "UPDATE moto_imagens SET arquivo=%s, variantes=%s WHERE id=%s",
+                (original, Json(variantes), imagem_id),
+            )
+            conn.commit()
+        finally:
+            cur.close()
+        PROCESSADAS.inc(resultado="ok")
+    except Exception:
+        if conn is not None:
+            conn.rollback()
+        PROCESSADAS.inc(resultado="erro")
+        logging.exception("Erro ao processar a imagem %s", imagem_id)
+    finally:
+        if conn is not None:
+            conn.close()
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+def processar_em_background(imagens):
+    """Agenda [(imagem_id, chave), ...] no pool. Os registros já devem estar commitados."""
+    if not disponivel() or not imagens:
+        return []
+    pool = _get_pool()
+    futuros = []
+    for imagem_id, chave in imagens:
+        pasta = tempfile.mkdtemp(prefix="imagem-")
+        try:
+            with armazenamento.caminho_local(chave) as caminho:
+                origem = os.path.join(pasta, os.path.basename(chave))
+                try:
+                    os.link(caminho, origem)  # mesmo disco: sem cópia
+                except OSError:
+                    shutil.copyfile(caminho, origem)
+        except Exception:
+            shutil.rmtree(pasta, ignore_errors=True)
+            logging.exception("Imagem %s indisponível para processamento", imagem_id)
+            continue
+        fut = pool.submit(gerar_variantes, origem, pasta, Config.IMAGEM_QUALIDADE)
+        fut.add_done_callback(partial(_registrar, imagem_id, pasta, time.monotonic()))
+        futuros.append(fut)
+    return futuros
+
+
+def encerrar():
+    """Espera as fotos em processamento (e o registro delas) e fecha o pool."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and _pool_pid == os.getpid():
+        pool.shutdown(wait=True)
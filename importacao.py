@@ -0,0 +1,740 @@
+import codecs
+import csv
+import datetime as dt
+import io
+import logging
+import re
+import time
+import unicodedata
+from collections import namedtuple
+
+from psycopg2.extensions import get_wait_callback
+from psycopg2.extras import Json, execute_values
+
+import asaas_client
+import consumidor
+import dashboard_metrics
+import metrics
+import referencias
+from config import Config
+from database import get_db_connection
+
+# Importação de motos e clientes por planilha (CSV).
+#
+# O arquivo é lido em streaming: cada linha é validada e normalizada (placa,
+# CPF com dígito verificador, email, datas dd/mm/aaaa...) e as válidas seguem
+# direto para um COPY numa tabela temporária, sem montar a planilha inteira em
+# memória. A mescla com as tabelas de verdade é feita em SQL, numa transação:
+#
+#   motos     INSERT ... ON CONFLICT (placa) DO UPDATE
+#   clientes  cada linha é ligada ao cadastro existente pelo CPF (dígitos) ou
+#             pelo email; se os dois apontam para clientes diferentes, a linha
+#             vai para o relatório de erros. As ligadas viram UPDATE, as outras
+#             INSERT ... ON CONFLICT DO NOTHING (guarda contra cadastro
+#             concorrente pelo formulário).
+#
+# Células vazias em colunas opcionais não apagam o que já está cadastrado, e
+# linhas sem diferença não são regravadas: reimportar o mesmo arquivo não muda
+# nada. As linhas recusadas ficam em importacao_erros com os valores
+# originais; o relatório (CSV) traz as mesmas colunas do arquivo e pode ser
+# corrigido e importado de novo.
+#
+# Clientes novos podem entrar em clientes_asaas_fila: a tarefa clientes_asaas
+# do agendador cadastra no Asaas em lotes (CLIENTES_ASAAS_LOTE), um por
+# transação, com backoff em caso de erro.
+#
+# Com o psycopg2 cooperativo (gunicorn gevent + psycogreen) o COPY não é
+# aceito; nesse caso as linhas entram na tabela temporária por INSERTs em lote.
+
+TIPOS = ("motos", "clientes")
+AMOSTRA = 64 * 1024  # bytes lidos para descobrir codificação e separador
+LOTE = 1000  # linhas por INSERT quando o COPY não está disponível
+
+IMPORTADAS = metrics.counter(
+    "importacao_linhas_total", "Linhas de planilhas importadas, por resultado", ("tipo", "resultado")
+)
+CLIENTES_ASAAS = metrics.counter(
+    "importacao_clientes_asaas_total", "Clientes importados enviados ao Asaas, por resultado", ("resultado",)
+)
+
+
+class ImportacaoInvalida(Exception):
+    """O arquivo inteiro foi recusado (cabeçalho, codificação, erros demais)."""
+
+
+Campo = namedtuple("Campo", "nome obrigatorio converter apelidos")
+Erro = namedtuple("Erro", "linha campo mensagem dados")
+
+
+# ====
+# Validação das células
+# ====
+_NAO_DIGITO = re.compile(r"\D")
+_PLACA = re.compile(r"^[A-Z]{3}[0-9][A-Z0-9][0-9]{2}$")  # antiga (ABC1234) e Mercosul (ABC1D23)
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+_SIM = {"sim", "s", "true", "1", "x", "disponivel", "yes"}
+_NAO = {"nao", "n", "false", "0", "bloqueada", "indisponivel", "no"}
+
+
+def _sem_acento(texto):
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii")
+
+
+def normalizar_titulo(titulo):
+    """'Data de Nascimento' -> 'data_de_nascimento'."""
+    return re.sub(r"[^a-z0-9]+", "_", _sem_acento(titulo).strip().lower()).strip("_")
+
+
+def _placa(valor):
+    placa = re.sub(r"[\s-]", "", valor).upper()
+    if not _PLACA.match(placa):
+        raise ValueError(f"placa inválida: {valor}")
+    return placa
+
+
+def _texto(valor):
+    return valor
+
+
+def _ano(valor):
+    try:
+        ano = int(valor)
+    except ValueError:
+        raise ValueError(f"ano inválido: {valor}") from None
+    if not 1900 <= ano <= dt.date.today().year + 1:
+        raise ValueError(f"ano fora do intervalo: {ano}")
+    return ano
+
+
+def _booleano(valor):
+    texto = _sem_acento(valor).strip().lower()
+    if texto in _SIM:
+        return True
+    if texto in _NAO:
+        return False
+    raise ValueError(f"use sim ou não: {valor}")
+
+
+def _email(valor):
+    if not _EMAIL.match(valor):
+        raise ValueError(f"email inválido: {valor}")
+    return valor.lower()
+
+
+def _telefone(valor):
+    digitos = _NAO_DIGITO.sub("", valor)
+    if len(digitos) in (12, 13) and digitos.startswith("55"):
+        digitos = digitos[2:]
+    if len(digitos) not in (10, 11):
+        raise ValueError(f"telefone inválido (DDD + número): {valor}")
+    return valor
+
+
+def _cpf(valor):
+    d = _NAO_DIGITO.sub("", valor)
+    if len(d) != 11 or d == d[0] * 11:
+        raise ValueError(f"CPF inválido: {valor}")
+    for n in (9, 10):
+        dv = sum(int(d[i]) * (n + 1 - i) for i in range(n)) * 10 % 11 % 10
+        if dv != int(d[n]):
+            raise ValueError(f"CPF inválido (dígito verificador): {valor}")
+    return f"{d[:3]}.{d[3:6]}.{d[6:9]}-{d[9:]}"  # mesma máscara do formulário
+
+
+def _data(valor):
+    for formato in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"):
+        try:
+            data = dt.datetime.strptime(valor, formato).date()
+        except ValueError:
+            continue
+        if data.year < 1900 or data > dt.date.today():
+            raise ValueError(f"data fora do intervalo: {valor}")
+        return data
+    raise ValueError(f"data inválida (use dd/mm/aaaa): {valor}")
+
+
+# Ordem das colunas = ordem da tabela temporária e do modelo para download
+CAMPOS = {
+    "motos": (
+        Campo("placa", True, _placa, ()),
+        Campo("modelo", True, _texto, ("moto", "marca_modelo")),
+        Campo("ano", False, _ano, ("ano_modelo", "ano_fabricacao")),
+        Campo("disponivel", False, _booleano, ("disponibilidade", "situacao")),
+    ),
+    "clientes": (
+        Campo("nome", True, _texto, ("nome_completo", "cliente")),
+        Campo("email", True, _email, ("e_mail",)),
+        Campo("telefone", True, _telefone, ("celular", "fone", "whatsapp")),
+        Campo("cpf", False, _cpf, ("documento",)),
+        Campo("endereco", False, _texto, ()),
+        Campo("data_nascimento", False, _data, ("nascimento", "data_de_nascimento")),
+        Campo("observacoes", False, _texto, ("observacao", "obs")),
+    ),
+}
+
+# Chaves que não podem se repetir dentro do arquivo
+UNICOS = {"motos": ("placa",), "clientes": ("cpf", "email")}
+
+MODELOS = {
+    "motos": (("ABC1D23", "Honda CG 160 Fan", "2023", "sim"),),
+    "clientes": (("Maria da Silva", "maria@example.com", "(11) 98765-4321", "529.982.247-25",
+                  "Rua das Flores, 100", "15/03/1990", ""),),
+}
+
+
+def modelo_csv(tipo, saida):
+    """Planilha de exemplo com o cabeçalho esperado."""
+    escritor = csv.writer(saida, delimiter=";")
+    escritor.writerow(c.nome for c in CAMPOS[tipo])
+    escritor.writerows(MODELOS[tipo])
+
+
+# ====
+# Leitura do arquivo
+# ====
+class _Encadeado(io.RawIOBase):
+    """Devolve a amostra já lida e depois o resto do arquivo (que pode não ter seek)."""
+
+    def __init__(self, amostra, arquivo):
+        self._amostra = amostra
+        self._arquivo = arquivo
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        if self._amostra:
+            n = min(len(destino), len(self._amostra))
+            destino[:n] = self._amostra[:n]
+            self._amostra = self._amostra[n:]
+            return n
+        dados = self._arquivo.read(len(destino))
+        destino[:len(dados)] = dados
+        return len(dados)
+
+
+def _codificacao(amostra):
+    if amostra.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    # A amostra pode terminar no meio de um caractere de vários bytes
+    for corte in range(4):
+        try:
+            amostra[:len(amostra) - corte].decode("utf-8")
+            return "utf-8"
+        except UnicodeDecodeError:
+            continue
+    return "cp1252"  # "CSV (separado por vírgulas)" do Excel em português
+
+
+def _abrir(arquivo):
+    """(cabeçalho, leitor csv) de um arquivo binário, com codificação e separador detectados."""
+    amostra = arquivo.read(AMOSTRA)
+    codificacao = _codificacao(amostra)
+    primeira = amostra.decode(codificacao, "ignore").lstrip("\ufeff").splitlines()[:1]
+    # Excel em português salva com ";"; o separador é o mais frequente no cabeçalho
+    separador = max(";,\t", key=primeira[0].count) if primeira and primeira[0] else ";"
+
+    texto = io.TextIOWrapper(io.BufferedReader(_Encadeado(amostra, arquivo)), encoding=codificacao, newline="")
+    leitor = csv.reader(texto, delimiter=separador)
+    try:
+        cabecalho = next(leitor)
+    except StopIteration:
+        raise ImportacaoInvalida("Arquivo vazio.") from None
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ImportacaoInvalida(f"Não foi possível ler o arquivo: {e}") from None
+    return [t.strip() for t in cabecalho], leitor
+
+
+def _posicoes(tipo, cabecalho):
+    """{campo: índice da coluna}; recusa o arquivo se falta coluna obrigatória."""
+    por_titulo = {}
+    for campo in CAMPOS[tipo]:
+        for titulo in (campo.nome,) + campo.apelidos:
+            por_titulo[titulo] = campo.nome
+    posicoes = {}
+    for i, titulo in enumerate(cabecalho):
+        nome = por_titulo.get(normalizar_titulo(titulo))
+        if nome and nome not in posicoes:
+            posicoes[nome] = i
+    faltando = [c.nome for c in CAMPOS[tipo] if c.obrigatorio and c.nome not in posicoes]
+    if faltando:
+        raise ImportacaoInvalida(
+            f"Coluna(s) obrigatória(s) ausente(s): {', '.join(faltando)}. "
+            f"Cabeçalho lido: {' | '.join(cabecalho) or '(vazio)'}"
+        )
+    return posicoes
+
+
+def _validas(tipo, cabecalho, leitor, posicoes, erros, contagem):
+    """Gera (linha, valores...) das linhas válidas; as outras vão para `erros`."""
+    campos = CAMPOS[tipo]
+    unicos = UNICOS[tipo]
+    vistas = {}  # (chave, valor) -> linha em que apareceu primeiro
+    try:
+        for valores in leitor:
+            if not any(v.strip() for v in valores):
+                continue
+            contagem["linhas"] += 1
+            numero = leitor.line_num
+            registro, problemas = {}, []
+            for campo in campos:
+                i = posicoes.get(campo.nome)
+                bruto = valores[i].strip() if i is not None and i < len(valores) else ""
+                if not bruto:
+                    registro[campo.nome] = None
+                    if campo.obrigatorio:
+                        problemas.append((campo.nome, "obrigatório"))
+                    continue
+                try:
+                    registro[campo.nome] = campo.converter(bruto)
+                except ValueError as e:
+                    problemas.append((campo.nome, str(e)))
+
+            if not problemas:
+                chaves = [(c, registro[c]) for c in unicos if registro[c] is not None]
+                for chave in chaves:
+                    if chave in vistas:
+                        problemas.append((chave[0], f"repetido no arquivo (linha {vistas[chave]})"))
+                if not problemas:
+                    for chave in chaves:
+                        vistas[chave] = numero
+
+            if problemas:
+                erros.append(Erro(
+                    numero, ", ".join(p[0] for p in problemas), "; ".join(p[1] for p in problemas),
+                    dict(zip(cabecalho, valores)),
+                ))
+                if len(erros) > Config.IMPORTACAO_MAX_ERROS:
+                    raise ImportacaoInvalida(
+                        f"Mais de {Config.IMPORTACAO_MAX_ERROS} linhas com erro; confira o formato do arquivo. "
+                        f"Primeiro erro (linha {erros[0].linha}): {erros[0].campo}: {erros[0].mensagem}"
+                    )
+                continue
+
+            contagem["validas"] += 1
+            yield (numero,) + tuple(registro[c.nome] for c in campos)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ImportacaoInvalida(f"Erro de leitura perto da linha {leitor.line_num}: {e}") from None
+
+
+# ====
+# Carga na tabela temporária
+# ====
+class _ArquivoCopy:
+    """Arquivo só de leitura para o copy_expert: escreve as linhas em CSV conforme o COPY pede."""
+
+    def __init__(self, registros):
+        self._registros = registros
+        self._buffer = io.StringIO()
+        self._escritor = csv.writer(self._buffer, lineterminator="\n")
+        self.erro = None
+
+    def read(self, tamanho=-1):
+        tamanho = tamanho if tamanho and tamanho > 0 else AMOSTRA
+        try:
+            while self._buffer.tell() < tamanho:
+                registro = next(self._registros, None)
+                if registro is None:
+                    break
+                self._escritor.writerow(registro)  # None vira campo vazio = NULL no COPY
+        except Exception as e:
+            # Exceção aqui dentro viraria um erro genérico do COPY: encerra e quem chamou relança
+            self.erro = e
+        parte = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return parte
+
+
+def _carregar(cur, tabela, colunas, registros):
+    lista = ", ".join(("linha",) + colunas)
+    if get_wait_callback() is not None:
+        # psycopg2 cooperativo (gevent): sem COPY
+        while True:
+            lote = [r for _, r in zip(range(LOTE), registros)]
+            if not lote:
+                return
+            execute_values(cur, f"INSERT INTO {tabela} ({lista}) VALUES %s", lote, page_size=LOTE)
+
+    arquivo = _ArquivoCopy(registros)
+    cur.copy_expert(f"COPY {tabela} ({lista}) FROM STDIN WITH (FORMAT csv)", arquivo)
+    if arquivo.erro is not None:
+        raise arquivo.erro
+
+
+# ====
+# Mescla
+# ====
+# Tabelas temporárias (linha = número da linha no arquivo); somem no fim da transação
+TEMPORARIAS = {
+    "motos": """
+        CREATE TEMP TABLE _importacao_motos (
+            linha INTEGER PRIMARY KEY,
+            placa TEXT NOT NULL UNIQUE,
+            modelo TEXT NOT NULL,
+            ano INTEGER,
+            disponivel BOOLEAN
+        ) ON COMMIT DROP
+    """,
+    "clientes": r"""
+        CREATE TEMP TABLE _importacao_clientes (
+            linha INTEGER PRIMARY KEY,
+            nome TEXT NOT NULL,
+            email citext NOT NULL UNIQUE,
+            telefone TEXT NOT NULL,
+            cpf TEXT,
+            endereco TEXT,
+            data_nascimento DATE,
+            observacoes TEXT,
+            cpf_digitos TEXT GENERATED ALWAYS AS (regexp_replace(COALESCE(cpf, ''), '\D', '', 'g')) STORED,
+            cliente_id INTEGER,
+            novo BOOLEAN NOT NULL DEFAULT FALSE,
+            conflito TEXT
+        ) ON COMMIT DROP
+    """,
+}
+
+
+def _mesclar_motos(cur, resultado):
+    # disponivel vazio: moto nova entra disponível, existente mantém a situação
+    cur.execute("""
+        INSERT INTO motos AS m (placa, modelo, ano, disponivel)
+        SELECT placa, modelo, ano, COALESCE(disponivel, TRUE) FROM _importacao_motos ORDER BY linha
+        ON CONFLICT (placa) DO UPDATE
+           SET modelo = EXCLUDED.modelo,
+               ano = COALESCE(EXCLUDED.ano, m.ano),
+               disponivel = COALESCE(
+                   (SELECT s.disponivel FROM _importacao_motos s WHERE s.placa = EXCLUDED.placa), m.disponivel)
+         WHERE (m.modelo, m.ano, m.disponivel) IS DISTINCT FROM (
+               EXCLUDED.modelo, COALESCE(EXCLUDED.ano, m.ano),
+               COALESCE((SELECT s.disponivel FROM _importacao_motos s WHERE s.placa = EXCLUDED.placa), m.disponivel))
+        RETURNING m.id, (m.xmax = 0) AS inserido
+    """)
+    for r in cur.fetchall():
+        resultado["inseridos" if r["inserido"] else "atualizados"] += 1
+        if not r["inserido"]:
+            resultado["ids_atualizados"].append(r["id"])
+
+
+def _mesclar_clientes(cur, resultado):
+    # Cadastro existente de cada linha, pelo CPF ou pelo email
+    cur.execute("""
+        UPDATE _importacao_clientes s
+           SET cliente_id = COALESCE(a.por_cpf, a.por_email),
+               conflito = CASE WHEN a.por_cpf <> a.por_email
+                               THEN format('CPF já é do cliente #%s e o email do cliente #%s', a.por_cpf, a.por_email)
+                          END
+          FROM (
+              SELECT s2.linha,
+                     (SELECT c.id FROM clientes c
+                       WHERE s2.cpf IS NOT NULL AND c.cpf_digitos = s2.cpf_digitos
+                       ORDER BY c.id LIMIT 1) AS por_cpf,
+                     (SELECT c.id FROM clientes c WHERE c.email = s2.email) AS por_email
+                FROM _importacao_clientes s2
+          ) a
+         WHERE a.linha = s.linha
+    """)
+    # Duas linhas (uma pelo CPF, outra pelo email) apontando para o mesmo cliente
+    cur.execute("""
+        UPDATE _importacao_clientes s
+           SET conflito = format('mesmo cliente (#%s) da linha %s', d.cliente_id, d.primeira)
+          FROM (
+              SELECT linha, cliente_id, MIN(linha) OVER (PARTITION BY cliente_id) AS primeira
+                FROM _importacao_clientes
+               WHERE cliente_id IS NOT NULL AND conflito IS NULL
+          ) d
+         WHERE d.linha = s.linha AND d.linha > d.primeira
+    """)
+
+    # Existentes: campos opcionais vazios mantêm o cadastro; sem diferença, sem UPDATE
+    cur.execute("""
+        UPDATE clientes c
+           SET nome = s.nome, email = s.email, telefone = s.telefone,
+               cpf = CASE WHEN s.cpf IS NULL OR c.cpf_digitos = s.cpf_digitos THEN c.cpf ELSE s.cpf END,
+               endereco = COALESCE(s.endereco, c.endereco),
+               data_nascimento = COALESCE(s.data_nascimento, c.data_nascimento),
+               observacoes = COALESCE(s.observacoes, c.observacoes)
+          FROM _importacao_clientes s
+         WHERE s.cliente_id = c.id AND s.conflito IS NULL
+           AND (c.nome, c.email, c.telefone, c.cpf_digitos, c.endereco, c.data_nascimento, c.observacoes)
+               IS DISTINCT FROM
+               (s.nome, s.email, s.telefone, COALESCE(NULLIF(s.cpf_digitos, ''), c.cpf_digitos),
+                COALESCE(s.endereco, c.endereco), COALESCE(s.data_nascimento, c.data_nascimento),
+                COALESCE(s.observacoes, c.observacoes))
+        RETURNING c.id
+    """)
+    resultado["ids_atualizados"] = [r["id"] for r in cur.fetchall()]
+    resultado["atualizados"] = len(resultado["ids_atualizados"])
+
+    # Novos; o ON CONFLICT cobre quem foi cadastrado pelo formulário durante a importação
+    cur.execute("""
+        WITH novos AS (
+            INSERT INTO clientes (nome, email, telefone, cpf, endereco, data_nascimento, observacoes)
+            SELECT nome, email, telefone, cpf, endereco, data_nascimento, observacoes
+              FROM _importacao_clientes
+             WHERE cliente_id IS NULL AND conflito IS NULL
+             ORDER BY linha
+            ON CONFLICT DO NOTHING
+            RETURNING id, email
+        )
+        UPDATE _importacao_clientes s
+           SET cliente_id = n.id, novo = TRUE
+          FROM novos n
+         WHERE s.email = n.email AND s.cliente_id IS NULL
+    """)
+    resultado["inseridos"] = cur.rowcount
+    cur.execute("""
+        UPDATE _importacao_clientes
+           SET conflito = 'CPF ou email cadastrado por outro usuário durante a importação'
+         WHERE cliente_id IS NULL AND conflito IS NULL
+    """)
+
+
+MESCLAS = {"motos": _mesclar_motos, "clientes": _mesclar_clientes}
+
+
+# ====
+# Importação
+# ====
+def importar(conn, tipo, arquivo, nome_arquivo=None, origem="web", asaas=False, simular=False):
+    """Importa o CSV `arquivo` (binário) numa transação de `conn`.
+
+    asaas: enfileira os clientes novos para cadastro no Asaas.
+    simular: valida e mescla, mas desfaz tudo no fim (prévia dos totais e erros).
+    Retorna um dict com id, linhas, inseridos, atualizados, inalterados, erros
+    (quantidade), asaas_enfileirados, duracao_ms e lista_erros. Levanta
+    ImportacaoInvalida quando o arquivo inteiro é recusado.
+    """
+    if tipo not in TIPOS:
+        raise ImportacaoInvalida(f"Tipo de importação inválido: {tipo}")
+    inicio = time.perf_counter()
+    cabecalho, leitor = _abrir(arquivo)
+    posicoes = _posicoes(tipo, cabecalho)
+
+    erros, contagem = [], {"linhas": 0, "validas": 0, "conflitos": 0}
+    resultado = {
+        "id": None, "tipo": tipo, "arquivo": nome_arquivo, "simulado": simular,
+        "inseridos": 0, "atualizados": 0, "asaas_enfileirados": 0, "ids_atualizados": [],
+    }
+    colunas = tuple(c.nome for c in CAMPOS[tipo])
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "INSERT INTO importacoes (tipo, arquivo, origem) VALUES (%s, %s, %s) RETURNING id",
+            (tipo, (nome_arquivo or "")[:255] or None, origem),
+        )
+        importacao_id = cur.fetchone()["id"]
+
+        tabela = f"_importacao_{tipo}"
+        cur.execute(TEMPORARIAS[tipo])
+        _carregar(cur, tabela, colunas, _validas(tipo, cabecalho, leitor, posicoes, erros, contagem))
+        cur.execute(f"ANALYZE {tabela}")
+        MESCLAS[tipo](cur, resultado)
+
+        if tipo == "clientes":
+            cur.execute(f"""
+                SELECT linha, conflito, {", ".join(colunas)} FROM _importacao_clientes
+                WHERE conflito IS NOT NULL ORDER BY linha
+            """)
+            for r in cur.fetchall():
+                # Com os títulos do arquivo, como os erros de validação: o relatório continua importável
+                dados = {cabecalho[i]: (r[c].strftime("%d/%m/%Y") if isinstance(r[c], dt.date) else r[c] or "")
+                         for c, i in posicoes.items()}
+                erros.append(Erro(r["linha"], "cpf, email", r["conflito"], dados))
+                contagem["conflitos"] += 1
+            erros.sort(key=lambda e: e.linha)
+
+            if asaas:
+                cur.execute("""
+                    INSERT INTO clientes_asaas_fila (cliente_id, importacao_id)
+                    SELECT cliente_id, %s FROM _importacao_clientes WHERE novo
+                    ON CONFLICT (cliente_id) DO NOTHING
+                """, (importacao_id,))
+                resultado["asaas_enfileirados"] = cur.rowcount
+
+        if erros:
+            execute_values(cur, """
+                INSERT INTO importacao_erros (importacao_id, linha, campo, mensagem, dados) VALUES %s
+            """, [(importacao_id, e.linha, e.campo[:50], e.mensagem, Json(e.dados)) for e in erros], page_size=LOTE)
+
+        resultado.update(
+            linhas=contagem["linhas"],
+            erros=len(erros),
+            inalterados=contagem["validas"] - contagem["conflitos"] - resultado["inseridos"] - resultado["atualizados"],
+            duracao_ms=int((time.perf_counter() - inicio) * 1000),
+        )
+        cur.execute("""
+            UPDATE importacoes
+               SET linhas = %(linhas)s, inseridos = %(inseridos)s, atualizados = %(atualizados)s,
+                   inalterados = %(inalterados)s, erros = %(erros)s,
+                   asaas_enfileirados = %(asaas_enfileirados)s, duracao_ms = %(duracao_ms)s
+             WHERE id = %(id)s
+        """, dict(resultado, id=importacao_id))
+
+        if simular:
+            conn.rollback()
+        else:
+            conn.commit()
+            resultado["id"] = importacao_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    resultado["lista_erros"] = erros
+    if not simular:
+        _depois_do_commit(tipo, resultado)
+    logging.info(
+        "Importação de %s%s (%s): %s linha(s), %s nova(s), %s atualizada(s), %s inalterada(s), %s erro(s) em %s ms",
+        tipo, " simulada" if simular else "", nome_arquivo or "-", resultado["linhas"], resultado["inseridos"],
+        resultado["atualizados"], resultado["inalterados"], resultado["erros"], resultado["duracao_ms"],
+    )
+    return resultado
+
+
+def _depois_do_commit(tipo, resultado):
+    for chave in ("inseridos", "atualizados", "inalterados", "erros"):
+        if resultado[chave]:
+            IMPORTADAS.inc(resultado[chave], tipo=tipo, resultado=chave)
+    if not (resultado["inseridos"] or resultado["atualizados"]):
+        return
+    singular = tipo[:-1]  # moto:<id>, cliente:<id>
+    referencias.invalidar(tipo, *(f"{singular}:{i}" for i in resultado["ids_atualizados"]))
+    dashboard_metrics.invalidate()
+
+
+def erros_da_importacao(cur, importacao_id, limite=None):
+    cur.execute("""
+        SELECT linha, campo, mensagem, dados FROM importacao_erros
+        WHERE importacao_id = %s ORDER BY linha, id LIMIT %s
+    """, (importacao_id, limite))
+    return [Erro(r["linha"], r["campo"], r["mensagem"], r["dados"] or {}) for r in cur.fetchall()]
+
+
+def relatorio_csv(erros, saida):
+    """Relatório de erros: linha, campo e erro, seguidos das colunas originais da linha."""
+    originais = []
+    for e in erros:
+        for titulo in e.dados:
+            if titulo not in originais:
+                originais.append(titulo)
+    saida.write("\ufeff")  # Excel reconhece o UTF-8
+    escritor = csv.writer(saida, delimiter=";")
+    escritor.writerow(["linha", "campo", "erro"] + originais)
+    for e in erros:
+        escritor.writerow([e.linha, e.campo, e.mensagem] + [e.dados.get(t) or "" for t in originais])
+
+
+# ====
+# Cadastro no Asaas dos clientes importados
+# ====
+def _backoff(tentativas):
+    return consumidor.backoff(tentativas, Config.CLIENTES_ASAAS_BACKOFF_BASE)
+
+
+def _resposta(resp):
+    if resp.status_code not in (200, 201):
+        raise asaas_client.AsaasError(resp.status_code, resp.text[:1000])
+    return resp.json()
+
+
+def _cadastrar_no_asaas(cliente):
+    """Id do cliente no Asaas: o cadastro existente (CPF, depois email) ou um novo. Retorna (id, criado)."""
+    cpf = _NAO_DIGITO.sub("", cliente["cpf"] or "")
+    buscas = ([{"cpfCnpj": cpf}] if cpf else []) + [{"email": cliente["email"]}]
+    for params in buscas:
+        existentes = _resposta(asaas_client.get("/customers", params=params)).get("data") or []
+        if existentes:
+            return existentes[0]["id"], False
+    criado = _resposta(asaas_client.post("/customers", json={
+        "name": cliente["nome"],
+        "email": cliente["email"],
+        "phone": cliente["telefone"],
+        "cpfCnpj": cpf or None,
+        "address": cliente["endereco"],
+        "notificationDisabled": False,
+    }))
+    if not criado.get("id"):
+        raise RuntimeError(f"Resposta do Asaas sem id do cliente: {criado}")
+    return criado["id"], True
+
+
+def enviar_um_cliente_asaas():
+    """Cadastra no Asaas o próximo cliente da fila, numa transação própria.
+
+    Retorna "criado", "vinculado" (já existia no Asaas), "erro" ou None se a fila está vazia.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT f.cliente_id, f.tentativas, c.nome, c.email, c.telefone, c.cpf, c.endereco, c.asaas_id
+            FROM clientes_asaas_fila f
+            JOIN clientes c ON c.id = f.cliente_id
+            WHERE f.proxima_tentativa <= CURRENT_TIMESTAMP
+            ORDER BY f.proxima_tentativa, f.cliente_id
+            LIMIT 1
+            FOR UPDATE OF f SKIP LOCKED
+        """)
+        cliente = cur.fetchone()
+        if cliente is None:
+            conn.commit()
+            return None
+
+        cur.execute("SAVEPOINT clientes_asaas")
+        try:
+            if cliente["asaas_id"]:
+                situacao = "vinculado"  # cadastrado por outro caminho enquanto esperava
+            else:
+                asaas_id, criado = _cadastrar_no_asaas(cliente)
+                cur.execute("UPDATE clientes SET asaas_id = %s WHERE id = %s AND asaas_id IS NULL",
+                            (asaas_id, cliente["cliente_id"]))
+                situacao = "criado" if criado else "vinculado"
+            cur.execute("DELETE FROM clientes_asaas_fila WHERE cliente_id = %s", (cliente["cliente_id"],))
+            cur.execute("RELEASE SAVEPOINT clientes_asaas")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT clientes_asaas")
+            tentativas = cliente["tentativas"] + 1
+            cur.execute("""
+                UPDATE clientes_asaas_fila
+                   SET tentativas = %s, ultimo_erro = %s,
+                       proxima_tentativa = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                 WHERE cliente_id = %s
+            """, (tentativas, repr(e)[:2000], _backoff(tentativas), cliente["cliente_id"]))
+            situacao = "erro"
+            logging.warning("Cliente %s não cadastrado no Asaas (tentativa %s): %s",
+                            cliente["cliente_id"], tentativas, e)
+        conn.commit()
+        CLIENTES_ASAAS.inc(resultado=situacao)
+        return situacao
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+
+def enviar_clientes_asaas(limite):
+    """Cadastra até `limite` clientes da fila. Retorna a contagem por situação."""
+    totais = {"criados": 0, "vinculados": 0, "erros": 0}
+    chaves = {"criado": "criados", "vinculado": "vinculados", "erro": "erros"}
+    for _ in range(limite):
+        situacao = enviar_um_cliente_asaas()
+        if situacao is None:
+            break
+        totais[chaves[situacao]] += 1
+    return totais
+
+
+def fila_asaas(cur, importacao_id):
+    """Clientes da importação ainda à espera do Asaas (para a tela de resultado)."""
+    cur.execute("""
+        SELECT f.cliente_id, c.nome, f.tentativas, f.proxima_tentativa, f.ultimo_erro
+        FROM clientes_asaas_fila f
+        JOIN clientes c ON c.id = f.cliente_id
+        WHERE f.importacao_id = %s
+        ORDER BY f.cliente_id
+    """, (importacao_id,))
+    return cur.fetchall()
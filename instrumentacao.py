@@ -0,0 +1,162 @@
+import logging
+import re
+import time
+
+from flask import g, has_request_context, request
+from psycopg2 import sql as pg_sql
+
+import linhas
+import metrics
+from config import Config
+
+# Instrumentação transversal: tempo de cada request (por blueprint/endpoint),
+# de cada comando SQL (cursor instrumentado, usado por todas as conexões do
+# pool) e das chamadas ao Asaas feitas durante o request. Tudo sai em /metrics;
+# comandos acima de SLOW_QUERY_MS vão para o log "motorental.sql" com os
+# parâmetros trocados pelo tipo (nada de CPF, e-mail ou valores no log).
+# Comandos sem parâmetros (execute_values e mogrify já mandam os valores
+# dentro do texto) saem com as strings e os números do texto trocados por "?".
+#
+# As métricas de SQL levam o endpoint que as disparou, então
+#   topk(5, sum by (endpoint, operacao) (rate(db_query_seconds_sum[5m])))
+# mostra direto se o peso está nos COUNTs do dashboard ou no JOIN das locações.
+# Fora de um request (CLI, threads de sincronização) o endpoint é "-".
+
+REQUISICOES = metrics.histogram(
+    "http_request_seconds", "Duração dos requests por blueprint/endpoint",
+    ("method", "blueprint", "endpoint", "status"),
+)
+SQL = metrics.histogram(
+    "db_query_seconds", "Duração dos comandos SQL por endpoint e operação",
+    ("endpoint", "operacao"),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+SQL_LENTAS = metrics.counter("db_slow_queries_total", "Comandos SQL acima de SLOW_QUERY_MS", ("endpoint",))
+SQL_POR_REQUEST = metrics.histogram(
+    "http_request_db_queries", "Comandos SQL executados por request", ("endpoint",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250, 500),
+)
+SQL_TEMPO_REQUEST = metrics.histogram("http_request_db_seconds", "Tempo em SQL por request", ("endpoint",))
+ASAAS_TEMPO_REQUEST = metrics.histogram("http_request_asaas_seconds", "Tempo em chamadas ao Asaas por request", ("endpoint",))
+
+logger = logging.getLogger("motorental.sql")
+
+_ESPACOS = re.compile(r"\s+")
+# Literais no texto do SQL: strings ('' é aspa escapada) e números soltos (não os de identificadores)
+_LITERAIS = re.compile(r"'(?:[^']|'')*'|(?<![\w.$])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.])")
+
+
+def _endpoint():
+    if has_request_context():
+        return request.endpoint or "nao_encontrado"
+    return "-"
+
+
+def _acumulado():
+    # Totais do request atual (None fora de um request)
+    if has_request_context():
+        return g.get("_instrumentacao")
+    return None
+
+
+def somar(tipo, duracao):
+    """Soma `duracao` ao total do request atual; tipo é "sql" ou "asaas"."""
+    acumulado = _acumulado()
+    if acumulado is not None:
+        acumulado[tipo] += duracao
+        if tipo == "sql":
+            acumulado["queries"] += 1
+
+
+def _operacao(texto):
+    palavra = texto.lstrip(" (\n\t").split(None, 1)[:1]
+    return palavra[0].upper() if palavra else "-"
+
+
+def _redigir(params):
+    # Mantém a forma (quantidade, nomes, tipos) e descarta os valores
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _redigir_valor(v) for k, v in params.items()}
+    try:
+        return [_redigir_valor(v) for v in params]
+    except TypeError:
+        return _redigir_valor(params)
+
+
+def _redigir_texto(texto):
+    return _LITERAIS.sub(lambda m: "'?'" if m.group().startswith("'") else "?", texto)
+
+
+def _redigir_valor(valor):
+    if valor is None:
+        return "<NULL>"
+    if isinstance(valor, (list, tuple)):
+        return f"<{type(valor).__name__}[{len(valor)}]>"
+    return f"<{type(valor).__name__}>"
+
+
+class CursorInstrumentado(linhas.CursorLinhas):
+    """Cursor de linhas compactas (linhas.py) que mede cada execute/executemany."""
+
+    def _texto(self, query):
+        if isinstance(query, pg_sql.Composable):
+            query = query.as_string(self)
+        elif isinstance(query, bytes):
+            query = query.decode("utf-8", "replace")
+        return query
+
+    def _medir(self, metodo, query, params):
+        inicio = time.perf_counter()
+        try:
+            return metodo(query, params)
+        finally:
+            duracao = time.perf_counter() - inicio
+            texto = self._texto(query)
+            endpoint = _endpoint()
+            SQL.observe(duracao, endpoint=endpoint, operacao=_operacao(texto))
+            somar("sql", duracao)
+            if duracao * 1000 >= Config.SLOW_QUERY_MS:
+                SQL_LENTAS.inc(endpoint=endpoint)
+                if params is None:
+                    texto = _redigir_texto(texto)
+                logger.warning(
+                    "SQL lenta (%.0f ms) em %s: %s params=%s",
+                    duracao * 1000, endpoint, _ESPACOS.sub(" ", texto).strip()[:2000], _redigir(params),
+                )
+
+    def execute(self, query, vars=None):
+        return self._medir(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._medir(super().executemany, query, vars_list)
+
+
+# ====
+# Requests
+# ====
+def _inicio_request():
+    g._instrumentacao = {"inicio": time.perf_counter(), "sql": 0.0, "asaas": 0.0, "queries": 0}
+
+
+def _fim_request(response):
+    acumulado = g.pop("_instrumentacao", None)
+    if acumulado is None:
+        return response
+    endpoint = request.endpoint or "nao_encontrado"
+    # Respostas em streaming (exportações) contam só até o primeiro byte
+    REQUISICOES.observe(
+        time.perf_counter() - acumulado["inicio"],
+        method=request.method, blueprint=request.blueprint or "", endpoint=endpoint, status=response.status_code,
+    )
+    SQL_POR_REQUEST.observe(acumulado["queries"], endpoint=endpoint)
+    SQL_TEMPO_REQUEST.observe(acumulado["sql"], endpoint=endpoint)
+    if acumulado["asaas"]:
+        ASAAS_TEMPO_REQUEST.observe(acumulado["asaas"], endpoint=endpoint)
+    return response
+
+
+def init_app(app):
+    app.before_request(_inicio_request)
+    app.after_request(_fim_request)
@@ -0,0 +1,141 @@
+import functools
+from collections.abc import Mapping
+
+from psycopg2.extensions import cursor as _cursor
+
+try:
+    from _collections import _tuplegetter
+except ImportError:  # outras implementações do Python
+    def _tuplegetter(indice, doc):
+        return property(lambda linha: tuple.__getitem__(linha, indice), doc=doc)
+
+# Linhas de resultado compactas.
+#
+# O RealDictCursor montava um OrderedDict por linha, preenchido coluna a coluna
+# pelo psycopg2: em listagens grandes, a maior parte da memória e do tempo de
+# fetch era isso. Aqui cada linha é uma tupla (o que o psycopg2 já produz),
+# promovida a uma subclasse com os nomes das colunas. A classe é criada uma vez
+# por conjunto de colunas e reaproveitada (cache), então a linha não carrega
+# nada além dos valores.
+#
+# A linha continua se comportando como o dicionário de antes, e todo o código
+# segue usando a mesma forma:
+#   linha["nome"], linha.get("nome"), dict(linha), **linha, "nome" in linha
+#   linha.nome (também nos templates), linha[0] (por posição)
+# Iterar percorre os nomes das colunas, como num dict; values() e items() dão
+# os valores. Não é um dict de verdade: json.dumps direto não funciona
+# (converta com dict(linha)) e a linha é imutável.
+#
+# Para listagens sem paginação, passe o próprio cursor ao template
+# ({% for moto in motos %}): as linhas são criadas uma a uma durante a
+# renderização, em vez de uma lista inteira antes dela.
+
+# Colunas sem atributo (ficariam escondidas por ele ou não são identificadores, como "?column?"):
+# continuam acessíveis por linha["nome"]
+_RESERVADOS = frozenset({"get", "keys", "values", "items"})
+
+
+class Linha(tuple):
+    """Linha de resultado imutável, acessível por nome de coluna, atributo ou posição."""
+
+    __slots__ = ()
+    _campos = ()
+    _indice = {}
+
+    def __getitem__(self, chave):
+        if isinstance(chave, str):
+            return tuple.__getitem__(self, self._indice[chave])
+        return tuple.__getitem__(self, chave)
+
+    def get(self, chave, padrao=None):
+        indice = self._indice.get(chave)
+        return padrao if indice is None else tuple.__getitem__(self, indice)
+
+    def keys(self):
+        return self._campos
+
+    def values(self):
+        return tuple(tuple.__iter__(self))
+
+    def items(self):
+        return zip(self._campos, tuple.__iter__(self))
+
+    def __iter__(self):
+        return iter(self._campos)
+
+    def __contains__(self, chave):
+        return chave in self._indice
+
+    def _asdict(self):
+        return dict(zip(self._campos, tuple.__iter__(self)))
+
+    def __reduce__(self):
+        # As subclasses são dinâmicas: o pickle recria pela lista de colunas
+        return _reconstruir, (self._campos, tuple(tuple.__iter__(self)))
+
+    def __repr__(self):
+        return "Linha(%s)" % ", ".join(f"{k}={v!r}" for k, v in self.items())
+
+
+Mapping.register(Linha)
+
+
+@functools.lru_cache(maxsize=1024)
+def classe(campos):
+    """Subclasse de Linha para as colunas `campos` (tupla de nomes), criada uma vez."""
+    atributos = {"__slots__": (), "_campos": campos, "_indice": {nome: i for i, nome in enumerate(campos)}}
+    for i, nome in enumerate(campos):
+        if nome.isidentifier() and not nome.startswith("_") and nome not in _RESERVADOS and nome not in atributos:
+            atributos[nome] = _tuplegetter(i, f"Coluna {nome}")
+    return type("Linha", (Linha,), atributos)
+
+
+def _reconstruir(campos, valores):
+    return tuple.__new__(classe(campos), valores)
+
+
+class CursorLinhas(_cursor):
+    """Cursor cujos fetch*() e iteração devolvem Linha (mesma ideia do NamedTupleCursor do psycopg2)."""
+
+    _classe = None
+
+    def execute(self, query, vars=None):
+        self._classe = None
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        self._classe = None
+        return super().executemany(query, vars_list)
+
+    def callproc(self, procname, vars=None):
+        self._classe = None
+        return super().callproc(procname, vars)
+
+    def _criar(self):
+        if self._classe is None:
+            self._classe = classe(tuple(d[0] for d in self.description) if self.description else ())
+        return functools.partial(tuple.__new__, self._classe)
+
+    def fetchone(self):
+        t = super().fetchone()
+        return None if t is None else self._criar()(t)
+
+    def fetchmany(self, size=None):
+        ts = super().fetchmany(size) if size is not None else super().fetchmany()
+        return list(map(self._criar(), ts))
+
+    def fetchall(self):
+        return list(map(self._criar(), super().fetchall()))
+
+    def __iter__(self):
+        # super().__iter__() devolve o próprio cursor: next() direto, senão voltaríamos a este __iter__.
+        # Cursores nomeados só têm description depois da primeira linha
+        it = super().__iter__()
+        try:
+            primeira = next(it)
+            criar = self._criar()
+            yield criar(primeira)
+            while True:
+                yield criar(next(it))
+        except StopIteration:
+            return
@@ -0,0 +1,150 @@
+import threading
+import time
+
+# Registro simples de métricas em memória (por processo/worker do gunicorn),
+# exportado em formato texto do Prometheus pela rota /metrics.
+
+_lock = threading.Lock()
+_registry = {}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(n, "")) for n in labelnames)
+
+
+def _fmt_labels(labelnames, key, extra=None):
+    pares = list(zip(labelnames, key))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ""
+    corpo = ",".join(
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pares
+    )
+    return "{" + corpo + "}"
+
+
+class Counter:
+    tipo = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with _lock:
+            itens = list(self._values.items())
+        if not itens and not self.labelnames:
+            itens = [((), 0)]
+        for key, v in itens:
+            yield self.name, _fmt_labels(self.labelnames, key), v
+
+
+class Gauge(Counter):
+    tipo = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    tipo = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [contagens por bucket..., soma, total]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            dados = self._values.get(key)
+            if dados is None:
+                dados = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if value <= limite:
+                    dados[i] += 1
+            dados[-2] += value
+            dados[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        with _lock:
+            itens = [(k, list(v)) for k, v in self._values.items()]
+        for key, dados in itens:
+            for i, limite in enumerate(self.buckets):
+                yield self.name + "_bucket", _fmt_labels(self.labelnames, key, ("le", limite)), dados[i]
+            yield self.name + "_bucket", _fmt_labels(self.labelnames, key, ("le", "+Inf")), dados[-1]
+            yield self.name + "_sum", _fmt_labels(self.labelnames, key), dados[-2]
+            yield self.name + "_count", _fmt_labels(self.labelnames, key), dados[-1]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.inicio
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+def _registrar(cls, name, *args, **kwargs):
+    # Idempotente: módulos recarregados reaproveitam a métrica já registrada
+    with _lock:
+        existente = _registry.get(name)
+        if existente is None:
+            existente = _registry[name] = cls(name, *args, **kwargs)
+        return existente
+
+
+def counter(name, documentation, labelnames=()):
+    return _registrar(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _registrar(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _registrar(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def render():
+    """Gera o texto no formato de exposição do Prometheus."""
+    with _lock:
+        metricas = sorted(_registry.values(), key=lambda m: m.name)
+    linhas = []
+    for m in metricas:
+        linhas.append(f"# HELP {m.name} {m.documentation}")
+        linhas.append(f"# TYPE {m.name} {m.tipo}")
+        for nome, labels, valor in m.samples():
+            linhas.append(f"{nome}{labels} {valor}")
+    return "\n".join(linhas) + "\n"
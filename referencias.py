@@ -0,0 +1,285 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import clientes_busca
+import disponibilidade
+import metrics
+from config import Config
+from database import get_db_connection
+
+# Cache de leitura das projeções de referência (nome/CPF do cliente, modelo e
+# placa da moto, listas dos typeaheads do formulário de locação).
+#
+# Cada worker guarda até REFERENCIAS_CACHE_MAX entradas num LRU em memória, por
+# no máximo REFERENCIAS_CACHE_TTL segundos. Toda entrada declara as tags de que
+# depende ("cliente:12", "clientes", "motos", "locacoes"...) e guarda a versão
+# de cada tag no momento em que foi carregada; as escritas chamam invalidar()
+# com as tags que afetaram, depois do commit, e só as entradas dessas tags
+# deixam de valer. A versão é lida antes da consulta ao banco, então uma carga
+# concorrente com a escrita já nasce vencida.
+#
+# Sem REFERENCIAS_CACHE_COMPARTILHADO as versões são do processo: os outros
+# workers enxergam a escrita quando o TTL expira (como o dashboard). Com um
+# caminho (ex.: /dev/shm/motorental-referencias.sqlite3) as versões e os
+# valores ficam também num SQLite local, comum aos workers da máquina: a
+# invalidação vale para todos na hora e um worker aproveita o que outro já
+# carregou. Qualquer erro no SQLite vira miss; o cache nunca derruba o request.
+#
+# Os valores devolvidos são compartilhados entre requests: não altere.
+
+_AUSENTE = object()
+
+CONSULTAS = metrics.counter(
+    "referencias_cache_consultas_total", "Leituras do cache de referências, por resultado (hit, hit_compartilhado, miss)",
+    ("grupo", "resultado"),
+)
+DESPEJOS = metrics.counter("referencias_cache_despejos_total", "Entradas removidas do LRU por falta de espaço")
+INVALIDACOES = metrics.counter("referencias_cache_invalidacoes_total", "Tags invalidadas por escritas", ("grupo",))
+ENTRADAS = metrics.gauge("referencias_cache_entradas", "Entradas no LRU deste worker")
+
+
+def _grupo(tag):
+    return tag.split(":", 1)[0]
+
+
+# ====
+# Versões e valores compartilhados (SQLite local)
+# ====
+class _Compartilhado:
+    """Versões das tags e valores num SQLite em tmpfs; uma conexão por processo."""
+
+    # Poda das linhas vencidas a cada N gravações
+    PODA_A_CADA = 200
+
+    def __init__(self, caminho, maximo):
+        self.caminho = caminho
+        self.maximo = maximo
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._gravacoes = 0
+
+    def _conexao(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.caminho, timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # é só cache, em memória
+            conn.execute("CREATE TABLE IF NOT EXISTS versoes (tag TEXT PRIMARY KEY, versao INTEGER NOT NULL)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS valores (
+                    chave TEXT PRIMARY KEY, tags TEXT NOT NULL, versoes TEXT NOT NULL,
+                    expira REAL NOT NULL, valor BLOB NOT NULL
+                )
+            """)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def versoes(self, tags):
+        with self._lock:
+            rows = self._conexao().execute(
+                f"SELECT tag, versao FROM versoes WHERE tag IN ({','.join('?' * len(tags))})", tags
+            ).fetchall()
+        atuais = dict(rows)
+        return tuple(atuais.get(t, 0) for t in tags)
+
+    def invalidar(self, tags):
+        with self._lock:
+            self._conexao().executemany(
+                "INSERT INTO versoes (tag, versao) VALUES (?, 1) ON CONFLICT (tag) DO UPDATE SET versao = versao + 1",
+                [(t,) for t in tags],
+            )
+
+    def ler(self, chave):
+        """(versoes, expira, valor) gravados por algum worker, ou None."""
+        with self._lock:
+            row = self._conexao().execute(
+                "SELECT versoes, expira, valor FROM valores WHERE chave = ?", (chave,)
+            ).fetchone()
+        if row is None:
+            return None
+        return tuple(int(v) for v in row[0].split(",") if v), row[1], pickle.loads(row[2])
+
+    def gravar(self, chave, tags, versoes, expira, valor):
+        dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            conn = self._conexao()
+            conn.execute(
+                "INSERT OR REPLACE INTO valores (chave, tags, versoes, expira, valor) VALUES (?, ?, ?, ?, ?)",
+                (chave, ",".join(tags), ",".join(map(str, versoes)), expira, dados),
+            )
+            self._gravacoes += 1
+            if self._gravacoes % self.PODA_A_CADA == 0:
+                conn.execute("DELETE FROM valores WHERE expira < ?", (time.time(),))
+                # Acima do limite, saem as que venceriam primeiro
+                conn.execute("""
+                    DELETE FROM valores WHERE chave IN (
+                        SELECT chave FROM valores ORDER BY expira DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.maximo,))
+
+
+# ====
+# LRU do worker
+# ====
+class Cache:
+    def __init__(self, maximo, ttl, compartilhado=None):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.compartilhado = compartilhado
+        self._entradas = OrderedDict()  # chave -> (tags, versoes, expira, valor)
+        self._versoes = {}  # tag -> versão (só sem o compartilhado)
+        self._lock = threading.Lock()
+
+    def _versoes_atuais(self, tags):
+        if self.compartilhado is not None:
+            try:
+                return self.compartilhado.versoes(tags)
+            except sqlite3.Error as e:
+                logging.warning("Cache de referências: versões indisponíveis (%s)", e)
+                return None
+        with self._lock:
+            return tuple(self._versoes.get(t, 0) for t in tags)
+
+    def _guardar(self, chave, entrada):
+        with self._lock:
+            self._entradas[chave] = entrada
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+                DESPEJOS.inc()
+            ENTRADAS.set(len(self._entradas))
+
+    def obter(self, chave, tags, carregar):
+        """Valor de `chave` (tupla; o primeiro item é o grupo nas métricas), chamando carregar() no miss."""
+        grupo = chave[0]
+        chave = repr(chave)
+        tags = tuple(tags)
+        versoes = self._versoes_atuais(tags)
+        agora = time.time()
+
+        if versoes is not None:
+            with self._lock:
+                entrada = self._entradas.get(chave)
+                if entrada is not None and entrada[1] == versoes and agora < entrada[2]:
+                    self._entradas.move_to_end(chave)
+                    CONSULTAS.inc(grupo=grupo, resultado="hit")
+                    return entrada[3]
+
+            if self.compartilhado is not None:
+                try:
+                    gravado = self.compartilhado.ler(chave)
+                except (sqlite3.Error, pickle.UnpicklingError, EOFError) as e:
+                    logging.warning("Cache de referências: leitura compartilhada falhou (%s)", e)
+                    gravado = None
+                if gravado is not None and gravado[0] == versoes and agora < gravado[1]:
+                    self._guardar(chave, (tags, versoes, gravado[1], gravado[2]))
+                    CONSULTAS.inc(grupo=grupo, resultado="hit_compartilhado")
+                    return gravado[2]
+
+        CONSULTAS.inc(grupo=grupo, resultado="miss")
+        valor = carregar()
+        if versoes is None or valor is None:
+            return valor  # sem versão confiável (ou nada a guardar): não grava
+
+        expira = agora + self.ttl
+        self._guardar(chave, (tags, versoes, expira, valor))
+        if self.compartilhado is not None:
+            try:
+                self.compartilhado.gravar(chave, tags, versoes, expira, valor)
+            except sqlite3.Error as e:
+                logging.warning("Cache de referências: gravação compartilhada falhou (%s)", e)
+        return valor
+
+    def invalidar(self, *tags):
+        """Chame depois do commit da escrita, com as tags que ela afetou."""
+        for t in tags:
+            INVALIDACOES.inc(grupo=_grupo(t))
+        if self.compartilhado is not None:
+            try:
+                self.compartilhado.invalidar(tags)
+                return
+            except sqlite3.Error as e:
+                # Sem o compartilhado, ao menos este worker deixa de servir a versão antiga
+                logging.warning("Cache de referências: invalidação compartilhada falhou (%s)", e)
+                self.limpar()
+                return
+        with self._lock:
+            for t in tags:
+                self._versoes[t] = self._versoes.get(t, 0) + 1
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            ENTRADAS.set(0)
+
+
+_cache = Cache(
+    Config.REFERENCIAS_CACHE_MAX,
+    Config.REFERENCIAS_CACHE_TTL,
+    _Compartilhado(Config.REFERENCIAS_CACHE_COMPARTILHADO, Config.REFERENCIAS_CACHE_MAX * 4)
+    if Config.REFERENCIAS_CACHE_COMPARTILHADO else None,
+)
+obter = _cache.obter
+invalidar = _cache.invalidar
+
+
+def _consultar(sql, params):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        row = cur.fetchone()
+        return dict(row) if row else None
+    finally:
+        cur.close()
+        conn.close()
+
+
+# ====
+# Projeções
+# ====
+def cliente(cliente_id):
+    """{id, nome, cpf} do cliente, ou None."""
+    return obter(("cliente", cliente_id), (f"cliente:{cliente_id}",), lambda: _consultar(
+        "SELECT id, nome, cpf FROM clientes WHERE id = %s", (cliente_id,)
+    ))
+
+
+def moto(moto_id):
+    """{id, modelo, placa, ano, disponivel} da moto, ou None."""
+    return obter(("moto", moto_id), (f"moto:{moto_id}",), lambda: _consultar(
+        "SELECT id, modelo, placa, ano, disponivel FROM motos WHERE id = %s", (moto_id,)
+    ))
+
+
+def clientes_typeahead(termo, limite):
+    """[{id, texto}] da busca de clientes (clientes_busca)."""
+    def carregar():
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            clientes, _ = clientes_busca.buscar(cur, termo, limite)
+        finally:
+            cur.close()
+            conn.close()
+        return [{"id": c["id"], "texto": clientes_busca.texto_typeahead(c)} for c in clientes]
+    return obter(("clientes_typeahead", termo.lower(), limite), ("clientes",), carregar)
+
+
+def motos_livres_typeahead(inicio, fim, termo, limite):
+    """[{id, texto}] das motos livres no período (disponibilidade.motos_livres)."""
+    def carregar():
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            motos, _ = disponibilidade.motos_livres(cur, inicio, fim, termo, limite)
+        finally:
+            cur.close()
+            conn.close()
+        return [{"id": m["id"], "texto": f"{m['modelo']} - {m['placa']}"} for m in motos]
+    return obter(("motos_typeahead", inicio, fim, termo.lower(), limite), ("motos", "locacoes"), carregar)
@@ -0,0 +1,245 @@
+import datetime as dt
+
+import metrics
+
+# Relatórios financeiros e de frota.
+#
+# Nada aqui varre a tabela boletos inteira:
+#   - receita por mês, moto e cliente vem de financeiro_mensal (uma linha por
+#     locação/mês) e receita por semana de receita_semanal, ambos mantidos por
+#     delta pelos triggers de boletos (ver financeiro.py);
+#   - utilização da frota vem de utilizacao_diaria, recalculada de forma
+#     incremental a partir do dia que os triggers de locacoes/motos marcam em
+#     relatorios_estado (atualizar_utilizacao);
+#   - o aging da inadimplência lê só os boletos em aberto (índice parcial
+#     idx_boletos_em_aberto), que são poucos perto do histórico.
+# Variação, acumulado, ranking e participação saem de funções de janela sobre
+# esses agregados, então anos de histórico continuam respondendo na hora.
+
+GRANULARIDADES = ("semana", "mes")
+DIMENSOES = ("moto", "cliente")
+FAIXAS_ATRASO = (("0-7", 0, 7), ("8-30", 8, 30), ("31-60", 31, 60), ("60+", 61, None))
+
+CLASSE_LOCK = 72020  # advisory lock do recálculo da utilização (a classe 72019 é do agendador)
+
+UTILIZACAO_DIAS = metrics.counter("relatorios_utilizacao_dias_total", "Dias recalculados em utilizacao_diaria")
+
+
+def periodo_padrao(hoje=None):
+    """Últimos 12 meses, do primeiro dia do mês até hoje."""
+    hoje = hoje or dt.date.today()
+    inicio = (hoje.replace(day=1) - dt.timedelta(days=335)).replace(day=1)
+    return inicio, hoje
+
+
+# ====
+# Utilização (rollup incremental)
+# ====
+_UTILIZACAO_SQL = """
+    WITH ocupacao AS (
+        SELECT data_inicio AS ini, locacao_fim(data_inicio, data_fim, cancelado) AS fim
+        FROM locacoes
+        WHERE data_inicio <= %(fim)s
+    ), eventos AS (
+        -- Varredura: +1 no início (ou no começo da janela), -1 no dia seguinte ao fim
+        SELECT GREATEST(ini, %(inicio)s) AS dia, 1 AS locadas, 0 AS frota
+        FROM ocupacao WHERE fim IS NULL OR fim >= %(inicio)s
+        UNION ALL
+        SELECT fim + 1, -1, 0
+        FROM ocupacao WHERE fim >= %(inicio)s AND fim < %(fim)s
+        UNION ALL
+        SELECT GREATEST(created_at::date, %(inicio)s), 0, 1
+        FROM motos WHERE created_at::date <= %(fim)s
+    ), por_dia AS (
+        SELECT dia, SUM(locadas) AS locadas, SUM(frota) AS frota FROM eventos GROUP BY dia
+    )
+    INSERT INTO utilizacao_diaria (dia, motos_locadas, frota)
+    SELECT d.dia,
+           SUM(COALESCE(p.locadas, 0)) OVER (ORDER BY d.dia),
+           SUM(COALESCE(p.frota, 0)) OVER (ORDER BY d.dia)
+    FROM generate_series(%(inicio)s::date, %(fim)s::date, interval '1 day') AS g(d)
+    CROSS JOIN LATERAL (SELECT g.d::date AS dia) d
+    LEFT JOIN por_dia p ON p.dia = d.dia
+"""
+
+
+def atualizar_utilizacao(cur, reconstruir=False, hoje=None, esperar=True):
+    """Recalcula utilizacao_diaria do dia marcado (ou do último calculado) até hoje.
+
+    Um recálculo por vez; com esperar=False (páginas) não espera quem já está
+    recalculando e só lê o rollup como está. Retorna o número de dias
+    recalculados. Quem chama faz o commit.
+    """
+    hoje = hoje or dt.date.today()
+    cur.execute("""
+        SELECT e.recalcular_desde, (SELECT MAX(dia) FROM utilizacao_diaria) AS ultimo
+        FROM relatorios_estado e WHERE e.nome = 'utilizacao'
+    """)
+    estado = cur.fetchone()
+    if not reconstruir and estado and estado["recalcular_desde"] is None and estado["ultimo"] and estado["ultimo"] >= hoje:
+        return 0  # caminho comum: nada mudou desde a última atualização de hoje
+
+    if esperar:
+        cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext('utilizacao'))", (CLASSE_LOCK,))
+    else:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s, hashtext('utilizacao')) AS livre", (CLASSE_LOCK,))
+        if not cur.fetchone()["livre"]:
+            return 0
+    # Trava a linha de estado: marcações concorrentes esperam o recálculo terminar
+    cur.execute("SELECT recalcular_desde FROM relatorios_estado WHERE nome = 'utilizacao' FOR UPDATE")
+    marcado = cur.fetchone()["recalcular_desde"]
+    cur.execute("SELECT MAX(dia) AS ultimo FROM utilizacao_diaria")
+    ultimo = cur.fetchone()["ultimo"]
+
+    if reconstruir or ultimo is None:
+        cur.execute("""
+            SELECT LEAST((SELECT MIN(data_inicio) FROM locacoes), (SELECT MIN(created_at)::date FROM motos)) AS inicio
+        """)
+        inicio = cur.fetchone()["inicio"]
+    else:
+        # O último dia é sempre refeito: locações em andamento mudam ao longo do dia
+        inicio = min(marcado, ultimo) if marcado else ultimo
+
+    dias = 0
+    if inicio is not None and inicio <= hoje:
+        cur.execute("DELETE FROM utilizacao_diaria WHERE dia >= %s", (inicio,))
+        cur.execute(_UTILIZACAO_SQL, {"inicio": inicio, "fim": hoje})
+        dias = cur.rowcount
+        UTILIZACAO_DIAS.inc(dias)
+    cur.execute("UPDATE relatorios_estado SET recalcular_desde = NULL WHERE nome = 'utilizacao'")
+    return dias
+
+
+def utilizacao(cur, granularidade, de, ate):
+    """Taxa de ocupação média da frota por período, com média móvel de 4 períodos."""
+    cur.execute("""
+        SELECT periodo, dias, media_locadas, media_frota, taxa,
+               ROUND(AVG(taxa) OVER (ORDER BY periodo ROWS BETWEEN 3 PRECEDING AND CURRENT ROW), 1) AS taxa_movel
+        FROM (
+            SELECT date_trunc(%(trunc)s, dia)::date AS periodo,
+                   COUNT(*) AS dias,
+                   ROUND(AVG(motos_locadas), 1) AS media_locadas,
+                   ROUND(AVG(frota), 1) AS media_frota,
+                   ROUND(100.0 * SUM(LEAST(motos_locadas, frota)) / NULLIF(SUM(frota), 0), 1) AS taxa
+            FROM utilizacao_diaria
+            WHERE dia BETWEEN %(de)s AND %(ate)s
+            GROUP BY 1
+        ) p
+        ORDER BY periodo
+    """, {"trunc": _trunc(granularidade), "de": de, "ate": ate})
+    return cur.fetchall()
+
+
+# ====
+# Receita
+# ====
+def _trunc(granularidade):
+    return "week" if granularidade == "semana" else "month"
+
+
+def receita(cur, granularidade, de, ate):
+    """Receita recebida por semana ou mês (períodos sem pagamento aparecem com zero)."""
+    if granularidade == "semana":
+        fonte = "SELECT semana AS periodo, valor_pago, qtd_pagos FROM receita_semanal"
+        passo = "1 week"
+    else:
+        fonte = "SELECT mes AS periodo, valor_pago, qtd_pagos FROM financeiro_mensal"
+        passo = "1 month"
+    cur.execute(f"""
+        WITH periodos AS (
+            SELECT g::date AS periodo
+            FROM generate_series(date_trunc(%(trunc)s, %(de)s::date), %(ate)s::date, interval '{passo}') g
+        ), agregado AS (
+            SELECT periodo, SUM(valor_pago) AS valor_pago, SUM(qtd_pagos) AS qtd_pagos
+            FROM ({fonte}) f
+            WHERE periodo >= date_trunc(%(trunc)s, %(de)s::date) AND periodo <= %(ate)s
+            GROUP BY periodo
+        )
+        SELECT p.periodo,
+               COALESCE(a.valor_pago, 0) AS valor_pago,
+               COALESCE(a.qtd_pagos, 0) AS qtd_pagos,
+               SUM(COALESCE(a.valor_pago, 0)) OVER (ORDER BY p.periodo) AS acumulado,
+               ROUND(100.0 * (COALESCE(a.valor_pago, 0) - LAG(COALESCE(a.valor_pago, 0)) OVER w)
+                     / NULLIF(LAG(COALESCE(a.valor_pago, 0)) OVER w, 0), 1) AS variacao_pct
+        FROM periodos p
+        LEFT JOIN agregado a ON a.periodo = p.periodo
+        WINDOW w AS (ORDER BY p.periodo)
+        ORDER BY p.periodo
+    """, {"trunc": _trunc(granularidade), "de": de, "ate": ate})
+    return cur.fetchall()
+
+
+def receita_por(cur, dimensao, de, ate, limite=20):
+    """Ranking de receita por moto ou por cliente no período (meses inteiros)."""
+    if dimensao == "moto":
+        chave, rotulo, junta = "m.id", "m.placa || ' - ' || m.modelo", "JOIN motos m ON m.id = l.moto_id"
+    else:
+        chave, rotulo, junta = "c.id", "c.nome", "JOIN clientes c ON c.id = l.cliente_id"
+    cur.execute(f"""
+        SELECT id, nome, valor_pago, qtd_pagos, locacoes, posicao, participacao_pct,
+               SUM(participacao_pct) OVER (ORDER BY posicao, id) AS participacao_acumulada_pct
+        FROM (
+            SELECT {chave} AS id, {rotulo} AS nome,
+                   SUM(f.valor_pago) AS valor_pago, SUM(f.qtd_pagos) AS qtd_pagos,
+                   COUNT(DISTINCT f.locacao_id) AS locacoes,
+                   RANK() OVER (ORDER BY SUM(f.valor_pago) DESC) AS posicao,
+                   ROUND(100.0 * SUM(f.valor_pago) / NULLIF(SUM(SUM(f.valor_pago)) OVER (), 0), 1) AS participacao_pct
+            FROM financeiro_mensal f
+            JOIN locacoes l ON l.id = f.locacao_id
+            {junta}
+            WHERE f.mes >= date_trunc('month', %(de)s::date) AND f.mes <= %(ate)s AND f.valor_pago <> 0
+            GROUP BY {chave}, {rotulo}
+        ) r
+        ORDER BY posicao, id
+        LIMIT %(limite)s
+    """, {"de": de, "ate": ate, "limite": limite})
+    return cur.fetchall()
+
+
+# ====
+# Inadimplência
+# ====
+def _faixa_sql(coluna):
+    casos = " ".join(
+        f"WHEN {coluna} <= {ate} THEN '{nome}'" for nome, _, ate in FAIXAS_ATRASO if ate is not None
+    )
+    return f"CASE {casos} ELSE '{FAIXAS_ATRASO[-1][0]}' END"
+
+
+def inadimplencia(cur, hoje=None, limite=20):
+    """Aging dos boletos vencidos em aberto (dias após data_vencimento) e maiores devedores."""
+    hoje = hoje or dt.date.today()
+    params = {"hoje": hoje, "limite": limite}
+    em_aberto = f"""
+        SELECT b.locacao_id, COALESCE(b.valor, 0) AS valor, %(hoje)s::date - b.data_vencimento AS dias,
+               {_faixa_sql("%(hoje)s::date - b.data_vencimento")} AS faixa
+        FROM boletos b
+        WHERE b.status IN ('PENDING','OVERDUE') AND b.data_vencimento < %(hoje)s
+    """
+    cur.execute(f"""
+        WITH aberto AS ({em_aberto}),
+        faixas AS (
+            SELECT nome, ordem FROM (VALUES {", ".join(f"('{n}', {i})" for i, (n, _, _) in enumerate(FAIXAS_ATRASO))}) v(nome, ordem)
+        )
+        SELECT f.nome AS faixa, COUNT(a.faixa) AS qtd, COALESCE(SUM(a.valor), 0) AS valor,
+               ROUND(100.0 * COALESCE(SUM(a.valor), 0) / NULLIF(SUM(SUM(a.valor)) OVER (), 0), 1) AS participacao_pct
+        FROM faixas f
+        LEFT JOIN aberto a ON a.faixa = f.nome
+        GROUP BY f.nome, f.ordem
+        ORDER BY f.ordem
+    """, params)
+    faixas = cur.fetchall()
+
+    cur.execute(f"""
+        WITH aberto AS ({em_aberto})
+        SELECT c.id, c.nome, c.telefone, COUNT(*) AS boletos, SUM(a.valor) AS valor, MAX(a.dias) AS maior_atraso,
+               {_faixa_sql("MAX(a.dias)")} AS faixa,
+               RANK() OVER (ORDER BY SUM(a.valor) DESC) AS posicao
+        FROM aberto a
+        JOIN locacoes l ON l.id = a.locacao_id
+        JOIN clientes c ON c.id = l.cliente_id
+        GROUP BY c.id, c.nome, c.telefone
+        ORDER BY posicao, c.id
+        LIMIT %(limite)s
+    """, params)
+    return {"faixas": faixas, "devedores": cur.fetchall()}
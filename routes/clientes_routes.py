@@ -1,9 +1,13 @@
-import requests
-from flask import Blueprint, render_template, flash, redirect, url_for, request
+from flask import Blueprint, render_template, flash, redirect, url_for, request, jsonify, abort, current_app
 from flask_login import login_required
-from psycopg2.extras import RealDictCursor
+from werkzeug.utils import secure_filename
 from database import get_db_connection
-from config import Config
+import armazenamento
+import asaas_client
+import clientes_busca
+import dashboard_metrics
+import entrega
+import referencias
 
 clientes_bp = Blueprint("clientes", __name__, url_prefix="/clientes")
 
@@ -24,7 +28,7 @@ def listar_clientes():
             return redirect(url_for("clientes.listar_clientes"))
 
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur = conn.cursor()
 
         try:
             # Verifica se cliente já existe localmente pelo CPF ou email
@@ -36,14 +40,13 @@ def listar_clientes():
                 return redirect(url_for("clientes.listar_clientes"))
 
             # Busca cliente no Asaas pelo CPF (document) ou email
-            headers = {"access_token": Config.ASAAS_API_KEY}
             params = {}
             if cpf:
                 params["cpfCnpj"] = cpf
             else:
                 params["email"] = email
 
-            resp = requests.get(f"{Config.ASAAS_BASE_URL}/customers", headers=headers, params=params, timeout=30)
+            resp = asaas_client.get("/customers", params=params)
             if resp.status_code != 200:
                 flash(f"Erro ao consultar Asaas: {resp.status_code}", "danger")
                 return redirect(url_for("clientes.listar_clientes"))
@@ -66,7 +69,7 @@ def listar_clientes():
                     "address": endereco,
                     "notificationDisabled": False,
                 }
-                resp_create = requests.post(f"{Config.ASAAS_BASE_URL}/customers", headers=headers, json=cliente_payload, timeout=30)
+                resp_create = asaas_client.post("/customers", json=cliente_payload)
                 if resp_create.status_code not in (200, 201):
                     flash(f"Erro ao criar cliente no Asaas: {resp_create.status_code}", "danger")
                     return redirect(url_for("clientes.listar_clientes"))
@@ -78,6 +81,8 @@ def listar_clientes():
                 VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
             """, (nome, email, telefone, cpf, endereco, data_nascimento or None, observacoes or None, asaas_id))
             conn.commit()
+            dashboard_metrics.invalidate()
+            referencias.invalidar("clientes")
 
             flash("Cliente cadastrado com sucesso e integrado ao Asaas.", "success")
             return redirect(url_for("clientes.listar_clientes"))
@@ -91,24 +96,53 @@ def listar_clientes():
             cur.close()
             conn.close()
 
-    # GET: lista clientes e renderiza o template clientes.html
+    # GET: lista (ou busca) clientes, paginado, e renderiza o template clientes.html
+    q = (request.args.get("q") or "").strip()
+    pagina = max(request.args.get("pagina", 1, type=int), 1)
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor()
     try:
-        cur.execute("SELECT * FROM clientes ORDER BY nome ASC")
-        clientes = cur.fetchall()
+        clientes, tem_mais = clientes_busca.buscar(
+            cur, q, clientes_busca.POR_PAGINA, (pagina - 1) * clientes_busca.POR_PAGINA
+        )
     finally:
         cur.close()
         conn.close()
 
-    return render_template("clientes.html", clientes=clientes)
+    return render_template("clientes.html", clientes=clientes, q=q, pagina=pagina, tem_mais=tem_mais)
+
+
+@clientes_bp.route("/buscar")
+@login_required
+def buscar_clientes():
+    """Busca em JSON: ?q=termo&pagina=1&por_pagina=20"""
+    q = (request.args.get("q") or "").strip()
+    pagina = max(request.args.get("pagina", 1, type=int), 1)
+    por_pagina = min(max(request.args.get("por_pagina", 20, type=int), 1), 100)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        clientes, tem_mais = clientes_busca.buscar(cur, q, por_pagina, (pagina - 1) * por_pagina)
+    finally:
+        cur.close()
+        conn.close()
+
+    return jsonify({
+        "clientes": [
+            {"id": c["id"], "nome": c["nome"], "email": c["email"], "telefone": c["telefone"],
+             "cpf": c["cpf"], "texto": clientes_busca.texto_typeahead(c)}
+            for c in clientes
+        ],
+        "pagina": pagina,
+        "tem_mais": tem_mais,
+    })
 
 
 @clientes_bp.route("/editar/<int:id>", methods=["GET", "POST"])
 @login_required
 def editar_cliente(id):
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor()
 
     if request.method == "POST":
         nome = request.form.get("nome", "").strip()
@@ -125,6 +159,7 @@ def editar_cliente(id):
                 data_nascimento=%s, observacoes=%s WHERE id=%s
             """, (nome, email, telefone, cpf, endereco, data_nascimento or None, observacoes or None, id))
             conn.commit()
+            referencias.invalidar("clientes", f"cliente:{id}")
             flash("Cliente atualizado com sucesso.", "success")
             return redirect(url_for("clientes.listar_clientes"))
         except Exception as e:
@@ -147,4 +182,75 @@ def editar_cliente(id):
         cur.close()
         conn.close()
 
-    return render_template("editar_cliente.html", cliente=cliente)
\ No newline at end of file
+    return render_template("editar_cliente.html", cliente=cliente)
+
+
+# ====
+# Habilitação (CNH) do cliente
+# ====
+ALLOWED_CNH_MIME = {"application/pdf", "image/jpeg", "image/png"}
+
+@clientes_bp.route("/<int:id>/habilitacao", methods=["GET", "POST"])
+@login_required
+def habilitacao(id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        if request.method == "POST":
+            file = request.files.get("habilitacao")
+            if not file or not file.filename:
+                flash("Nenhum arquivo selecionado.", "warning")
+                return redirect(url_for("clientes.habilitacao", id=id))
+            try:
+                arquivo = armazenamento.salvar(cur, file.stream, secure_filename(file.filename), file.mimetype)
+                if arquivo.mime_type not in ALLOWED_CNH_MIME:
+                    conn.rollback()
+                    flash("Formato inválido. Envie PDF, JPG, JPEG ou PNG.", "warning")
+                    return redirect(url_for("clientes.habilitacao", id=id))
+                cur.execute("UPDATE clientes SET habilitacao_arquivo=%s WHERE id=%s", (arquivo.chave, id))
+                conn.commit()
+                flash("Habilitação enviada com sucesso!", "success")
+            except Exception:
+                conn.rollback()
+                current_app.logger.exception("Erro ao enviar habilitação do cliente %s", id)
+                flash("Erro ao enviar habilitação.", "danger")
+            return redirect(url_for("clientes.habilitacao", id=id))
+
+        cur.execute("SELECT id, nome, habilitacao_arquivo FROM clientes WHERE id=%s", (id,))
+        cliente = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+
+    if not cliente:
+        flash("Cliente não encontrado.", "warning")
+        return redirect(url_for("clientes.listar_clientes"))
+    return render_template("cliente_habilitacao.html", cliente=cliente)
+
+
+@clientes_bp.route("/<int:id>/habilitacao/excluir", methods=["POST"])
+@login_required
+def excluir_habilitacao(id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        # O arquivo em si sai na limpeza de órfãos do armazenamento
+        cur.execute("UPDATE clientes SET habilitacao_arquivo=NULL WHERE id=%s", (id,))
+        conn.commit()
+        flash("Habilitação removida.", "info")
+    except Exception:
+        conn.rollback()
+        current_app.logger.exception("Erro ao remover habilitação do cliente %s", id)
+        flash("Erro ao remover habilitação.", "danger")
+    finally:
+        cur.close()
+        conn.close()
+    return redirect(url_for("clientes.habilitacao", id=id))
+
+
+@clientes_bp.route("/habilitacoes/<path:filename>")
+@login_required
+def uploaded_habilitacao(filename):
+    if not armazenamento.legado(filename) and not armazenamento.chave_valida(filename):
+        abort(404)
+    return entrega.enviar(filename, pasta_legada="habilitacoes")
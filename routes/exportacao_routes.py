@@ -0,0 +1,52 @@
+import datetime as dt
+from flask import Blueprint, Response, abort, request, stream_with_context
+from flask_login import login_required
+from database import get_db_connection
+import exportacao
+from routes.locacoes_routes import STATUS_PAGAMENTO
+
+exportacao_bp = Blueprint("exportacao", __name__, url_prefix="/exportar")
+
+def _data(nome):
+    valor = (request.args.get(nome) or "").strip()
+    if not valor:
+        return None
+    try:
+        return dt.date.fromisoformat(valor)
+    except ValueError:
+        abort(400, description=f"Data inválida em '{nome}' (use AAAA-MM-DD).")
+
+def _filtros():
+    status = [s.strip().upper() for s in request.args.getlist("status") if s.strip()]
+    if any(s not in STATUS_PAGAMENTO for s in status):
+        abort(400, description="Status inválido.")
+    frequencia = (request.args.get("frequencia") or "").strip().upper()
+    return {
+        "de": _data("de"),
+        "ate": _data("ate"),
+        "status": status,
+        "situacao": (request.args.get("situacao") or "").strip().lower(),
+        "cliente": (request.args.get("cliente") or "").strip(),
+        "placa": (request.args.get("placa") or "").strip(),
+        "frequencia": frequencia if frequencia in ("WEEKLY", "MONTHLY") else "",
+        "locacao_id": request.args.get("locacao_id", type=int),
+    }
+
+# ==== Exportar planilha (CSV/XLSX) em streaming ====
+# Ex.: /exportar/boletos.xlsx?de=2024-01-01&ate=2024-12-31&status=RECEIVED&status=CONFIRMED
+@exportacao_bp.route("/<tabela>.<formato>")
+@login_required
+def exportar(tabela, formato):
+    exp = exportacao.EXPORTACOES.get(tabela)
+    if exp is None or formato not in exportacao.FORMATOS:
+        abort(404)
+    gerar, mimetype = exportacao.FORMATOS[formato]
+
+    # A conexão do request só volta ao pool quando o streaming termina (stream_with_context)
+    cur = exportacao.abrir_cursor(get_db_connection(), exp, _filtros())
+    corpo = stream_with_context(gerar(exp.colunas, exportacao.linhas(cur), tabela))
+    nome = f"{tabela}_{dt.date.today():%Y%m%d}.{formato}"
+    return Response(corpo, mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{nome}"',
+        "X-Accel-Buffering": "no",  # nginx repassa os blocos em vez de acumular
+    })
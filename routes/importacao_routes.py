@@ -0,0 +1,122 @@
+import io
+import os
+from flask import Blueprint, Response, abort, current_app, flash, redirect, render_template, request, url_for
+from flask_login import login_required
+from database import get_db_connection
+import importacao
+
+importacao_bp = Blueprint("importacao", __name__, url_prefix="/importacao")
+
+# Linhas de erro mostradas na tela; o relatório CSV traz todas
+ERROS_NA_TELA = 500
+
+def _csv(conteudo, nome):
+    return Response(conteudo, mimetype="text/csv; charset=utf-8", headers={
+        "Content-Disposition": f'attachment; filename="{nome}"',
+    })
+
+# ==== Upload e histórico ====
+@importacao_bp.route("/", methods=["GET", "POST"])
+@login_required
+def importar():
+    if request.method == "POST":
+        tipo = request.form.get("tipo", "")
+        arquivo = request.files.get("arquivo")
+        if tipo not in importacao.TIPOS:
+            flash("Escolha o que importar (motos ou clientes).", "warning")
+            return redirect(url_for("importacao.importar"))
+        if not arquivo or not arquivo.filename:
+            flash("Nenhum arquivo selecionado.", "danger")
+            return redirect(url_for("importacao.importar", tipo=tipo))
+        if not arquivo.filename.lower().endswith((".csv", ".txt")):
+            flash("Envie a planilha em CSV (no Excel: Salvar como > CSV).", "warning")
+            return redirect(url_for("importacao.importar", tipo=tipo))
+
+        simular = request.form.get("simular") == "1"
+        conn = get_db_connection()
+        try:
+            # O upload é lido em streaming (o werkzeug guarda arquivos grandes em disco)
+            resultado = importacao.importar(
+                conn, tipo, arquivo.stream, nome_arquivo=os.path.basename(arquivo.filename),
+                asaas=tipo == "clientes" and request.form.get("asaas") == "1", simular=simular,
+            )
+        except importacao.ImportacaoInvalida as e:
+            flash(f"Arquivo recusado: {e}", "danger")
+            return redirect(url_for("importacao.importar", tipo=tipo))
+        except Exception:
+            current_app.logger.exception("Erro ao importar planilha %s (%s)", arquivo.filename, tipo)
+            flash("Erro inesperado ao importar a planilha; nada foi gravado.", "danger")
+            return redirect(url_for("importacao.importar", tipo=tipo))
+        finally:
+            conn.close()
+
+        if simular:
+            return render_template(
+                "importacao_resultado.html", imp=resultado, erros=resultado["lista_erros"][:ERROS_NA_TELA], fila=[],
+            )
+        flash(
+            f"Importação concluída: {resultado['inseridos']} nova(s), {resultado['atualizados']} atualizada(s), "
+            f"{resultado['erros']} com erro.", "success" if not resultado["erros"] else "warning",
+        )
+        return redirect(url_for("importacao.detalhe", importacao_id=resultado["id"]))
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, tipo, arquivo, origem, linhas, inseridos, atualizados, inalterados, erros,
+                   asaas_enfileirados, duracao_ms, created_at
+            FROM importacoes ORDER BY id DESC LIMIT 20
+        """)
+        historico = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+    tipo = request.args.get("tipo")
+    return render_template(
+        "importacao.html", historico=historico, campos=importacao.CAMPOS,
+        tipo=tipo if tipo in importacao.TIPOS else "motos",
+    )
+
+# ==== Resultado de uma importação ====
+@importacao_bp.route("/<int:importacao_id>")
+@login_required
+def detalhe(importacao_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT * FROM importacoes WHERE id = %s", (importacao_id,))
+        imp = cur.fetchone()
+        if imp is None:
+            abort(404)
+        erros = importacao.erros_da_importacao(cur, importacao_id, ERROS_NA_TELA)
+        fila = importacao.fila_asaas(cur, importacao_id) if imp["asaas_enfileirados"] else []
+    finally:
+        cur.close()
+        conn.close()
+    return render_template("importacao_resultado.html", imp=imp, erros=erros, fila=fila)
+
+@importacao_bp.route("/<int:importacao_id>/erros.csv")
+@login_required
+def relatorio_erros(importacao_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        erros = importacao.erros_da_importacao(cur, importacao_id)
+    finally:
+        cur.close()
+        conn.close()
+    saida = io.StringIO()
+    importacao.relatorio_csv(erros, saida)
+    return _csv(saida.getvalue(), f"importacao_{importacao_id}_erros.csv")
+
+@importacao_bp.route("/modelo/<tipo>.csv")
+@login_required
+def modelo(tipo):
+    if tipo not in importacao.TIPOS:
+        abort(404)
+    saida = io.StringIO()
+    saida.write("\ufeff")  # Excel reconhece o UTF-8
+    importacao.modelo_csv(tipo, saida)
+    return _csv(saida.getvalue(), f"modelo_{tipo}.csv")
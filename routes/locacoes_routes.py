@@ -1,70 +1,100 @@
 import datetime as dt
-import requests
 import psycopg2
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, send_from_directory, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, abort, jsonify
 from flask_login import login_required
 from database import get_db_connection
+import armazenamento
+import asaas_client
+import asaas_outbox
+import dashboard_metrics
+import disponibilidade
+import entrega
+import referencias
+import sync_boletos
 from config import Config
 from werkzeug.utils import secure_filename
-import os
 
 locacoes_bp = Blueprint("locacoes", __name__, url_prefix="/locacoes")
 
+LOCACOES_POR_PAGINA = 50
+TYPEAHEAD_LIMITE = 20
+STATUS_PAGAMENTO = ("PENDING", "RECEIVED", "CONFIRMED", "OVERDUE", "CANCELED",
+                    "REFUNDED", "CHARGEBACK", "RECEIVED_IN_CASH")
+
+def _filtros_listagem():
+    filtros = {
+        "cliente": (request.args.get("cliente") or "").strip(),
+        "placa": (request.args.get("placa") or "").strip(),
+        "status": (request.args.get("status") or "").strip().upper(),
+        "frequencia": (request.args.get("frequencia") or "").strip().upper(),
+    }
+    if filtros["status"] not in STATUS_PAGAMENTO:
+        filtros["status"] = ""
+    if filtros["frequencia"] not in ("WEEKLY", "MONTHLY"):
+        filtros["frequencia"] = ""
+    return filtros, request.args.get("antes", type=int)
+
 # ==== Listar locações ativas + Criar nova ====
 @locacoes_bp.route("/", methods=["GET", "POST"])
 @login_required
 def listar_locacoes():
-    import traceback
-    from psycopg2.extras import RealDictCursor
-
     breadcrumb = "inicio"
 
     if request.method == "GET":
+        filtros, antes = _filtros_listagem()
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur = conn.cursor()
         try:
-            # Locações ativas
-            cur.execute("""
+            # Locações ativas: paginação por chave (l.id DESC), uma página por vez
+            where, params = ["l.cancelado = FALSE"], []
+            if antes:
+                where.append("l.id < %s")
+                params.append(antes)
+            if filtros["cliente"]:
+                where.append("c.nome ILIKE %s")
+                params.append(f"%{filtros['cliente']}%")
+            if filtros["placa"]:
+                where.append("m.placa LIKE %s")
+                params.append(filtros["placa"].upper().replace("%", "") + "%")
+            if filtros["status"]:
+                where.append("l.pagamento_status = %s")
+                params.append(filtros["status"])
+            if filtros["frequencia"]:
+                where.append("l.frequencia_pagamento = %s")
+                params.append(filtros["frequencia"])
+
+            cur.execute(f"""
                 SELECT l.id, c.nome AS cliente_nome, m.modelo AS moto_modelo, m.placa AS moto_placa,
                 l.data_inicio, l.data_fim, l.frequencia_pagamento, 
-                l.contrato_arquivo, l.boleto_url, l.pagamento_status, l.valor_pago
+                l.contrato_arquivo, l.boleto_url, l.pagamento_status, l.valor_pago, l.valor_vencido,
+                l.asaas_subscription_id IS NULL AS asaas_pendente,
+                EXISTS (SELECT 1 FROM asaas_outbox o WHERE o.locacao_id = l.id AND o.status = 'DEAD') AS asaas_falhou
                 FROM locacoes l
                 JOIN clientes c ON c.id = l.cliente_id
                 JOIN motos m ON m.id = l.moto_id
-                WHERE l.cancelado = FALSE
+                WHERE {" AND ".join(where)}
                 ORDER BY l.id DESC
-            """)
-            locacoes_rows = cur.fetchall()
-            locacoes = [{
-                "id": r["id"],
-                "cliente_nome": r["cliente_nome"],
-                "moto_modelo": r["moto_modelo"],
-                "moto_placa": r["moto_placa"],
-                "data_inicio": r["data_inicio"],
-                "data_fim": r["data_fim"],
-                "frequencia_pagamento": r["frequencia_pagamento"],
-                "contrato_arquivo": r["contrato_arquivo"],
-                "boleto_url": r["boleto_url"],
-                "pagamento_status": r["pagamento_status"],
-                "valor_pago": r["valor_pago"],
-            } for r in locacoes_rows]
-
-            # Clientes para o select
-            cur.execute("SELECT id, nome FROM clientes ORDER BY nome ASC")
-            clientes = [{"id": r["id"], "nome": r["nome"]} for r in cur.fetchall()]
-
-            # Motos disponíveis
-            cur.execute("SELECT id, modelo, placa FROM motos WHERE disponivel = TRUE ORDER BY modelo ASC")
-            motos = [{"id": r["id"], "modelo": r["modelo"], "placa": r["placa"]} for r in cur.fetchall()]
-
-            return render_template("locacoes.html", locacoes=locacoes, clientes=clientes, motos=motos)
+                LIMIT %s
+            """, params + [LOCACOES_POR_PAGINA + 1])
+            locacoes = cur.fetchall()
+
+            proximo = None
+            if len(locacoes) > LOCACOES_POR_PAGINA:
+                locacoes = locacoes[:LOCACOES_POR_PAGINA]
+                proximo = locacoes[-1]["id"]
+
+            # Clientes e motos do formulário são carregados sob demanda (typeahead_*)
+            return render_template("locacoes.html", locacoes=locacoes, filtros=filtros,
+                                   filtros_url={k: v for k, v in filtros.items() if v},
+                                   proximo=proximo, primeira_pagina=not antes,
+                                   status_opcoes=STATUS_PAGAMENTO)
         finally:
             cur.close()
             conn.close()
 
     # POST: cria locação
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor()
 
     try:
         breadcrumb = "validando_campos"
@@ -110,25 +140,30 @@ def listar_locacoes():
         valor = float(valor_str.replace(".", "").replace(",", "."))
 
         breadcrumb = "buscar_cliente_moto"
-        cur.execute("SELECT asaas_id, nome FROM clientes WHERE id=%s", (cliente_id,))
+        cur.execute("SELECT asaas_id FROM clientes WHERE id=%s", (cliente_id,))
         cliente = cur.fetchone()
         if not cliente:
             flash("Cliente não encontrado.", "danger")
             return redirect(url_for("locacoes.listar_locacoes"))
-        asaas_customer_id = cliente["asaas_id"]
-        cliente_nome = cliente["nome"]
-        if not asaas_customer_id:
+        if not cliente["asaas_id"]:
             flash("Cliente sem integração Asaas (asaas_id ausente).", "danger")
             return redirect(url_for("locacoes.listar_locacoes"))
 
-        cur.execute("SELECT modelo, placa, disponivel FROM motos WHERE id=%s", (moto_id,))
+        # Trava a moto até o commit: duas criações simultâneas para a mesma moto
+        # não passam ambas pela checagem de período
+        cur.execute("SELECT disponivel FROM motos WHERE id=%s FOR NO KEY UPDATE", (moto_id,))
         moto = cur.fetchone()
         if not moto:
             flash("Moto não encontrada.", "danger")
             return redirect(url_for("locacoes.listar_locacoes"))
-        modelo, placa, disponivel = moto["modelo"], moto["placa"], moto["disponivel"]
-        if not disponivel:
-            flash("Moto indisponível para locação.", "warning")
+        if not moto["disponivel"]:
+            flash("Moto não está liberada para locação.", "warning")
+            return redirect(url_for("locacoes.listar_locacoes"))
+
+        breadcrumb = "checar_periodo"
+        ocupada = disponibilidade.conflitos(cur, moto_id, data_inicio, data_fim)
+        if ocupada:
+            flash(f"Moto já locada no período: {disponibilidade.descrever_conflitos(ocupada)}.", "warning")
             return redirect(url_for("locacoes.listar_locacoes"))
 
         breadcrumb = "checar_config_asaas"
@@ -136,94 +171,52 @@ def listar_locacoes():
             flash("Configuração do Asaas ausente. Verifique ASAAS_API_KEY/ASAAS_BASE_URL.", "danger")
             return redirect(url_for("locacoes.listar_locacoes"))
 
-        subscription_data = {
-            "customer": asaas_customer_id,
-            "billingType": "BOLETO",
-            "value": valor,
-            "cycle": frequencia,  # 'WEEKLY' ou 'MONTHLY'
-            "description": f"Locação moto {modelo} - {placa} ({cliente_nome})",
-            "nextDueDate": data_inicio.strftime("%Y-%m-%d")
-        }
-        if data_fim:
-            subscription_data["endDate"] = data_fim.strftime("%Y-%m-%d")
-
-        breadcrumb = "chamar_asaas"
-        try:
-            resp = requests.post(
-                f"{Config.ASAAS_BASE_URL}/subscriptions",
-                headers={"access_token": Config.ASAAS_API_KEY},
-                json=subscription_data,
-                timeout=30
-            )
-        except requests.RequestException as rexc:
-            print("ERRO REQUEST AO ASAAS:", rexc)
-            traceback.print_exc()
-            flash(f"Falha de conexão com Asaas: {str(rexc)}", "danger")
-            return redirect(url_for("locacoes.listar_locacoes"))
-
-        if resp.status_code not in (200, 201):
-            body = ""
-            try:
-                body = resp.text
-            except Exception:
-                body = "<sem corpo>"
-            print("ERRO ASAAS STATUS/RESP:", resp.status_code, body)
-            flash(f"Erro do Asaas ({resp.status_code}): {body}", "danger")
-            return redirect(url_for("locacoes.listar_locacoes"))
-
-        asaas_subscription_id = resp.json().get("id")
-        if not asaas_subscription_id:
-            print("ERRO: Resposta do Asaas sem id:", resp.json())
-            flash("Resposta do Asaas não retornou id da assinatura.", "danger")
-            return redirect(url_for("locacoes.listar_locacoes"))
-
         breadcrumb = "upload_contrato"
         contrato_arquivo = None
         arquivo = request.files.get("contrato_pdf")
         if arquivo and arquivo.filename:
-            nome_seguro = secure_filename(arquivo.filename)
-            pasta_contratos = os.path.join(os.getcwd(), "uploads", "contratos")
-            os.makedirs(pasta_contratos, exist_ok=True)
-            caminho_destino = os.path.join(pasta_contratos, nome_seguro)
-            arquivo.save(caminho_destino)
-            contrato_arquivo = nome_seguro
+            # Endereçado pelo conteúdo: contratos com o mesmo nome não se sobrescrevem
+            contrato_arquivo = armazenamento.salvar(
+                cur, arquivo.stream, secure_filename(arquivo.filename), arquivo.mimetype
+            ).chave
 
         breadcrumb = "insert_locacao"
         cur.execute("""
             INSERT INTO locacoes (
                 cliente_id, moto_id, data_inicio, data_fim,
-                valor, frequencia_pagamento, observacoes,
-                asaas_subscription_id, contrato_arquivo
-            ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                valor, frequencia_pagamento, observacoes, contrato_arquivo
+            ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+            RETURNING id
         """, (
             cliente_id, moto_id, data_inicio, data_fim,
-            valor, frequencia, observacoes,
-            asaas_subscription_id, contrato_arquivo
+            valor, frequencia, observacoes, contrato_arquivo
         ))
+        locacao_id = cur.fetchone()["id"]
 
-        breadcrumb = "update_moto_disponivel"
-        cur.execute("UPDATE motos SET disponivel=FALSE WHERE id=%s", (moto_id,))
+        # A assinatura é criada pelo outbox depois do commit; o id volta para a locação
+        breadcrumb = "outbox_asaas"
+        asaas_outbox.enfileirar(cur, locacao_id, asaas_outbox.CRIAR)
 
         conn.commit()
-        flash("Locação criada, contrato salvo e assinatura recorrente configurada no Asaas!", "success")
+        dashboard_metrics.invalidate()
+        referencias.invalidar("locacoes")
+        asaas_outbox.garantir_worker_em_thread()
+        flash("Locação criada e contrato salvo! A assinatura recorrente é configurada no Asaas em segundo plano.", "success")
         return redirect(url_for("locacoes.listar_locacoes"))
 
     except psycopg2.Error as e:
         conn.rollback()
-        print("ERRO psycopg2 em", breadcrumb, "=>", e)
-        traceback.print_exc()
+        current_app.logger.exception("Erro de banco ao criar locação (%s)", breadcrumb)
         detalhe = getattr(e.diag, "message_detail", "")
         msg = detalhe or (e.pgerror or str(e))
         flash(f"Erro ao criar locação ({breadcrumb}): {msg}", "danger")
     except ValueError as e:
         conn.rollback()
-        print("ERRO ValueError em", breadcrumb, "=>", e)
-        traceback.print_exc()
+        current_app.logger.warning("Data/valor inválido ao criar locação (%s): %s", breadcrumb, e)
         flash(f"Data/valor inválido ({breadcrumb}): {str(e)}", "danger")
     except Exception as e:
         conn.rollback()
-        print("ERRO inesperado em", breadcrumb, "=>", e)
-        traceback.print_exc()
+        current_app.logger.exception("Erro inesperado ao criar locação (%s)", breadcrumb)
         flash(f"Erro inesperado ao criar locação ({breadcrumb}): {repr(e)}", "danger")
     finally:
         cur.close()
@@ -231,6 +224,91 @@ def listar_locacoes():
 
     return redirect(url_for("locacoes.listar_locacoes"))
 
+# ==== Typeahead para o formulário de nova locação ====
+@locacoes_bp.route("/typeahead/clientes")
+@login_required
+def typeahead_clientes():
+    # Mesma busca indexada da tela de clientes (nome, email, CPF ou telefone), com cache (referencias.py)
+    q = (request.args.get("q") or "").strip()
+    return jsonify(referencias.clientes_typeahead(q, TYPEAHEAD_LIMITE))
+
+@locacoes_bp.route("/typeahead/motos")
+@login_required
+def typeahead_motos():
+    # Só motos livres no período escolhido no formulário (inicio/fim), com cache (referencias.py)
+    q = (request.args.get("q") or "").strip()
+    inicio, fim = _periodo_consulta()
+    return jsonify(referencias.motos_livres_typeahead(inicio, fim, q, TYPEAHEAD_LIMITE))
+
+# ==== Disponibilidade da frota por período (JSON) ====
+def _data_consulta(nome, padrao=None):
+    valor = (request.args.get(nome) or "").strip()
+    if not valor:
+        return padrao
+    try:
+        return dt.date.fromisoformat(valor)
+    except ValueError:
+        abort(400, description=f"Data inválida em '{nome}' (use AAAA-MM-DD).")
+
+def _iso(data):
+    return data.isoformat() if data else None
+
+def _periodo_consulta():
+    inicio = _data_consulta("inicio", dt.date.today())
+    fim = _data_consulta("fim")
+    if fim and fim < inicio:
+        abort(400, description="'fim' não pode ser anterior a 'inicio'.")
+    return inicio, fim
+
+# Ex.: /locacoes/disponibilidade?inicio=2025-03-10&fim=2025-03-20&q=CG
+# Sem 'fim' a consulta é para uma locação sem data de fim (livre dali em diante).
+@locacoes_bp.route("/disponibilidade")
+@login_required
+def disponibilidade_frota():
+    inicio, fim = _periodo_consulta()
+    q = (request.args.get("q") or "").strip()
+    limite = min(max(request.args.get("limite", disponibilidade.LIMITE_PADRAO, type=int), 1), 500)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        motos, total = disponibilidade.motos_livres(cur, inicio, fim, q, limite)
+        return jsonify({
+            "inicio": inicio.isoformat(),
+            "fim": _iso(fim),
+            "total": total,
+            "motos": [{"id": m["id"], "modelo": m["modelo"], "placa": m["placa"], "ano": m["ano"]} for m in motos],
+        })
+    finally:
+        cur.close()
+        conn.close()
+
+# Ex.: /locacoes/disponibilidade/7?de=2025-03-01&ate=2025-05-31 (padrão: próximos 90 dias)
+@locacoes_bp.route("/disponibilidade/<int:moto_id>")
+@login_required
+def agenda_moto(moto_id):
+    de = _data_consulta("de", dt.date.today())
+    ate = _data_consulta("ate", de + dt.timedelta(days=90))
+    if ate < de:
+        abort(400, description="'ate' não pode ser anterior a 'de'.")
+    moto = referencias.moto(moto_id)
+    if not moto:
+        abort(404)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        ocupados, livres = disponibilidade.agenda(cur, moto_id, de, ate)
+        return jsonify({
+            "moto": {k: moto[k] for k in ("id", "modelo", "placa", "disponivel")},
+            "de": de.isoformat(),
+            "ate": ate.isoformat(),
+            "ocupado": [{"locacao_id": o["id"], "cliente": o["cliente_nome"],
+                         "inicio": _iso(o["data_inicio"]), "fim": _iso(o["data_fim"])} for o in ocupados],
+            "livre": [{"inicio": _iso(l["inicio"]), "fim": _iso(l["fim"])} for l in livres] if moto["disponivel"] else [],
+        })
+    finally:
+        cur.close()
+        conn.close()
+
 # ==== Editar locação + listar boletos ====
 @locacoes_bp.route("/<int:id>/editar", methods=["GET", "POST"])
 @login_required
@@ -239,49 +317,61 @@ def editar_locacao(id):
     cur = conn.cursor()
 
     if request.method == "POST":
-        data_inicio = request.form["data_inicio"]
-        data_fim = request.form.get("data_fim") or None
         valor = request.form["valor"]
         frequencia = request.form["frequencia_pagamento"]
         observacoes = request.form.get("observacoes")
+        aviso = None
+        try:
+            data_inicio = dt.date.fromisoformat(request.form["data_inicio"])
+            data_fim = request.form.get("data_fim") or None
+            data_fim = dt.date.fromisoformat(data_fim) if data_fim else None
+        except ValueError:
+            aviso = "Data inválida. Use o formato aaaa-mm-dd."
+        else:
+            if data_fim and data_fim < data_inicio:
+                aviso = "Data fim não pode ser anterior à data de início."
+        if aviso:
+            flash(aviso, "warning")
+            cur.close()
+            conn.close()
+            return redirect(url_for("locacoes.editar_locacao", id=id))
 
         try:
+            # Mesma ordem da criação: trava a moto e confere o período antes de gravar
             cur.execute("""
-                UPDATE locacoes SET data_inicio=%s, data_fim=%s, valor=%s,
-                frequencia_pagamento=%s, observacoes=%s WHERE id=%s
-            """, (data_inicio, data_fim, valor, frequencia, observacoes, id))
-
-            cur.execute("SELECT asaas_subscription_id FROM locacoes WHERE id=%s", (id,))
-            row = cur.fetchone()
-            asaas_subscription_id = row[0] if row else None
-
-            if asaas_subscription_id:
-                patch_data = {"value": float(valor), "cycle": frequencia}
-                if data_inicio:
-                    patch_data["nextDueDate"] = data_inicio
-                if data_fim:
-                    patch_data["endDate"] = data_fim
-
-                resp = requests.post(
-                    f"{Config.ASAAS_BASE_URL}/subscriptions/{asaas_subscription_id}",
-                    headers={"access_token": Config.ASAAS_API_KEY},
-                    json=patch_data,
-                    timeout=30
-                )
-                if resp.status_code not in (200, 201):
-                    resp = requests.put(
-                        f"{Config.ASAAS_BASE_URL}/subscriptions/{asaas_subscription_id}",
-                        headers={"access_token": Config.ASAAS_API_KEY},
-                        json=patch_data,
-                        timeout=30
-                    )
-                if resp.status_code not in (200, 201):
-                    flash(f"Locação atualizada, mas falhou no Asaas: {resp.text}", "warning")
-                else:
-                    flash("Locação e assinatura atualizadas!", "success")
+                SELECT m.id FROM locacoes l JOIN motos m ON m.id = l.moto_id
+                WHERE l.id = %s FOR NO KEY UPDATE OF m
+            """, (id,))
+            moto = cur.fetchone()
+            ocupada = moto and disponibilidade.conflitos(cur, moto["id"], data_inicio, data_fim, ignorar_locacao=id)
+            if moto is None:
+                flash("Locação não encontrada.", "danger")
+            elif ocupada:
+                conn.rollback()
+                flash(f"Moto já locada no período: {disponibilidade.descrever_conflitos(ocupada)}.", "warning")
             else:
-                flash("Locação e assinatura atualizadas!", "success")
+                cur.execute("""
+                    UPDATE locacoes SET data_inicio=%s, data_fim=%s, valor=%s,
+                    frequencia_pagamento=%s, observacoes=%s WHERE id=%s
+                    RETURNING cancelado
+                """, (data_inicio, data_fim, valor, frequencia, observacoes, id))
+
+                # Assinatura atualizada pelo outbox, com o estado da locação no momento do envio
+                if not cur.fetchone()["cancelado"]:
+                    asaas_outbox.enfileirar(cur, id, asaas_outbox.ATUALIZAR)
+                conn.commit()
+                referencias.invalidar("locacoes")
+                asaas_outbox.garantir_worker_em_thread()
+                flash("Locação atualizada! A assinatura no Asaas é atualizada em segundo plano.", "success")
+        except psycopg2.errors.ExclusionViolation:
+            conn.rollback()
+            cur.execute("SELECT moto_id FROM locacoes WHERE id=%s", (id,))
+            moto_id = cur.fetchone()["moto_id"]
+            ocupada = disponibilidade.conflitos(cur, moto_id, data_inicio, data_fim, ignorar_locacao=id)
+            flash(f"Moto já locada no período: {disponibilidade.descrever_conflitos(ocupada)}.", "warning")
         except Exception as e:
+            conn.rollback()
+            current_app.logger.exception("Erro ao atualizar locação %s", id)
             flash(f"Erro ao atualizar locação: {e}", "danger")
 
         conn.commit()
@@ -300,10 +390,31 @@ def editar_locacao(id):
         ORDER BY data_vencimento DESC NULLS LAST, id DESC
     """, (id,))
     boletos = cur.fetchall()
+    pendencias_asaas = asaas_outbox.pendencias(cur, id)
 
     cur.close()
     conn.close()
-    return render_template("editar_locacao.html", locacao=locacao, boletos=boletos)
+    return render_template("editar_locacao.html", locacao=locacao, boletos=boletos,
+                           pendencias_asaas=pendencias_asaas)
+
+# ==== Reenviar ao Asaas operações que falharam ====
+@locacoes_bp.route("/<int:id>/asaas/reenviar", methods=["POST"])
+@login_required
+def reenviar_asaas(id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        reenviadas = asaas_outbox.reenviar(cur, id)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    if reenviadas:
+        asaas_outbox.garantir_worker_em_thread()
+        flash(f"{reenviadas} operação(ões) reenviada(s) ao Asaas.", "info")
+    else:
+        flash("Nenhuma operação com falha para reenviar.", "warning")
+    return redirect(url_for("locacoes.editar_locacao", id=id))
 
 # ==== Listar locações canceladas ====
 @locacoes_bp.route("/canceladas")
@@ -333,38 +444,33 @@ def cancelar_locacao(id):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT asaas_subscription_id, moto_id FROM locacoes WHERE id=%s", (id,))
+        cur.execute("SELECT cancelado FROM locacoes WHERE id=%s FOR UPDATE", (id,))
         row = cur.fetchone()
         if not row:
             flash("Locação não encontrada.", "danger")
             return redirect(url_for("locacoes.listar_locacoes"))
 
-        if isinstance(row, dict):
-            asaas_subscription_id = row.get("asaas_subscription_id")
-            moto_id = row.get("moto_id")
-        else:
-            asaas_subscription_id = row[0]
-            moto_id = row[1]
-
-        # Cancela assinatura no Asaas se existir
-        if asaas_subscription_id:
-            resp = requests.post(
-                f"{Config.ASAAS_BASE_URL}/subscriptions/{asaas_subscription_id}/cancel",
-                headers={"access_token": Config.ASAAS_API_KEY},
-                timeout=30
-            )
-            if resp.status_code not in (200, 201):
-                flash(f"Falha ao cancelar assinatura no Asaas: {resp.text}", "warning")
-
-        # Cancela locação localmente
+        if row["cancelado"]:
+            flash("Locação já cancelada.", "info")
+            return redirect(url_for("locacoes.listar_locacoes"))
+
+        # Cancela localmente; a assinatura é cancelada no Asaas pelo outbox, na mesma transação.
+        # Locação que ainda não começou termina no próprio início (o período não pode ficar invertido)
         hoje = dt.date.today().strftime("%Y-%m-%d")
-        cur.execute("UPDATE locacoes SET cancelado=TRUE, data_fim=%s WHERE id=%s", (hoje, id))
-        cur.execute("UPDATE motos SET disponivel=TRUE WHERE id=%s", (moto_id,))
+        cur.execute("""
+            UPDATE locacoes SET cancelado=TRUE, data_fim=GREATEST(data_inicio, %s::date)
+            WHERE id=%s AND cancelado = FALSE
+        """, (hoje, id))
+        asaas_outbox.enfileirar(cur, id, asaas_outbox.CANCELAR)
         conn.commit()
-        flash("Locação cancelada!", "info")
+        dashboard_metrics.invalidate()
+        referencias.invalidar("locacoes")
+        asaas_outbox.garantir_worker_em_thread()
+        flash("Locação cancelada! A assinatura no Asaas é cancelada em segundo plano.", "info")
 
     except psycopg2.Error as e:
         conn.rollback()
+        current_app.logger.exception("Erro de banco ao cancelar locação %s", id)
         motivo = e.pgerror or str(e)
         detalhe = getattr(e.diag, "message_detail", "")
         if detalhe:
@@ -374,7 +480,7 @@ def cancelar_locacao(id):
 
     except Exception as e:
         conn.rollback()
-        print(f"Erro inesperado ao cancelar locação: {repr(e)} (tipo: {type(e)})")
+        current_app.logger.exception("Erro inesperado ao cancelar locação %s", id)
         flash(f"Erro inesperado ao cancelar locação: {repr(e)}", "danger")
 
     finally:
@@ -386,65 +492,15 @@ def cancelar_locacao(id):
 @locacoes_bp.route("/<int:id>/sincronizar_boletos", methods=["GET"])
 @login_required
 def sincronizar_boletos_manual(id):
-    conn = get_db_connection()
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT asaas_subscription_id FROM locacoes WHERE id=%s", (id,))
-        row = cur.fetchone()
-        if not row or not row[0]:
-            flash("Assinatura Asaas não vinculada à locação.", "warning")
-            return redirect(url_for("locacoes.editar_locacao", id=id))
-
-        sub_id = row[0]
-        url = f"{Config.ASAAS_BASE_URL}/payments?subscription={sub_id}&limit=100"
-        resp = requests.get(url, headers={"access_token": Config.ASAAS_API_KEY}, timeout=30)
-        if resp.status_code not in (200, 201):
-            flash(f"Erro ao consultar boletos no Asaas: {resp.text}", "danger")
-            return redirect(url_for("locacoes.editar_locacao", id=id))
-
-        data = resp.json()
-        items = data.get("data", []) if isinstance(data, dict) else []
-
-        inseridos, atualizados = 0, 0
-        for p in items:
-            asaas_payment_id = p.get("id")
-            status = p.get("status")
-            valor = p.get("value")
-            net_value = p.get("netValue")
-            boleto_url = p.get("bankSlipUrl")
-            descricao = p.get("description")
-            due_date = p.get("dueDate")
-            payment_date = p.get("paymentDate")
-
-            cur.execute("SELECT id FROM boletos WHERE asaas_payment_id=%s", (asaas_payment_id,))
-            existe = cur.fetchone()
-            if existe:
-                cur.execute("""
-                    UPDATE boletos
-                    SET status=%s, valor=%s, valor_pago=%s, boleto_url=%s,
-                    descricao=%s, data_vencimento=%s, data_pagamento=%s
-                    WHERE asaas_payment_id=%s
-                """, (status, valor, net_value, boleto_url,
-                      descricao, due_date, payment_date, asaas_payment_id))
-                atualizados += 1
-            else:
-                cur.execute("""
-                    INSERT INTO boletos (locacao_id, asaas_payment_id, status, valor,
-                    valor_pago, boleto_url, descricao,
-                    data_vencimento, data_pagamento)
-                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """, (id, asaas_payment_id, status, valor, net_value,
-                      boleto_url, descricao, due_date, payment_date))
-                inseridos += 1
-
-        conn.commit()
-        flash(f"Boletos sincronizados! Inseridos: {inseridos}, Atualizados: {atualizados}.", "success")
+        resultado = sync_boletos.sincronizar_locacao(id)
+        flash(f"Boletos sincronizados! Inseridos: {resultado.inseridos}, Atualizados: {resultado.atualizados}.", "success")
+    except LookupError as e:
+        flash(str(e), "warning")
+    except asaas_client.AsaasError as e:
+        flash(f"Erro ao consultar boletos no Asaas: {e.body}", "danger")
     except Exception as e:
-        conn.rollback()
         flash(f"Erro ao sincronizar boletos: {e}", "danger")
-    finally:
-        cur.close()
-        conn.close()
     return redirect(url_for("locacoes.editar_locacao", id=id))
 
 
@@ -457,13 +513,13 @@ def contrato_pdf(locacao_id):
     try:
         cur.execute("SELECT contrato_arquivo FROM locacoes WHERE id = %s", (locacao_id,))
         result = cur.fetchone()
-        if not result or not result[0]:
+        if not result or not result["contrato_arquivo"]:
             flash("Contrato não encontrado.", "warning")
             return redirect(url_for("locacoes.listar_locacoes"))
-        contrato_arquivo = result[0]
 
-        uploads_dir = os.path.join(os.getcwd(), "uploads", "contratos")
-        return send_from_directory(directory=uploads_dir, filename=contrato_arquivo)
+        return entrega.enviar(
+            result["contrato_arquivo"], nome_download=f"contrato_{locacao_id}.pdf", pasta_legada="contratos"
+        )
     finally:
         cur.close()
         conn.close()
\ No newline at end of file
@@ -0,0 +1,24 @@
+import hmac
+from flask import Blueprint, Response, abort, current_app, request
+from flask_login import current_user
+import metrics
+from config import Config
+
+metrics_bp = Blueprint("metrics", __name__)
+
+# Exposição das métricas do worker no formato do Prometheus.
+# Com METRICS_TOKEN definido, o scraper se autentica pelo cabeçalho Authorization;
+# sem token, a rota fica restrita a usuários logados.
+@metrics_bp.route("/metrics")
+def prometheus():
+    token = (Config.METRICS_TOKEN or "").strip()
+    if token:
+        enviado = request.headers.get("Authorization", "").encode()
+        # Tempo constante nas duas formas aceitas (`|` compara as duas sempre)
+        if not (hmac.compare_digest(enviado, token.encode())
+                | hmac.compare_digest(enviado, f"Bearer {token}".encode())):
+            abort(401)
+    elif not current_user.is_authenticated:
+        return current_app.login_manager.unauthorized()
+
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -1,10 +1,13 @@
-import os
-import time
 import psycopg2
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_from_directory, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
 from flask_login import login_required
 from werkzeug.utils import secure_filename
 from database import get_db_connection
+import armazenamento
+import dashboard_metrics
+import entrega
+import imagens as imagens_pipeline
+import referencias
 
 motos_bp = Blueprint("motos", __name__, url_prefix="/motos")
 
@@ -17,11 +20,6 @@ ALLOWED_IMG_EXT = {"png", "jpg", "jpeg"}
 def _allowed(filename, allowed):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in allowed
 
-def _unique_filename(prefix_id, filename):
-    name, ext = os.path.splitext(filename)
-    ts = int(time.time() * 1000)
-    return f"{prefix_id}_{ts}{ext.lower()}"
-
 # ======================
 # Listar e cadastrar motos
 # ======================
@@ -43,6 +41,8 @@ def listar_motos():
                 VALUES (%s, %s, %s, %s)
             """, (placa, modelo, ano, disponivel))
             conn.commit()
+            dashboard_metrics.invalidate()
+            referencias.invalidar("motos")
             flash("Moto cadastrada com sucesso!", "success")
         except Exception as e:
             conn.rollback()
@@ -53,11 +53,20 @@ def listar_motos():
 
         return redirect(url_for("motos.listar_motos"))
 
-    cur.execute("SELECT id, placa, modelo, ano, disponivel, documento_arquivo, imagem FROM motos ORDER BY modelo")
-    motos = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template("motos.html", motos=motos)
+    cur.execute("""
+        SELECT m.id, m.placa, m.modelo, m.ano, m.disponivel, m.documento_arquivo, m.imagem,
+               EXISTS (
+                   SELECT 1 FROM locacoes l
+                   WHERE l.moto_id = m.id AND l.cancelado = FALSE AND l.periodo @> CURRENT_DATE
+               ) AS locada
+        FROM motos m ORDER BY m.modelo
+    """)
+    try:
+        # Lista sem paginação: o template percorre o cursor e cada linha só existe enquanto é desenhada
+        return render_template("motos.html", motos=cur)
+    finally:
+        cur.close()
+        conn.close()
 
 # ======================
 # Editar moto
@@ -80,6 +89,7 @@ def editar_moto(id):
                 WHERE id=%s
             """, (placa, modelo, ano, disponivel, id))
             conn.commit()
+            referencias.invalidar("motos", f"moto:{id}")
             flash("Moto atualizada com sucesso!", "success")
             return redirect(url_for("motos.listar_motos"))
         except Exception as e:
@@ -103,6 +113,8 @@ def excluir_moto(id):
     try:
         cur.execute("DELETE FROM motos WHERE id=%s", (id,))
         conn.commit()
+        dashboard_metrics.invalidate()
+        referencias.invalidar("motos", f"moto:{id}")
         flash("Moto excluída com sucesso!", "info")
     except psycopg2.errors.ForeignKeyViolation as e:
         conn.rollback()
@@ -143,13 +155,9 @@ def moto_documento(moto_id):
             return redirect(request.url)
 
         try:
-            filename = secure_filename(file.filename)
-            filename = _unique_filename(moto_id, filename)
-            pasta = os.path.join(current_app.config["UPLOAD_FOLDER"], "contratos")  
-            os.makedirs(pasta, exist_ok=True)
-            file.save(os.path.join(pasta, filename))
+            arquivo = armazenamento.salvar(cur, file.stream, secure_filename(file.filename), file.mimetype)
 
-            cur.execute("UPDATE motos SET documento_arquivo=%s WHERE id=%s", (filename, moto_id))
+            cur.execute("UPDATE motos SET documento_arquivo=%s WHERE id=%s", (arquivo.chave, moto_id))
             conn.commit()
             flash("Documento enviado com sucesso!", "success")
             return redirect(url_for("motos.moto_documento", moto_id=moto_id))
@@ -169,18 +177,7 @@ def excluir_documento_moto(moto_id):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT documento_arquivo FROM motos WHERE id=%s", (moto_id,))
-        row = cur.fetchone()
-        if row and row[0]:
-            filename = row[0]
-            pasta = os.path.join(current_app.config["UPLOAD_FOLDER"], "contratos")
-            filepath = os.path.join(pasta, filename)
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except Exception:
-                    pass
-
+        # O arquivo pode estar referenciado em outro lugar (dedup); sem referências, sai na limpeza de órfãos
         cur.execute("UPDATE motos SET documento_arquivo=NULL WHERE id=%s", (moto_id,))
         conn.commit()
         flash("Documento da moto removido com sucesso!", "info")
@@ -192,11 +189,12 @@ def excluir_documento_moto(moto_id):
         conn.close()
     return redirect(url_for("motos.moto_documento", moto_id=moto_id))
 
-@motos_bp.route("/documentos/<filename>")
+@motos_bp.route("/documentos/<path:filename>")
 @login_required
 def serve_documento_moto(filename):
-    pasta = os.path.join(current_app.config["UPLOAD_FOLDER"], "contratos")
-    return send_from_directory(pasta, filename)
+    if not armazenamento.legado(filename) and not armazenamento.chave_valida(filename):
+        abort(404)
+    return entrega.enviar(filename, pasta_legada="contratos")
 
 # ======================
 # Imagens da moto (upload múltiplo/lista/excluir)
@@ -213,27 +211,26 @@ def moto_imagens(moto_id):
             flash("Nenhuma imagem selecionada.", "warning")
             return redirect(request.url)
 
-        pasta = os.path.join(current_app.config["UPLOAD_FOLDER"], "motos")
-        os.makedirs(pasta, exist_ok=True)
-
-        count_ok = 0
+        enviadas = []
         try:
             for f in files:
                 if not f or f.filename == "":
                     continue
                 if not _allowed(f.filename, ALLOWED_IMG_EXT):
                     continue
-                filename = secure_filename(f.filename)
-                filename = _unique_filename(moto_id, filename)
-                f.save(os.path.join(pasta, filename))
+                arquivo = armazenamento.salvar(cur, f.stream, secure_filename(f.filename), f.mimetype)
 
                 cur.execute("""
                     INSERT INTO moto_imagens (moto_id, arquivo)
                     VALUES (%s, %s)
-                """, (moto_id, filename))
-                count_ok += 1
+                    RETURNING id
+                """, (moto_id, arquivo.chave))
+                enviadas.append((cur.fetchone()["id"], arquivo.chave))
 
             conn.commit()
+            count_ok = len(enviadas)
+            # Miniaturas/WebP são geradas no pool de processos, sem segurar a resposta
+            imagens_pipeline.processar_em_background(enviadas)
             if count_ok > 0:
                 flash(f"{count_ok} imagem(ns) enviada(s) com sucesso!", "success")
             else:
@@ -246,7 +243,7 @@ def moto_imagens(moto_id):
     cur.execute("SELECT id, placa, modelo FROM motos WHERE id=%s", (moto_id,))
     moto = cur.fetchone()
 
-    cur.execute("SELECT id, arquivo, data_upload FROM moto_imagens WHERE moto_id=%s ORDER BY id DESC", (moto_id,))
+    cur.execute("SELECT id, arquivo, variantes, data_upload FROM moto_imagens WHERE moto_id=%s ORDER BY id DESC", (moto_id,))
     imagens = cur.fetchall()
 
     cur.close()
@@ -259,19 +256,9 @@ def excluir_imagem_moto(moto_id, img_id):
     conn = get_db_connection()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT arquivo FROM moto_imagens WHERE id=%s AND moto_id=%s", (img_id, moto_id))
-        row = cur.fetchone()
-        if row:
-            filename = row[0]
-            pasta = os.path.join(current_app.config["UPLOAD_FOLDER"], "motos")
-            filepath = os.path.join(pasta, filename)
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except Exception:
-                    pass
-
-            cur.execute("DELETE FROM moto_imagens WHERE id=%s", (img_id,))
+        # Original e variantes sem outras referências saem na limpeza de órfãos do armazenamento
+        cur.execute("DELETE FROM moto_imagens WHERE id=%s AND moto_id=%s", (img_id, moto_id))
+        if cur.rowcount:
             conn.commit()
             flash("Imagem removida!", "info")
         else:
@@ -285,8 +272,23 @@ def excluir_imagem_moto(moto_id, img_id):
 
     return redirect(url_for("motos.moto_imagens", moto_id=moto_id))
 
-@motos_bp.route("/imagens/<filename>")
+@motos_bp.route("/imagens/<path:filename>")
 @login_required
 def serve_imagem_moto(filename):
-    pasta = os.path.join(current_app.config["UPLOAD_FOLDER"], "motos")
-    return send_from_directory(pasta, filename)
\ No newline at end of file
+    if not armazenamento.legado(filename) and not armazenamento.chave_valida(filename):
+        abort(404)
+    return entrega.enviar(filename, pasta_legada="motos")
+
+# Escolha da variante nos templates (ver templates/_imagem_moto.html)
+@motos_bp.app_template_global()
+def imagem_moto_url(img, variante=None, formato="jpeg"):
+    v = (img.get("variantes") or {}).get(variante) if variante else None
+    return url_for("motos.serve_imagem_moto", filename=v[formato] if v else img["arquivo"])
+
+@motos_bp.app_template_global()
+def imagem_moto_srcset(img, formato="jpeg"):
+    variantes = img.get("variantes") or {}
+    return ", ".join(
+        f"{url_for('motos.serve_imagem_moto', filename=v[formato])} {v['largura']}w"
+        for v in variantes.values()
+    )
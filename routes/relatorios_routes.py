@@ -0,0 +1,105 @@
+import datetime as dt
+from collections.abc import Mapping
+from decimal import Decimal
+from flask import Blueprint, render_template, request, jsonify, abort
+from flask_login import login_required
+from database import get_db_connection
+import relatorios
+
+relatorios_bp = Blueprint("relatorios", __name__, url_prefix="/relatorios")
+
+def _parametros():
+    padrao_de, padrao_ate = relatorios.periodo_padrao()
+    try:
+        de = dt.date.fromisoformat(request.args["de"]) if request.args.get("de") else padrao_de
+        ate = dt.date.fromisoformat(request.args["ate"]) if request.args.get("ate") else padrao_ate
+    except ValueError:
+        abort(400, description="Datas devem estar no formato AAAA-MM-DD.")
+    if de > ate:
+        de, ate = ate, de
+    granularidade = request.args.get("granularidade", "mes")
+    if granularidade not in relatorios.GRANULARIDADES:
+        granularidade = "mes"
+    limite = min(max(request.args.get("limite", 20, type=int), 1), 500)
+    return de, ate, granularidade, limite
+
+def _serializar(valor):
+    # Datas em ISO e valores como número (o JSON padrão do Flask usaria data HTTP e string)
+    if isinstance(valor, Mapping):  # dicts e linhas do banco (linhas.py)
+        return {k: _serializar(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_serializar(v) for v in valor]
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, dt.date):
+        return valor.isoformat()
+    return valor
+
+def _com_cursor(funcao):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        resultado = funcao(cur)
+        conn.commit()
+        return resultado
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+# ==== Página ====
+@relatorios_bp.route("/")
+@login_required
+def index():
+    de, ate, granularidade, limite = _parametros()
+
+    def consultar(cur):
+        relatorios.atualizar_utilizacao(cur, esperar=False)
+        return {
+            "receita": relatorios.receita(cur, granularidade, de, ate),
+            "por_moto": relatorios.receita_por(cur, "moto", de, ate, limite),
+            "por_cliente": relatorios.receita_por(cur, "cliente", de, ate, limite),
+            "inadimplencia": relatorios.inadimplencia(cur, limite=limite),
+            "utilizacao": relatorios.utilizacao(cur, granularidade, de, ate),
+        }
+
+    dados = _com_cursor(consultar)
+    return render_template("relatorios.html", de=de, ate=ate, granularidade=granularidade, **dados)
+
+# ==== JSON ====
+@relatorios_bp.route("/api/receita")
+@login_required
+def api_receita():
+    de, ate, granularidade, _ = _parametros()
+    linhas = _com_cursor(lambda cur: relatorios.receita(cur, granularidade, de, ate))
+    return jsonify(_serializar({"de": de, "ate": ate, "granularidade": granularidade, "periodos": linhas}))
+
+@relatorios_bp.route("/api/receita-por/<dimensao>")
+@login_required
+def api_receita_por(dimensao):
+    if dimensao not in relatorios.DIMENSOES:
+        abort(404)
+    de, ate, _, limite = _parametros()
+    linhas = _com_cursor(lambda cur: relatorios.receita_por(cur, dimensao, de, ate, limite))
+    return jsonify(_serializar({"de": de, "ate": ate, "dimensao": dimensao, "ranking": linhas}))
+
+@relatorios_bp.route("/api/inadimplencia")
+@login_required
+def api_inadimplencia():
+    _, _, _, limite = _parametros()
+    dados = _com_cursor(lambda cur: relatorios.inadimplencia(cur, limite=limite))
+    return jsonify(_serializar(dict(dados, hoje=dt.date.today())))
+
+@relatorios_bp.route("/api/utilizacao")
+@login_required
+def api_utilizacao():
+    de, ate, granularidade, _ = _parametros()
+
+    def consultar(cur):
+        relatorios.atualizar_utilizacao(cur, esperar=False)
+        return relatorios.utilizacao(cur, granularidade, de, ate)
+
+    linhas = _com_cursor(consultar)
+    return jsonify(_serializar({"de": de, "ate": ate, "granularidade": granularidade, "periodos": linhas}))
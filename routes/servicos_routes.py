@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
 from database import get_db_connection
+import referencias
 
 servicos_bp = Blueprint("servicos", __name__, url_prefix="/servicos")
 
@@ -40,17 +41,18 @@ def listar_servicos(locacao_id):
     """, (locacao_id,))
     servicos = cur.fetchall()
 
-    cur.execute("""
-        SELECT l.id, c.nome, m.modelo, m.placa
-        FROM locacoes l
-        JOIN clientes c ON c.id = l.cliente_id
-        JOIN motos m ON m.id = l.moto_id
-        WHERE l.id = %s
-    """, (locacao_id,))
+    cur.execute("SELECT id, cliente_id, moto_id FROM locacoes WHERE id = %s", (locacao_id,))
     locacao = cur.fetchone()
 
     cur.close()
     conn.close()
+
+    # Cabeçalho: nome do cliente e moto vêm do cache de referências
+    if locacao:
+        cliente = referencias.cliente(locacao["cliente_id"]) or {}
+        moto = referencias.moto(locacao["moto_id"]) or {}
+        locacao = {"id": locacao["id"], "nome": cliente.get("nome"),
+                   "modelo": moto.get("modelo"), "placa": moto.get("placa")}
     return render_template("servicos_locacao.html", servicos=servicos, locacao=locacao, locacao_id=locacao_id)
 
 # Excluir um serviço
@@ -1,6 +1,6 @@
-import json
-from flask import Blueprint, request, abort, Request
-from database import get_db_connection
+from flask import Blueprint, request, abort, current_app, Request
+import boletos
+import webhook_queue
 from config import Config
 
 webhook_bp = Blueprint("webhook", __name__, url_prefix="/webhook")
@@ -25,97 +25,61 @@ def asaas_webhook():
     except Exception:
         abort(400)
 
-    event = data.get("event")
-    payment = data.get("payment") or {}
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-
+    # Só persiste o evento bruto; o processamento acontece no consumidor da fila
     try:
-        if event in ("PAYMENT_CREATED", "PAYMENT_UPDATED"):
-            _upsert_boleto(cur, payment)
-
-        elif event in ("PAYMENT_CONFIRMED", "PAYMENT_RECEIVED", "PAYMENT_RECEIVED_IN_CASH"):
-            _upsert_boleto(cur, payment)
-            _atualizar_agregado_locacao(cur, payment)
-
-        elif event in ("PAYMENT_OVERDUE", "PAYMENT_DELETED", "PAYMENT_CANCELED"):
-            _upsert_boleto(cur, payment)
-            _atualizar_agregado_locacao(cur, payment)
+        evento_id = webhook_queue.PostgresStore().enfileirar(data)
+    except Exception:
+        current_app.logger.exception("Erro ao enfileirar evento do webhook")
+        # Sem persistir, é melhor o Asaas reenviar do que perder o evento
+        return {"ok": False, "error": "fila indisponível"}, 503
 
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        # Retornar 200 para Asaas não reenfileirar eternamente, mas logue em produção:
-        return {"ok": False, "error": str(e)}, 200
-    finally:
-        cur.close()
-        conn.close()
+    if evento_id is None:
+        # Reenvio de um evento já recebido: 200 para o Asaas parar de tentar
+        return {"ok": True, "duplicado": True}, 200
 
+    webhook_queue.garantir_worker_em_thread(processar_evento)
     return {"ok": True}, 200
 
-def _upsert_boleto(cur, p):
-    asaas_payment_id = p.get("id")
-    status = p.get("status")
-    valor = p.get("value")
-    net_value = p.get("netValue")
-    boleto_url = p.get("bankSlipUrl")
-    descricao = p.get("description")
-    due_date = p.get("dueDate")
-    payment_date = p.get("paymentDate")
-    subscription_id = p.get("subscription")
-
-    # Relacionar com locação pela assinatura
-    cur.execute("SELECT id FROM locacoes WHERE asaas_subscription_id=%s", (subscription_id,))
-    row = cur.fetchone()
-    locacao_id = row[0] if row else None
-
-    # Upsert
-    cur.execute("SELECT id FROM boletos WHERE asaas_payment_id=%s", (asaas_payment_id,))
-    exists = cur.fetchone()
-    if exists:
-        cur.execute("""
-            UPDATE boletos
-               SET status=%s, valor=%s, valor_pago=%s, boleto_url=%s, descricao=%s,
-                   data_vencimento=%s, data_pagamento=%s
-             WHERE asaas_payment_id=%s
-        """, (status, valor, net_value, boleto_url, descricao, due_date, payment_date, asaas_payment_id))
-    else:
-        cur.execute("""
-            INSERT INTO boletos (locacao_id, asaas_payment_id, status, valor, valor_pago,
-                                 boleto_url, descricao, data_vencimento, data_pagamento)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        """, (locacao_id, asaas_payment_id, status, valor, net_value, boleto_url, descricao, due_date, payment_date))
+def processar_evento(cur, data):
+    """Aplica um evento do Asaas no banco. Chamado pelo consumidor da fila (webhook_queue)."""
+    event = data.get("event")
+    payment = data.get("payment") or {}
 
-def _atualizar_agregado_locacao(cur, p):
-    # Recalcula status agregado da locação com base nos boletos
-    subscription_id = p.get("subscription")
-    if not subscription_id:
-        return
-    cur.execute("SELECT id FROM locacoes WHERE asaas_subscription_id=%s", (subscription_id,))
-    row = cur.fetchone()
-    if not row:
-        return
-    locacao_id = row[0]
+    if event in ("PAYMENT_CREATED", "PAYMENT_UPDATED",
+                 "PAYMENT_CONFIRMED", "PAYMENT_RECEIVED", "PAYMENT_RECEIVED_IN_CASH",
+                 "PAYMENT_OVERDUE", "PAYMENT_DELETED", "PAYMENT_CANCELED"):
+        # O ledger financeiro (financeiro_mensal/locacoes.valor_pago) recebe o delta via trigger
+        _upsert_boleto(cur, payment)
 
-    # Somatório valor pago e status mais recente
+def _upsert_boleto(cur, p):
+    resultado = boletos.salvar_boletos(cur, [p])
+    if resultado.sem_locacao:
+        assinatura = p.get("subscription")
+        if not assinatura:
+            raise webhook_queue.EventoIgnorado(f"cobrança avulsa {p.get('id')} (sem assinatura)")
+        if not _assinatura_pode_chegar(cur, p):
+            raise webhook_queue.EventoIgnorado(f"assinatura {assinatura} não pertence a nenhuma locação")
+        # O id da assinatura só chega à locação depois que o outbox a cria no Asaas: falhar faz a fila tentar de novo
+        raise LookupError(f"Locação não encontrada para a assinatura {assinatura}")
+    return resultado
+
+def _assinatura_pode_chegar(cur, p):
+    """Alguma locação ainda pode receber esta assinatura: a referência aponta para uma locação
+    sem assinatura, ou há criação pendente no outbox para um cliente com o mesmo customer
+    do pagamento (o outbox grava o id na mesma transação)."""
+    referencia = p.get("externalReference") or ""
+    locacao_id = referencia[len("locacao:"):] if referencia.startswith("locacao:") else ""
     cur.execute("""
-        SELECT
-            COALESCE(SUM(CASE WHEN status IN ('RECEIVED','CONFIRMED','RECEIVED_IN_CASH') THEN COALESCE(valor_pago,0) ELSE 0 END),0) AS total_pago,
-            MAX(data_pagamento) AS ultima_data_pagto
-        FROM boletos
-        WHERE locacao_id=%s
-    """, (locacao_id,))
-    agg = cur.fetchone()
-    total_pago = agg[0] if agg else 0
-
-    # Atualiza campos agregados (se você tiver colunas pagamento_status/valor_pago na locações)
-    try:
-        cur.execute("""
-            UPDATE locacoes
-               SET valor_pago=%s
-             WHERE id=%s
-        """, (total_pago, locacao_id))
-    except Exception:
-        # Se a coluna não existir, ignore silenciosamente
-        pass
\ No newline at end of file
+        SELECT EXISTS (
+                   SELECT 1 FROM locacoes
+                   WHERE id = %(locacao)s AND asaas_subscription_id IS NULL AND cancelado = FALSE
+               )
+            OR EXISTS (
+                   SELECT 1 FROM asaas_outbox o
+                   JOIN locacoes l ON l.id = o.locacao_id
+                   JOIN clientes c ON c.id = l.cliente_id
+                   WHERE o.operacao = 'CRIAR' AND o.status = 'PENDING'
+                     AND l.asaas_subscription_id IS NULL AND c.asaas_id = %(customer)s
+               ) AS pode
+    """, {"locacao": int(locacao_id) if locacao_id.isdigit() else None, "customer": p.get("customer")})
+    return cur.fetchone()["pode"]
@@ -3,6 +3,10 @@
 
 -- Extensão para textos case-insensitive (emails, usernames)
 CREATE EXTENSION IF NOT EXISTS citext;
+-- Índices trigram para a busca de clientes (ILIKE '%termo%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+-- Igualdade de inteiros em índice GiST (restrição de exclusão moto_id + periodo)
+CREATE EXTENSION IF NOT EXISTS btree_gist;
 
 -- Função para atualizar updated_at automaticamente
 CREATE OR REPLACE FUNCTION set_updated_at()
@@ -44,6 +48,12 @@ CREATE TABLE IF NOT EXISTS clientes (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- CPF e telefone só com dígitos, para a busca ignorar máscara/pontuação
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS cpf_digitos TEXT
+    GENERATED ALWAYS AS (regexp_replace(COALESCE(cpf, ''), '\D', '', 'g')) STORED;
+ALTER TABLE clientes ADD COLUMN IF NOT EXISTS telefone_digitos TEXT
+    GENERATED ALWAYS AS (regexp_replace(telefone, '\D', '', 'g')) STORED;
+
 -- ====
 -- Motos
 -- ====
@@ -124,6 +134,73 @@ CREATE TABLE IF NOT EXISTS boletos (
     ))
 );
 
+-- Saldos em aberto por locação, mantidos junto com valor_pago pelo ledger (ver abaixo)
+ALTER TABLE locacoes ADD COLUMN IF NOT EXISTS valor_pendente NUMERIC(12,2) NOT NULL DEFAULT 0;
+ALTER TABLE locacoes ADD COLUMN IF NOT EXISTS valor_vencido NUMERIC(12,2) NOT NULL DEFAULT 0;
+
+-- Período ocupado pela locação, dias inclusivos; sem data_fim fica em aberto (ver disponibilidade.py)
+ALTER TABLE locacoes ADD COLUMN IF NOT EXISTS periodo DATERANGE
+    GENERATED ALWAYS AS (daterange(data_inicio, data_fim, '[]')) STORED;
+
+-- ====
+-- Ledger financeiro por locação e mês (ver financeiro.py)
+-- ====
+-- Boletos pagos contam no mês do pagamento; pendentes e vencidos, no mês do vencimento.
+-- Mantido por delta pelos triggers de boletos; `flask rebuild-financeiro` confere e reconstrói.
+CREATE TABLE IF NOT EXISTS financeiro_mensal (
+    locacao_id INTEGER NOT NULL REFERENCES locacoes(id) ON DELETE CASCADE,
+    mes DATE NOT NULL,
+    valor_pago NUMERIC(14,2) NOT NULL DEFAULT 0,
+    valor_pendente NUMERIC(14,2) NOT NULL DEFAULT 0,
+    valor_vencido NUMERIC(14,2) NOT NULL DEFAULT 0,
+    qtd_pagos INTEGER NOT NULL DEFAULT 0,
+    qtd_pendentes INTEGER NOT NULL DEFAULT 0,
+    qtd_vencidos INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (locacao_id, mes)
+);
+
+-- Receita semanal (boletos pagos, pela semana do pagamento), mantida pelos mesmos triggers
+CREATE TABLE IF NOT EXISTS receita_semanal (
+    semana DATE PRIMARY KEY,  -- segunda-feira
+    valor_pago NUMERIC(14,2) NOT NULL DEFAULT 0,
+    qtd_pagos INTEGER NOT NULL DEFAULT 0
+);
+
+-- ====
+-- Relatórios (ver relatorios.py)
+-- ====
+-- Utilização da frota por dia. Atualizada de forma incremental: os triggers de
+-- locacoes/motos só anotam em relatorios_estado o dia mais antigo afetado, e
+-- relatorios.atualizar_utilizacao() recalcula dali até hoje.
+CREATE TABLE IF NOT EXISTS utilizacao_diaria (
+    dia DATE PRIMARY KEY,
+    motos_locadas INTEGER NOT NULL,
+    frota INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS relatorios_estado (
+    nome VARCHAR(50) PRIMARY KEY,
+    recalcular_desde DATE
+);
+INSERT INTO relatorios_estado (nome) VALUES ('utilizacao') ON CONFLICT (nome) DO NOTHING;
+
+-- ====
+-- Arquivos enviados, endereçados pelo conteúdo (ver armazenamento.py)
+-- ====
+-- As colunas *_arquivo e moto_imagens.arquivo guardam a chave ("ab/abcd....pdf").
+CREATE TABLE IF NOT EXISTS arquivos (
+    sha256 CHAR(64) PRIMARY KEY,
+    chave TEXT NOT NULL UNIQUE,
+    tamanho BIGINT NOT NULL,
+    mime_type VARCHAR(100) NOT NULL,
+    nome_original TEXT,
+    backend VARCHAR(20) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ultimo_uso TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT chk_arquivos_tamanho CHECK (tamanho >= 0)
+);
+
 -- ====
 -- Imagens das Motos
 -- ====
@@ -134,6 +211,10 @@ CREATE TABLE IF NOT EXISTS moto_imagens (
     data_upload TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Variantes geradas no upload (imagens.py): {"thumb": {"jpeg": ..., "webp": ..., "largura": ..., "altura": ...}, ...}
+-- NULL enquanto a foto não foi processada; os templates usam o original.
+ALTER TABLE moto_imagens ADD COLUMN IF NOT EXISTS variantes JSONB;
+
 -- ====
 -- Serviços Extras nas Locações
 -- ====
@@ -151,28 +232,215 @@ CREATE TABLE IF NOT EXISTS servicos_locacao (
     CONSTRAINT chk_servicos_km CHECK (quilometragem IS NULL OR quilometragem >= 0)
 );
 
+-- ====
+-- Fila de eventos do webhook Asaas (ver webhook_queue.py)
+-- ====
+CREATE TABLE IF NOT EXISTS webhook_eventos (
+    id BIGSERIAL PRIMARY KEY,
+    evento VARCHAR(100),
+    chave_ordem VARCHAR(255) NOT NULL DEFAULT '',  -- assinatura (ou pagamento) que define a ordem
+    payload JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'PENDING',
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    proxima_tentativa TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ultimo_erro TEXT,
+    processado_em TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT chk_webhook_eventos_status CHECK (status IN ('PENDING','DONE','DEAD'))
+);
+
+-- Deduplicação: id do evento no Asaas ou hash do payload (ver webhook_queue.chave_dedup)
+ALTER TABLE webhook_eventos ADD COLUMN IF NOT EXISTS chave_dedup VARCHAR(255);
+ALTER TABLE webhook_eventos ADD COLUMN IF NOT EXISTS reprocessamentos INTEGER NOT NULL DEFAULT 0;
+-- Motivo quando o evento foi concluído sem efeito (ex.: pagamento de assinatura que não é nossa)
+ALTER TABLE webhook_eventos ADD COLUMN IF NOT EXISTS ignorado TEXT;
+
+-- ====
+-- Outbox das assinaturas no Asaas (ver asaas_outbox.py)
+-- ====
+CREATE TABLE IF NOT EXISTS asaas_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    locacao_id INTEGER NOT NULL REFERENCES locacoes(id) ON DELETE CASCADE,
+    operacao VARCHAR(20) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'PENDING',
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    proxima_tentativa TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ultimo_erro TEXT,
+    resultado JSONB,
+    processado_em TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT chk_asaas_outbox_operacao CHECK (operacao IN ('CRIAR','ATUALIZAR','CANCELAR')),
+    CONSTRAINT chk_asaas_outbox_status CHECK (status IN ('PENDING','DONE','DEAD'))
+);
+
+-- ====
+-- Tarefas periódicas (ver agendador.py)
+-- ====
+CREATE TABLE IF NOT EXISTS tarefas (
+    nome VARCHAR(100) PRIMARY KEY,
+    intervalo_segundos INTEGER NOT NULL,
+    ativa BOOLEAN NOT NULL DEFAULT TRUE,
+    proxima_execucao TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    executando_desde TIMESTAMP,
+    executando_em VARCHAR(255),  -- host:pid de quem está rodando
+    ultima_execucao TIMESTAMP,
+    ultima_duracao_ms INTEGER,
+    ultimo_status VARCHAR(20),
+    ultimo_erro TEXT,
+    ultimo_resultado JSONB,
+    execucoes INTEGER NOT NULL DEFAULT 0,
+    falhas INTEGER NOT NULL DEFAULT 0,
+    falhas_seguidas INTEGER NOT NULL DEFAULT 0,
+
+    CONSTRAINT chk_tarefas_intervalo CHECK (intervalo_segundos > 0),
+    CONSTRAINT chk_tarefas_status CHECK (ultimo_status IS NULL OR ultimo_status IN ('OK','ERRO'))
+);
+
+-- Conciliação incremental: locações sincronizadas há mais tempo vão primeiro
+ALTER TABLE locacoes ADD COLUMN IF NOT EXISTS boletos_sincronizados_em TIMESTAMP;
+
+-- ====
+-- Importação de motos e clientes por planilha (ver importacao.py)
+-- ====
+CREATE TABLE IF NOT EXISTS importacoes (
+    id SERIAL PRIMARY KEY,
+    tipo VARCHAR(20) NOT NULL,
+    arquivo VARCHAR(255),
+    origem VARCHAR(20) NOT NULL DEFAULT 'web',  -- web ou cli
+    linhas INTEGER NOT NULL DEFAULT 0,
+    inseridos INTEGER NOT NULL DEFAULT 0,
+    atualizados INTEGER NOT NULL DEFAULT 0,
+    inalterados INTEGER NOT NULL DEFAULT 0,
+    erros INTEGER NOT NULL DEFAULT 0,
+    asaas_enfileirados INTEGER NOT NULL DEFAULT 0,
+    duracao_ms INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT chk_importacoes_tipo CHECK (tipo IN ('motos','clientes'))
+);
+
+-- Linhas recusadas, com os valores originais (o relatório pode ser corrigido e reimportado)
+CREATE TABLE IF NOT EXISTS importacao_erros (
+    id BIGSERIAL PRIMARY KEY,
+    importacao_id INTEGER NOT NULL REFERENCES importacoes(id) ON DELETE CASCADE,
+    linha INTEGER NOT NULL,
+    campo VARCHAR(50),
+    mensagem TEXT NOT NULL,
+    dados JSONB
+);
+
+-- Clientes importados à espera do cadastro no Asaas (tarefa clientes_asaas do agendador)
+CREATE TABLE IF NOT EXISTS clientes_asaas_fila (
+    cliente_id INTEGER PRIMARY KEY REFERENCES clientes(id) ON DELETE CASCADE,
+    importacao_id INTEGER REFERENCES importacoes(id) ON DELETE SET NULL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    proxima_tentativa TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ultimo_erro TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- ====
 -- Índices
 -- ====
 CREATE INDEX IF NOT EXISTS idx_clientes_cpf ON clientes(cpf);
 CREATE INDEX IF NOT EXISTS idx_clientes_email ON clientes(email);
 CREATE INDEX IF NOT EXISTS idx_clientes_asaas ON clientes(asaas_id);
+-- Busca de clientes (clientes_busca.py): trigram para "contém", btree para prefixo e ordenação
+CREATE INDEX IF NOT EXISTS idx_clientes_nome_trgm ON clientes USING gin (nome gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clientes_email_trgm ON clientes USING gin ((email::text) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clientes_telefone_trgm ON clientes USING gin (telefone_digitos gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_clientes_cpf_digitos ON clientes(cpf_digitos text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_clientes_nome ON clientes(nome, id);
 
 CREATE INDEX IF NOT EXISTS idx_motos_placa ON motos(placa);
 CREATE INDEX IF NOT EXISTS idx_motos_modelo ON motos(modelo);
+-- Busca por prefixo de placa (LIKE 'ABC%')
+CREATE INDEX IF NOT EXISTS idx_motos_placa_prefixo ON motos(placa varchar_pattern_ops);
 
 CREATE INDEX IF NOT EXISTS idx_locacoes_cliente_id ON locacoes(cliente_id);
 CREATE INDEX IF NOT EXISTS idx_locacoes_moto_id ON locacoes(moto_id);
 CREATE INDEX IF NOT EXISTS idx_locacoes_subscription ON locacoes(asaas_subscription_id);
 CREATE INDEX IF NOT EXISTS idx_locacoes_payment_id ON locacoes(asaas_payment_id);
 CREATE INDEX IF NOT EXISTS idx_locacoes_status ON locacoes(pagamento_status);
+-- Paginação por chave da listagem de locações ativas (ORDER BY id DESC)
+CREATE INDEX IF NOT EXISTS idx_locacoes_ativas_id ON locacoes(id DESC) WHERE cancelado = FALSE;
+-- Uma moto não tem duas locações ativas com períodos sobrepostos. O índice GiST
+-- da restrição também atende as consultas de motos livres por período.
+-- Locações antigas já sobrepostas impediriam a restrição (e derrubariam o schema
+-- inteiro): nesse caso ela fica para depois, com um aviso, e o flask init-db
+-- lista os pares. Cancelando ou ajustando as datas, o próximo init-db a cria.
+-- Quando a restrição é criada, motos.disponivel deixa de refletir locações: as
+-- motos desligadas só por terem locação ativa voltam a ficar liberadas.
+DO $$
+DECLARE
+    sobrepostas INTEGER;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'excl_locacoes_moto_periodo') THEN
+        SELECT count(*) INTO sobrepostas
+          FROM locacoes a
+          JOIN locacoes b ON b.moto_id = a.moto_id AND b.id > a.id
+                         AND b.cancelado = FALSE AND b.periodo && a.periodo
+         WHERE a.cancelado = FALSE;
+        IF sobrepostas > 0 THEN
+            RAISE WARNING 'excl_locacoes_moto_periodo não criada: % par(es) de locações ativas da mesma moto com períodos sobrepostos', sobrepostas;
+        ELSE
+            ALTER TABLE locacoes ADD CONSTRAINT excl_locacoes_moto_periodo
+                EXCLUDE USING gist (moto_id WITH =, periodo WITH &&) WHERE (cancelado = FALSE);
+            UPDATE motos m SET disponivel = TRUE
+             WHERE disponivel = FALSE
+               AND EXISTS (SELECT 1 FROM locacoes l WHERE l.moto_id = m.id AND l.cancelado = FALSE);
+        END IF;
+    END IF;
+END $$;
 
 CREATE INDEX IF NOT EXISTS idx_boletos_locacao_id ON boletos(locacao_id);
 CREATE INDEX IF NOT EXISTS idx_boletos_status ON boletos(status);
 CREATE INDEX IF NOT EXISTS idx_boletos_due_date ON boletos(data_vencimento);
+-- Aging da inadimplência: só os boletos em aberto
+CREATE INDEX IF NOT EXISTS idx_boletos_em_aberto ON boletos(data_vencimento) WHERE status IN ('PENDING','OVERDUE');
 
 CREATE INDEX IF NOT EXISTS idx_servicos_locacao_id ON servicos_locacao(locacao_id);
 
+CREATE INDEX IF NOT EXISTS idx_webhook_eventos_pendentes ON webhook_eventos(chave_ordem, id) WHERE status = 'PENDING';
+CREATE INDEX IF NOT EXISTS idx_financeiro_mensal_mes ON financeiro_mensal(mes);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_eventos_dead ON webhook_eventos(id) WHERE status = 'DEAD';
+-- Reenvios do Asaas param no índice único. Eventos gravados antes da deduplicação
+-- ganham a chave pelo id do evento; os sem id recebem o hash canônico no flask
+-- init-db (webhook_queue.preencher_chaves_legadas). Repetições antigas ficam sem chave.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE relname = 'uq_webhook_eventos_dedup') THEN
+        UPDATE webhook_eventos e SET chave_dedup = k.chave
+        FROM (
+            SELECT id, chave, ROW_NUMBER() OVER (PARTITION BY chave ORDER BY id) AS n
+            FROM (
+                SELECT id, left(payload->>'id', 255) AS chave
+                FROM webhook_eventos
+                WHERE COALESCE(payload->>'id', '') <> ''
+            ) s
+        ) k
+        WHERE k.id = e.id AND k.n = 1 AND e.chave_dedup IS NULL;
+        CREATE UNIQUE INDEX uq_webhook_eventos_dedup ON webhook_eventos(chave_dedup);
+    END IF;
+END $$;
+-- Reprocessamento (flask webhook-replay): janela de recebimento e evento mais recente de cada pagamento
+CREATE INDEX IF NOT EXISTS idx_webhook_eventos_recebimento ON webhook_eventos(created_at);
+CREATE INDEX IF NOT EXISTS idx_webhook_eventos_payment ON webhook_eventos((payload->'payment'->>'id'), id);
+
+CREATE INDEX IF NOT EXISTS idx_asaas_outbox_pendentes ON asaas_outbox(locacao_id, id) WHERE status = 'PENDING';
+CREATE INDEX IF NOT EXISTS idx_asaas_outbox_abertas ON asaas_outbox(locacao_id) WHERE status <> 'DONE';
+
+-- Relatório de erros de uma importação, em ordem de linha
+CREATE INDEX IF NOT EXISTS idx_importacao_erros ON importacao_erros(importacao_id, linha);
+CREATE INDEX IF NOT EXISTS idx_clientes_asaas_fila_proxima ON clientes_asaas_fila(proxima_tentativa);
+CREATE INDEX IF NOT EXISTS idx_clientes_asaas_fila_importacao ON clientes_asaas_fila(importacao_id);
+
+CREATE INDEX IF NOT EXISTS idx_locacoes_sincronizacao ON locacoes(boletos_sincronizados_em NULLS FIRST, id)
+    WHERE cancelado = FALSE AND asaas_subscription_id IS NOT NULL;
+
 -- ====
 -- Triggers de updated_at
 -- ====
@@ -225,4 +493,197 @@ BEGIN
     BEFORE UPDATE ON servicos_locacao
     FOR EACH ROW EXECUTE FUNCTION set_updated_at();
     END IF;
-END$$;
\ No newline at end of file
+END$$;
+
+-- ====
+-- Ledger financeiro: deltas a cada escrita em boletos
+-- ====
+-- Mês em que um boleto conta no ledger
+CREATE OR REPLACE FUNCTION financeiro_mes(status TEXT, vencimento DATE, pagamento DATE, criado TIMESTAMP)
+RETURNS DATE AS $$
+    SELECT date_trunc('month', CASE
+        WHEN status IN ('RECEIVED','CONFIRMED','RECEIVED_IN_CASH') THEN COALESCE(pagamento, vencimento, criado::date)
+        ELSE COALESCE(vencimento, criado::date)
+    END)::date
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Semana (segunda-feira) em que um boleto pago conta em receita_semanal
+CREATE OR REPLACE FUNCTION financeiro_semana(vencimento DATE, pagamento DATE, criado TIMESTAMP)
+RETURNS DATE AS $$
+    SELECT date_trunc('week', COALESCE(pagamento, vencimento, criado::date))::date
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Triggers por statement: um INSERT ... ON CONFLICT de 100 boletos vira um
+-- único UPSERT agregado no ledger. Linhas antigas entram com sinal -1 e novas
+-- com +1, então reenvios sem mudança se anulam e não escrevem nada.
+CREATE OR REPLACE FUNCTION financeiro_aplicar_delta()
+RETURNS TRIGGER AS $$
+DECLARE
+    origem TEXT;
+BEGIN
+    origem := CASE TG_OP
+        WHEN 'INSERT' THEN 'SELECT 1 AS sinal, * FROM novos'
+        WHEN 'DELETE' THEN 'SELECT -1 AS sinal, * FROM antigos'
+        ELSE 'SELECT 1 AS sinal, * FROM novos UNION ALL SELECT -1 AS sinal, * FROM antigos'
+    END;
+
+    EXECUTE format($sql$
+        WITH mov AS (
+            SELECT o.locacao_id,
+                   financeiro_mes(o.status, o.data_vencimento, o.data_pagamento, o.created_at) AS mes,
+                   o.sinal * CASE WHEN o.status IN ('RECEIVED','CONFIRMED','RECEIVED_IN_CASH')
+                                  THEN COALESCE(o.valor_pago, 0) ELSE 0 END AS pago,
+                   o.sinal * CASE WHEN o.status = 'PENDING' THEN COALESCE(o.valor, 0) ELSE 0 END AS pendente,
+                   o.sinal * CASE WHEN o.status = 'OVERDUE' THEN COALESCE(o.valor, 0) ELSE 0 END AS vencido,
+                   o.sinal * (o.status IN ('RECEIVED','CONFIRMED','RECEIVED_IN_CASH'))::int AS n_pagos,
+                   o.sinal * (o.status = 'PENDING')::int AS n_pendentes,
+                   o.sinal * (o.status = 'OVERDUE')::int AS n_vencidos,
+                   CASE WHEN o.status IN ('RECEIVED','CONFIRMED','RECEIVED_IN_CASH')
+                        THEN financeiro_semana(o.data_vencimento, o.data_pagamento, o.created_at) END AS semana
+            FROM (%s) o
+        ), semanal AS (
+            -- Sem filtro de locação: boletos apagados em cascata saem da receita, como no rebuild
+            INSERT INTO receita_semanal AS s (semana, valor_pago, qtd_pagos)
+            SELECT semana, SUM(pago), SUM(n_pagos)
+            FROM mov
+            WHERE semana IS NOT NULL
+            GROUP BY semana
+            HAVING SUM(pago) <> 0 OR SUM(n_pagos) <> 0
+            ON CONFLICT (semana) DO UPDATE
+               SET valor_pago = s.valor_pago + EXCLUDED.valor_pago,
+                   qtd_pagos = s.qtd_pagos + EXCLUDED.qtd_pagos
+        ), delta AS (
+            SELECT locacao_id, mes, SUM(pago) AS pago, SUM(pendente) AS pendente, SUM(vencido) AS vencido,
+                   SUM(n_pagos) AS n_pagos, SUM(n_pendentes) AS n_pendentes, SUM(n_vencidos) AS n_vencidos
+            FROM mov
+            GROUP BY locacao_id, mes
+            HAVING SUM(pago) <> 0 OR SUM(pendente) <> 0 OR SUM(vencido) <> 0
+                OR SUM(n_pagos) <> 0 OR SUM(n_pendentes) <> 0 OR SUM(n_vencidos) <> 0
+        ), ledger AS (
+            INSERT INTO financeiro_mensal AS f (locacao_id, mes, valor_pago, valor_pendente, valor_vencido,
+                                                qtd_pagos, qtd_pendentes, qtd_vencidos)
+            SELECT d.locacao_id, d.mes, d.pago, d.pendente, d.vencido, d.n_pagos, d.n_pendentes, d.n_vencidos
+            FROM delta d
+            WHERE EXISTS (SELECT 1 FROM locacoes l WHERE l.id = d.locacao_id)
+            ON CONFLICT (locacao_id, mes) DO UPDATE
+               SET valor_pago = f.valor_pago + EXCLUDED.valor_pago,
+                   valor_pendente = f.valor_pendente + EXCLUDED.valor_pendente,
+                   valor_vencido = f.valor_vencido + EXCLUDED.valor_vencido,
+                   qtd_pagos = f.qtd_pagos + EXCLUDED.qtd_pagos,
+                   qtd_pendentes = f.qtd_pendentes + EXCLUDED.qtd_pendentes,
+                   qtd_vencidos = f.qtd_vencidos + EXCLUDED.qtd_vencidos
+        )
+        UPDATE locacoes l
+           SET valor_pago = COALESCE(l.valor_pago, 0) + t.pago,
+               valor_pendente = l.valor_pendente + t.pendente,
+               valor_vencido = l.valor_vencido + t.vencido
+          FROM (
+              SELECT locacao_id, SUM(pago) AS pago, SUM(pendente) AS pendente, SUM(vencido) AS vencido
+              FROM delta GROUP BY locacao_id
+          ) t
+         WHERE l.id = t.locacao_id
+           AND (t.pago <> 0 OR t.pendente <> 0 OR t.vencido <> 0)
+    $sql$, origem);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_boletos_financeiro_ins') THEN
+    CREATE TRIGGER trg_boletos_financeiro_ins
+    AFTER INSERT ON boletos REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION financeiro_aplicar_delta();
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_boletos_financeiro_upd') THEN
+    CREATE TRIGGER trg_boletos_financeiro_upd
+    AFTER UPDATE ON boletos REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION financeiro_aplicar_delta();
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_boletos_financeiro_del') THEN
+    CREATE TRIGGER trg_boletos_financeiro_del
+    AFTER DELETE ON boletos REFERENCING OLD TABLE AS antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION financeiro_aplicar_delta();
+    END IF;
+END$$;
+
+-- ====
+-- Relatórios: marca o dia a partir do qual a utilização da frota muda
+-- ====
+-- Último dia em que a locação ocupa a moto (NULL = em andamento). Cancelada
+-- sem data_fim (registros antigos) conta só o dia do início.
+CREATE OR REPLACE FUNCTION locacao_fim(inicio DATE, fim DATE, cancelado BOOLEAN)
+RETURNS DATE AS $$
+    SELECT COALESCE(fim, CASE WHEN cancelado THEN inicio END)
+$$ LANGUAGE sql IMMUTABLE;
+
+-- INSERT/DELETE por statement (importações em lote anotam uma vez só); UPDATE
+-- por linha, só quando muda algo que afeta a ocupação (o ledger atualiza
+-- locacoes a cada boleto e não deve disparar recálculo).
+CREATE OR REPLACE FUNCTION utilizacao_marcar()
+RETURNS TRIGGER AS $$
+DECLARE
+    desde DATE;
+BEGIN
+    IF TG_LEVEL = 'ROW' THEN
+        IF OLD.moto_id IS DISTINCT FROM NEW.moto_id OR OLD.data_inicio IS DISTINCT FROM NEW.data_inicio THEN
+            desde := LEAST(OLD.data_inicio, NEW.data_inicio);
+        ELSE
+            -- Só o fim mudou: a ocupação difere a partir do menor dos dois fins
+            desde := NULLIF(LEAST(
+                COALESCE(locacao_fim(OLD.data_inicio, OLD.data_fim, OLD.cancelado), 'infinity'::date),
+                COALESCE(locacao_fim(NEW.data_inicio, NEW.data_fim, NEW.cancelado), 'infinity'::date)
+            ), 'infinity'::date);
+        END IF;
+    ELSIF TG_OP = 'INSERT' THEN
+        EXECUTE format('SELECT MIN(%s) FROM novos', TG_ARGV[0]) INTO desde;
+    ELSE
+        EXECUTE format('SELECT MIN(%s) FROM antigos', TG_ARGV[0]) INTO desde;
+    END IF;
+
+    IF desde IS NOT NULL THEN
+        UPDATE relatorios_estado
+           SET recalcular_desde = desde
+         WHERE nome = 'utilizacao' AND (recalcular_desde IS NULL OR recalcular_desde > desde);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_locacoes_utilizacao_ins') THEN
+    CREATE TRIGGER trg_locacoes_utilizacao_ins
+    AFTER INSERT ON locacoes REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION utilizacao_marcar('data_inicio');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_locacoes_utilizacao_del') THEN
+    CREATE TRIGGER trg_locacoes_utilizacao_del
+    AFTER DELETE ON locacoes REFERENCING OLD TABLE AS antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION utilizacao_marcar('data_inicio');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_locacoes_utilizacao_upd') THEN
+    CREATE TRIGGER trg_locacoes_utilizacao_upd
+    AFTER UPDATE OF moto_id, data_inicio, data_fim, cancelado ON locacoes
+    FOR EACH ROW
+    WHEN ((OLD.moto_id, OLD.data_inicio, OLD.data_fim, OLD.cancelado)
+          IS DISTINCT FROM (NEW.moto_id, NEW.data_inicio, NEW.data_fim, NEW.cancelado))
+    EXECUTE FUNCTION utilizacao_marcar();
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_motos_utilizacao_ins') THEN
+    CREATE TRIGGER trg_motos_utilizacao_ins
+    AFTER INSERT ON motos REFERENCING NEW TABLE AS novos
+    FOR EACH STATEMENT EXECUTE FUNCTION utilizacao_marcar('created_at::date');
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_motos_utilizacao_del') THEN
+    CREATE TRIGGER trg_motos_utilizacao_del
+    AFTER DELETE ON motos REFERENCING OLD TABLE AS antigos
+    FOR EACH STATEMENT EXECUTE FUNCTION utilizacao_marcar('created_at::date');
+    END IF;
+END$$;
@@ -0,0 +1,174 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import asaas_client
+import boletos
+import dashboard_metrics
+from config import Config
+from database import get_db_connection
+
+# Sincronização de boletos com o Asaas, para uma locação ou para todas as
+# ativas. As páginas de /payments são seguidas até hasMore=false; várias
+# assinaturas são buscadas em paralelo num pool de threads limitado (o limite
+# de requisições por segundo é o do asaas_client), e cada locação é gravada em lote
+# (boletos.salvar_boletos) e commitada assim que chega.
+#
+# O agendador (agendador.py) roda sincronizar_incremental, que pega um lote
+# das locações sincronizadas há mais tempo, e conferir_vencidos, que consulta
+# no Asaas os boletos que passaram do vencimento e continuam PENDING aqui
+# (webhook PAYMENT_OVERDUE perdido).
+
+
+def iter_payments(subscription_id):
+    """Gera todos os payments de uma assinatura, página por página."""
+    return asaas_client.paginate("/payments", {"subscription": subscription_id})
+
+
+def sincronizar(locacoes, max_workers=None):
+    """Sincroniza [(locacao_id, asaas_subscription_id), ...].
+
+    Retorna {locacao_id: boletos.Resultado ou Exception}.
+    """
+    resultados = {}
+    if not locacoes:
+        return resultados
+
+    max_workers = max_workers or Config.ASAAS_SYNC_WORKERS
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sync-boletos") as executor:
+            futures = {
+                executor.submit(lambda sub: list(iter_payments(sub)), sub_id): loc_id
+                for loc_id, sub_id in locacoes
+            }
+            for fut in as_completed(futures):
+                loc_id = futures[fut]
+                try:
+                    payments = fut.result()
+                    resultado = boletos.salvar_boletos(cur, payments, locacao_id=loc_id)
+                    cur.execute("UPDATE locacoes SET boletos_sincronizados_em = CURRENT_TIMESTAMP WHERE id=%s", (loc_id,))
+                    conn.commit()
+                    resultados[loc_id] = resultado
+                except Exception as e:
+                    conn.rollback()
+                    logging.exception("Erro ao sincronizar boletos da locação %s", loc_id)
+                    resultados[loc_id] = e
+    finally:
+        cur.close()
+        conn.close()
+        dashboard_metrics.invalidate()
+    return resultados
+
+
+def sincronizar_locacao(locacao_id):
+    """Sincroniza uma locação. Levanta LookupError se não houver assinatura vinculada."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT asaas_subscription_id FROM locacoes WHERE id=%s", (locacao_id,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+    if not row or not row["asaas_subscription_id"]:
+        raise LookupError("Assinatura Asaas não vinculada à locação.")
+
+    resultado = sincronizar([(locacao_id, row["asaas_subscription_id"])], max_workers=1)[locacao_id]
+    if isinstance(resultado, Exception):
+        raise resultado
+    return resultado
+
+
+def sincronizar_ativas(max_workers=None):
+    """Sincroniza todas as locações ativas com assinatura no Asaas."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, asaas_subscription_id FROM locacoes
+            WHERE cancelado = FALSE AND asaas_subscription_id IS NOT NULL
+            ORDER BY id
+        """)
+        locacoes = [(r["id"], r["asaas_subscription_id"]) for r in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+    return sincronizar(locacoes, max_workers=max_workers)
+
+
+def sincronizar_incremental(limite=None, max_workers=None):
+    """Sincroniza as `limite` locações ativas há mais tempo sem sincronizar (as nunca sincronizadas primeiro)."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, asaas_subscription_id FROM locacoes
+            WHERE cancelado = FALSE AND asaas_subscription_id IS NOT NULL
+            ORDER BY boletos_sincronizados_em NULLS FIRST, id
+            LIMIT %s
+        """, (limite or Config.CONCILIACAO_LOTE,))
+        locacoes = [(r["id"], r["asaas_subscription_id"]) for r in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+    return sincronizar(locacoes, max_workers=max_workers)
+
+
+def _buscar_payment(payment_id):
+    resp = asaas_client.get(f"/payments/{payment_id}")
+    if resp.status_code != 200:
+        raise asaas_client.AsaasError(resp.status_code, resp.text)
+    return resp.json()
+
+
+def conferir_vencidos(carencia_dias=None, limite=None, max_workers=None):
+    """Atualiza pelo Asaas os boletos PENDING vencidos há mais de `carencia_dias`.
+
+    Retorna {"conferidos", "vencidos", "pagos", "erros"}: quantos foram
+    consultados, quantos voltaram OVERDUE, quantos já estavam pagos e quantas
+    consultas falharam.
+    """
+    carencia_dias = Config.VENCIDOS_CARENCIA_DIAS if carencia_dias is None else carencia_dias
+    max_workers = max_workers or Config.ASAAS_SYNC_WORKERS
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT locacao_id, asaas_payment_id FROM boletos
+            WHERE status = 'PENDING' AND asaas_payment_id IS NOT NULL
+              AND data_vencimento < CURRENT_DATE - %s
+            ORDER BY data_vencimento, id
+            LIMIT %s
+        """, (carencia_dias, limite or Config.VENCIDOS_LOTE))
+        pendentes = cur.fetchall()
+        if not pendentes:
+            return {"conferidos": 0, "vencidos": 0, "pagos": 0, "erros": 0}
+
+        por_locacao, erros = {}, 0
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="conferir-vencidos") as executor:
+            futures = {executor.submit(_buscar_payment, b["asaas_payment_id"]): b for b in pendentes}
+            for fut in as_completed(futures):
+                try:
+                    por_locacao.setdefault(futures[fut]["locacao_id"], []).append(fut.result())
+                except Exception:
+                    erros += 1
+                    logging.exception("Erro ao consultar o boleto %s no Asaas", futures[fut]["asaas_payment_id"])
+
+        payments = [p for lista in por_locacao.values() for p in lista]
+        for loc_id, lista in por_locacao.items():
+            boletos.salvar_boletos(cur, lista, locacao_id=loc_id)
+        conn.commit()
+        return {
+            "conferidos": len(pendentes),
+            "vencidos": sum(1 for p in payments if p.get("status") == "OVERDUE"),
+            "pagos": sum(1 for p in payments if p.get("status") in boletos.PAGOS),
+            "erros": erros,
+        }
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+        dashboard_metrics.invalidate()
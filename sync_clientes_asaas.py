@@ -1,16 +1,21 @@
 # sync_clientes_asaas.py
 import os
-import requests
+import re
+import json
 import psycopg2
 import psycopg2.extras
-import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from asaas_client import AsaasClient
+import linhas
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 ASAAS_API_KEY = os.environ.get("ASAAS_API_KEY")
 ASAAS_BASE_URL = os.environ.get("ASAAS_BASE_URL", "https://www.asaas.com/api/v3")
-HEADERS = {"accept": "application/json", "content-type": "application/json", "access_token": ASAAS_API_KEY}
+# Session keep-alive com timeout, retry e o rate limit compartilhado do asaas_client
+asaas = AsaasClient(base_url=ASAAS_BASE_URL, api_key=ASAAS_API_KEY)
 
 def normalize_response_list(resp_json):
     # handles different shapes: list, {"data":[...]}, {"items":[...]}
@@ -24,7 +29,7 @@ def normalize_response_list(resp_json):
 
 def buscar_cliente_asaas_por_cpf(cpf):
     try:
-        r = requests.get(f"{ASAAS_BASE_URL}/customers", headers=HEADERS, params={"cpfCnpj": cpf})
+        r = asaas.get("/customers", params={"cpfCnpj": cpf})
         r.raise_for_status()
         itens = normalize_response_list(r.json())
         if itens:
@@ -35,7 +40,7 @@ def buscar_cliente_asaas_por_cpf(cpf):
 
 def buscar_cliente_asaas_por_email(email):
     try:
-        r = requests.get(f"{ASAAS_BASE_URL}/customers", headers=HEADERS, params={"email": email})
+        r = asaas.get("/customers", params={"email": email})
         r.raise_for_status()
         itens = normalize_response_list(r.json())
         if itens:
@@ -46,12 +51,12 @@ def buscar_cliente_asaas_por_email(email):
 
 def criar_cliente_asaas(nome, email, cpf, telefone):
     payload = {"name": nome, "email": email, "cpfCnpj": cpf, "mobilePhone": telefone}
-    r = requests.post(f"{ASAAS_BASE_URL}/customers", headers=HEADERS, json=payload)
+    r = asaas.post("/customers", json=payload)
     r.raise_for_status()
     return r.json()
 
-def sync_clientes(db_conn, dry_run=True, sleep_between=0.2):
-    cur = db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+def sync_clientes(db_conn, dry_run=True):
+    cur = db_conn.cursor(cursor_factory=linhas.CursorLinhas)
     cur.execute("SELECT id, nome, email, cpf, telefone FROM clientes WHERE asaas_id IS NULL")
     clientes = cur.fetchall()
     logging.info("Encontrados %d clientes sem asaas_id", len(clientes))
@@ -80,19 +85,168 @@ def sync_clientes(db_conn, dry_run=True, sleep_between=0.2):
                     cur.execute("UPDATE clientes SET asaas_id = %s WHERE id = %s", (asaas_id, c["id"]))
                     db_conn.commit()
                     logging.info("Atualizado localmente clientes.id=%s -> asaas_id=%s", c["id"], asaas_id)
-
-            time.sleep(sleep_between)  # respeitar rate limits
         except Exception as e:
             logging.exception("Erro ao processar cliente %s: %s", c["id"], e)
 
     cur.close()
 
+# ====
+# Reconciliação em massa (--bulk)
+# ====
+# Baixa a lista inteira de /customers do Asaas uma vez, indexada por CPF (só
+# dígitos) e email (minúsculo), e casa os clientes locais sem nenhuma chamada
+# HTTP por cliente. Só os que realmente não existem no Asaas são criados, num
+# pool de threads limitado. Os asaas_id são gravados com UPDATE em lote e o
+# último clientes.id processado fica num checkpoint: se o processo cair, a
+# próxima execução continua dali. Ao terminar sem interrupção o checkpoint é apagado.
+# Criações que falham vão para clientes_asaas_fila, no mesmo commit do lote: o
+# checkpoint passa por cima delas e a tarefa clientes_asaas do agendador tenta de
+# novo, com backoff.
+
+def normalizar_cpf(cpf):
+    return re.sub(r"\D", "", cpf or "")
+
+def normalizar_email(email):
+    return (email or "").strip().lower()
+
+def construir_indice():
+    por_cpf, por_email = {}, {}
+    total = 0
+    for c in asaas.paginate("/customers"):
+        if c.get("deleted"):
+            continue
+        total += 1
+        cpf = normalizar_cpf(c.get("cpfCnpj"))
+        email = normalizar_email(c.get("email"))
+        if cpf:
+            por_cpf.setdefault(cpf, c["id"])
+        if email:
+            por_email.setdefault(email, c["id"])
+    logging.info("Índice do Asaas: %d clientes (%d CPFs, %d emails)", total, len(por_cpf), len(por_email))
+    return por_cpf, por_email
+
+def _ler_checkpoint(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("ultimo_id", 0)
+    except (OSError, ValueError):
+        return 0
+
+def _salvar_checkpoint(path, ultimo_id):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"ultimo_id": ultimo_id}, f)
+    os.replace(tmp, path)
+
+def reconciliar_clientes(db_conn, dry_run=True, workers=4, lote=500,
+                         checkpoint_path="sync_clientes.checkpoint.json", reiniciar=False):
+    por_cpf, por_email = construir_indice()
+    ultimo_id = 0 if reiniciar else _ler_checkpoint(checkpoint_path)
+    if ultimo_id:
+        logging.info("Retomando a partir de clientes.id > %s", ultimo_id)
+
+    cur = db_conn.cursor(cursor_factory=linhas.CursorLinhas)
+    # asaas_id já usados por outros clientes (de execuções anteriores ou do app)
+    cur.execute("SELECT asaas_id FROM clientes WHERE asaas_id IS NOT NULL")
+    atribuidos = {r["asaas_id"] for r in cur.fetchall()}
+    totais = {"casados": 0, "criados": 0, "erros": 0}
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sync-clientes") as executor:
+            while True:
+                cur.execute("""
+                    SELECT id, nome, email, cpf, telefone FROM clientes
+                    WHERE asaas_id IS NULL AND id > %s
+                    ORDER BY id LIMIT %s
+                """, (ultimo_id, lote))
+                clientes = cur.fetchall()
+                if not clientes:
+                    break
+
+                pares, faltando, falhas = [], {}, []
+                for c in clientes:
+                    cpf, email = normalizar_cpf(c["cpf"]), normalizar_email(c["email"])
+                    asaas_id = (cpf and por_cpf.get(cpf)) or (email and por_email.get(email))
+                    if asaas_id:
+                        pares.append((c["id"], asaas_id))
+                        totais["casados"] += 1
+                    else:
+                        # Mesmo CPF/email duas vezes no lote: cria uma vez só
+                        faltando.setdefault(cpf or email or f"id:{c['id']}", []).append(c)
+
+                if faltando and dry_run:
+                    logging.info("[dry-run] iria criar %d clientes no Asaas", len(faltando))
+                elif faltando:
+                    futuros = {
+                        chave: executor.submit(criar_cliente_asaas, cs[0]["nome"], cs[0]["email"], cs[0]["cpf"], cs[0]["telefone"])
+                        for chave, cs in faltando.items()
+                    }
+                    for chave, fut in futuros.items():
+                        try:
+                            asaas_id = fut.result().get("id")
+                        except Exception as e:
+                            totais["erros"] += 1
+                            logging.exception("Erro ao criar cliente local id=%s no Asaas: %s", faltando[chave][0]["id"], e)
+                            falhas.extend((c["id"], repr(e)[:2000]) for c in faltando[chave])
+                            continue
+                        totais["criados"] += 1
+                        c = faltando[chave][0]
+                        if normalizar_cpf(c["cpf"]):
+                            por_cpf[normalizar_cpf(c["cpf"])] = asaas_id
+                        if normalizar_email(c["email"]):
+                            por_email[normalizar_email(c["email"])] = asaas_id
+                        pares.extend((c["id"], asaas_id) for c in faltando[chave])
+
+                # asaas_id é UNIQUE: dois clientes locais não podem apontar para o mesmo cadastro
+                unicos = []
+                for cliente_id, asaas_id in pares:
+                    if asaas_id in atribuidos:
+                        logging.warning("clientes.id=%s duplica asaas_id=%s; ignorado", cliente_id, asaas_id)
+                        continue
+                    atribuidos.add(asaas_id)
+                    unicos.append((cliente_id, asaas_id))
+
+                ultimo_id = clientes[-1]["id"]
+                if dry_run:
+                    logging.info("[dry-run] iria atualizar %d clientes (até id=%s)", len(unicos), ultimo_id)
+                    continue
+
+                if unicos:
+                    psycopg2.extras.execute_values(cur, """
+                        UPDATE clientes c SET asaas_id = v.asaas_id
+                        FROM (VALUES %s) AS v(id, asaas_id)
+                        WHERE c.id = v.id AND c.asaas_id IS NULL
+                    """, unicos, page_size=lote)
+                if falhas:
+                    psycopg2.extras.execute_values(cur, """
+                        INSERT INTO clientes_asaas_fila (cliente_id, tentativas, ultimo_erro) VALUES %s
+                        ON CONFLICT (cliente_id) DO NOTHING
+                    """, [(cliente_id, 1, erro) for cliente_id, erro in falhas], page_size=lote)
+                db_conn.commit()
+                _salvar_checkpoint(checkpoint_path, ultimo_id)
+                logging.info("Lote gravado: %d clientes atualizados, %d na fila de novas tentativas (até id=%s)",
+                             len(unicos), len(falhas), ultimo_id)
+    except Exception:
+        db_conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    if not dry_run and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    logging.info("Concluído: %(casados)d casados, %(criados)d criados, %(erros)d erros", totais)
+    return totais
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--dry-run", action="store_true", help="Não aplica updates no banco (default: True)")
     parser.add_argument("--apply", action="store_true", help="Aplica updates no banco")
     parser.add_argument("--db-url", default=os.environ.get("DATABASE_URL"), help="Database URL")
+    parser.add_argument("--bulk", action="store_true", help="Reconciliação em massa com índice local e checkpoint")
+    parser.add_argument("--workers", type=int, default=4, help="(--bulk) criações simultâneas no Asaas")
+    parser.add_argument("--lote", type=int, default=500, help="(--bulk) clientes por lote/commit")
+    parser.add_argument("--checkpoint", default="sync_clientes.checkpoint.json", help="(--bulk) arquivo de checkpoint")
+    parser.add_argument("--reiniciar", action="store_true", help="(--bulk) ignora o checkpoint existente")
     args = parser.parse_args()
 
     if not args.db_url:
@@ -100,6 +254,10 @@ if __name__ == "__main__":
 
     conn = psycopg2.connect(args.db_url)
     try:
-        sync_clientes(conn, dry_run=(not args.apply))
+        if args.bulk:
+            reconciliar_clientes(conn, dry_run=(not args.apply), workers=args.workers, lote=args.lote,
+                                 checkpoint_path=args.checkpoint, reiniciar=args.reiniciar)
+        else:
+            sync_clientes(conn, dry_run=(not args.apply))
     finally:
         conn.close()
\ No newline at end of file
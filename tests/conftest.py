@@ -0,0 +1,43 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def banco():
+    """Conexão (autocommit) com o Postgres do ambiente (DB_*); sem banco, o teste é pulado."""
+    import psycopg2
+    import database
+    try:
+        conn = database.nova_conexao()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Postgres indisponível: {e}")
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def fake_asaas(monkeypatch):
+    """fake_asaas.create_app() servido numa porta local, com o asaas_client apontando para ele.
+
+    Retorna o app Flask do fake: app.config["INTERCEPTAR"] injeta falhas.
+    """
+    from werkzeug.serving import make_server
+    import asaas_client
+    import fake_asaas as fake
+
+    app = fake.create_app(payments_por_assinatura=250)
+    servidor = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    cliente = asaas_client.AsaasClient(
+        base_url=f"http://127.0.0.1:{servidor.server_port}/api/v3", api_key="teste",
+        timeout=(1.0, 0.5), retries=2, backoff=0.01,
+    )
+    monkeypatch.setattr(asaas_client, "_client", cliente)
+    monkeypatch.setattr(asaas_client, "limiter", asaas_client.RateLimiter(1000, 1000))
+    yield app
+    servidor.shutdown()
@@ -0,0 +1,56 @@
+import hashlib
+
+import pytest
+from flask import Flask
+
+import armazenamento
+import entrega
+from config import Config
+
+CONTEUDO = b"%PDF-1.4 teste"
+SHA = hashlib.sha256(CONTEUDO).hexdigest()
+CHAVE = f"{SHA[:2]}/{SHA}.pdf"
+
+
+@pytest.fixture(params=["app", "nginx", "sendfile"])
+def cliente(request, tmp_path, monkeypatch):
+    """App mínimo com a rota de arquivos, armazenamento local em tmp_path e cada modo de entrega."""
+    raiz = tmp_path / "objetos"
+    (raiz / SHA[:2]).mkdir(parents=True)
+    (raiz / SHA[:2] / f"{SHA}.pdf").write_bytes(CONTEUDO)
+    (tmp_path / "contratos").mkdir()
+    (tmp_path / "contratos" / "antigo.pdf").write_bytes(CONTEUDO)
+    (tmp_path / "segredo.txt").write_text("não pode sair")
+
+    monkeypatch.setattr(armazenamento, "_backend", armazenamento.LocalBackend(str(raiz)))
+    monkeypatch.setattr(Config, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(Config, "ARQUIVOS_ENTREGA", request.param)
+
+    app = Flask(__name__)
+
+    @app.route("/arquivos/<path:filename>")
+    def arquivo(filename):
+        return entrega.enviar(filename, pasta_legada="contratos")
+
+    return app.test_client()
+
+
+def test_entrega_chave_e_nome_legado(cliente):
+    resp = cliente.get(f"/arquivos/{CHAVE}")
+    assert resp.status_code == 200
+    assert resp.get_etag()[0] == SHA
+    assert cliente.get("/arquivos/antigo.pdf").status_code == 200
+
+
+@pytest.mark.parametrize("url", [
+    "/arquivos/..%2Fsegredo.txt",
+    "/arquivos/..%2F..%2Fsegredo.txt",
+    f"/arquivos/{SHA[:2]}%2F..%2F..%2Fsegredo.txt",
+    "/arquivos/tmp%2F..%2F..%2Fsegredo.txt",
+    "/arquivos/tmp%2Fqualquer",
+    "/arquivos/..",
+])
+def test_chave_fora_do_armazenamento_da_404(cliente, url):
+    resp = cliente.get(url)
+    assert resp.status_code == 404
+    assert "X-Accel-Redirect" not in resp.headers and "X-Sendfile" not in resp.headers
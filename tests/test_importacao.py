@@ -0,0 +1,122 @@
+import io
+
+import psycopg2.extensions
+import psycopg2.extras
+import pytest
+
+import importacao
+import instrumentacao
+
+
+class CursorEspiao(instrumentacao.CursorInstrumentado):
+    """Anota como as linhas chegaram à tabela temporária: COPY ou INSERTs em lote."""
+
+    cargas = []
+
+    def copy_expert(self, sql, arquivo, *args, **kwargs):
+        CursorEspiao.cargas.append("copy")
+        return super().copy_expert(sql, arquivo, *args, **kwargs)
+
+    def execute(self, sql, params=None):
+        texto = sql.decode() if isinstance(sql, bytes) else sql
+        if texto.lstrip().startswith("INSERT INTO _importacao_"):
+            CursorEspiao.cargas.append("insert")
+        return super().execute(sql, params)
+
+
+@pytest.fixture
+def conn(banco):
+    """Conexão em transação (as tabelas temporárias da importação somem no commit), desfeita no fim."""
+    banco.autocommit = False
+    banco.cursor_factory = CursorEspiao
+    CursorEspiao.cargas = []
+    yield banco
+    banco.rollback()
+
+
+@pytest.fixture
+def cooperativo():
+    """psycopg2 como no gunicorn gevent (psycogreen): com wait callback o COPY não é aceito."""
+    psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
+    yield
+    psycopg2.extensions.set_wait_callback(None)
+
+
+def registros(n):
+    # Vírgula, aspas, quebra de linha e NULL passam pelo CSV do COPY sem mudar
+    for i in range(n):
+        yield (i + 2, f"TST{i:04d}", f'Honda "CG", 160\nlinha {i}', 2020 if i % 2 else None, None)
+
+
+def carregar_e_ler(conn, n):
+    cur = conn.cursor()
+    cur.execute(importacao.TEMPORARIAS["motos"])
+    importacao._carregar(cur, "_importacao_motos", ("placa", "modelo", "ano", "disponivel"), registros(n))
+    cur.execute("SELECT linha, placa, modelo, ano, disponivel FROM _importacao_motos ORDER BY linha")
+    return [tuple(r.values()) for r in cur.fetchall()]
+
+
+# ==== Carga na tabela temporária ====
+def test_carga_por_copy(conn):
+    assert carregar_e_ler(conn, 2500) == list(registros(2500))
+    assert CursorEspiao.cargas == ["copy"]
+
+
+def test_carga_por_insert_em_lote_sem_copy(conn, cooperativo):
+    assert carregar_e_ler(conn, 2500) == list(registros(2500))
+    # LOTE linhas por INSERT
+    assert CursorEspiao.cargas == ["insert"] * 3
+
+
+def test_erro_no_meio_da_carga_e_relancado(conn):
+    def com_erro():
+        yield from registros(10)
+        raise RuntimeError("falha lendo o arquivo")
+
+    cur = conn.cursor()
+    cur.execute(importacao.TEMPORARIAS["motos"])
+    with pytest.raises(RuntimeError, match="falha lendo o arquivo"):
+        importacao._carregar(cur, "_importacao_motos", ("placa", "modelo", "ano", "disponivel"), com_erro())
+
+
+# ==== Erros por linha ====
+PLANILHA = (
+    "Placa;Moto;Ano;Situação\n"
+    "zzz9a99;Honda CG 160;2023;sim\n"
+    "XYZ-1234;;2020;não\n"
+    "12345;Yamaha Factor;1850;talvez\n"
+    "\n"
+    "ZZZ9A99;Honda Biz;2021;sim\n"
+    "ZZZ8B88;Yamaha Fazer;2022;\n"
+)
+
+
+def test_erros_por_linha_com_os_titulos_do_arquivo(conn):
+    resultado = importacao.importar(conn, "motos", io.BytesIO(PLANILHA.encode("utf-8")), simular=True)
+
+    assert (resultado["linhas"], resultado["erros"], resultado["id"]) == (5, 3, None)
+    erros = {e.linha: e for e in resultado["lista_erros"]}
+    assert sorted(erros) == [3, 4, 6]  # linha 5 em branco não conta, mas a numeração segue o arquivo
+    assert erros[3].campo == "modelo" and erros[3].mensagem == "obrigatório"
+    assert erros[4].campo == "placa, ano, disponivel"
+    assert "placa inválida: 12345" in erros[4].mensagem and "ano fora do intervalo: 1850" in erros[4].mensagem
+    assert erros[6].campo == "placa" and erros[6].mensagem == "repetido no arquivo (linha 2)"
+    assert erros[4].dados == {"Placa": "12345", "Moto": "Yamaha Factor", "Ano": "1850", "Situação": "talvez"}
+
+    saida = io.StringIO()
+    importacao.relatorio_csv(resultado["lista_erros"], saida)
+    linhas = saida.getvalue().lstrip("\ufeff").splitlines()
+    assert linhas[0] == "linha;campo;erro;Placa;Moto;Ano;Situação"
+    assert linhas[1] == "3;modelo;obrigatório;XYZ-1234;;2020;não"
+
+
+def test_erros_no_fallback_cooperativo(conn, cooperativo):
+    resultado = importacao.importar(conn, "motos", io.BytesIO(PLANILHA.encode("utf-8")), simular=True)
+    assert resultado["erros"] == 3
+    assert resultado["inseridos"] + resultado["atualizados"] + resultado["inalterados"] == 2
+    assert CursorEspiao.cargas == ["insert"]
+
+
+def test_coluna_obrigatoria_ausente_recusa_o_arquivo(conn):
+    with pytest.raises(importacao.ImportacaoInvalida, match="modelo"):
+        importacao.importar(conn, "motos", io.BytesIO(b"placa;ano\nABC1D23;2020\n"), simular=True)
@@ -0,0 +1,34 @@
+import logging
+
+from psycopg2.extras import Json, execute_values
+
+import instrumentacao
+from config import Config
+
+
+def test_sql_lenta_de_execute_values_nao_vaza_valores(banco, monkeypatch, caplog):
+    monkeypatch.setattr(Config, "SLOW_QUERY_MS", 0)
+    cur = banco.cursor()
+    assert isinstance(cur, instrumentacao.CursorInstrumentado)
+    cur.execute("CREATE TEMP TABLE _t_lenta (cpf TEXT, email TEXT, valor NUMERIC, dados JSONB, n INTEGER)")
+
+    with caplog.at_level(logging.WARNING, logger="motorental.sql"):
+        execute_values(cur, "INSERT INTO _t_lenta (cpf, email, valor, dados, n) VALUES %s", [
+            ("529.982.247-25", "maria@example.com", 1234.56, Json({"CPF": "52998224725", "nome": "O'Brien"}), 7),
+            ("111.444.777-35", "joao@example.com", 99, None, 8),
+        ])
+
+    log = caplog.text
+    assert "SQL lenta" in log and "INSERT INTO _t_lenta" in log
+    for valor in ("529.982.247-25", "52998224725", "maria@example.com", "1234.56", "Brien", "111.444.777-35"):
+        assert valor not in log
+    assert "VALUES ('?','?',?,'?',?),('?','?',?,NULL,?)" in log
+
+
+def test_sql_lenta_com_parametros_mostra_so_os_tipos(banco, monkeypatch, caplog):
+    monkeypatch.setattr(Config, "SLOW_QUERY_MS", 0)
+    cur = banco.cursor()
+    with caplog.at_level(logging.WARNING, logger="motorental.sql"):
+        cur.execute("SELECT %s::text AS cpf, %s::int AS n, 10 AS dez", ("529.982.247-25", 3))
+    assert "529.982.247-25" not in caplog.text
+    assert "SELECT %s::text AS cpf, %s::int AS n, 10 AS dez params=['<str>', '<int>']" in caplog.text
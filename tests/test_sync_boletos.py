@@ -0,0 +1,151 @@
+import time
+import uuid
+
+import pytest
+
+import asaas_client
+import sync_boletos
+
+
+@pytest.fixture
+def locacoes(banco):
+    """Fábrica de locações de teste (cliente, moto e assinatura próprios); apaga tudo no fim."""
+    cur = banco.cursor()
+    clientes = []
+
+    def criar(n=1):
+        marca = uuid.uuid4().hex[:8]
+        cur.execute(
+            "INSERT INTO clientes (nome, email, telefone) VALUES (%s, %s, %s) RETURNING id",
+            (f"Teste sync {marca}", f"sync_{marca}@teste.local", "11999999999"),
+        )
+        cliente_id = cur.fetchone()[0]
+        clientes.append(cliente_id)
+        criadas = []
+        for i in range(n):
+            cur.execute(
+                "INSERT INTO motos (placa, modelo) VALUES (%s, %s) RETURNING id",
+                (f"T{marca[:5]}{i}".upper(), "Teste"),
+            )
+            moto_id = cur.fetchone()[0]
+            sub_id = f"sub_{marca}{i}"
+            cur.execute("""
+                INSERT INTO locacoes (cliente_id, moto_id, data_inicio, frequencia_pagamento, asaas_subscription_id)
+                VALUES (%s, %s, CURRENT_DATE, 'WEEKLY', %s) RETURNING id
+            """, (cliente_id, moto_id, sub_id))
+            criadas.append((cur.fetchone()[0], sub_id))
+        return criadas
+
+    yield criar
+    # locações e boletos vão em cascata com o cliente
+    cur.execute("SELECT moto_id FROM locacoes WHERE cliente_id = ANY(%s)", (clientes,))
+    motos = [r[0] for r in cur.fetchall()]
+    cur.execute("DELETE FROM clientes WHERE id = ANY(%s)", (clientes,))
+    cur.execute("DELETE FROM motos WHERE id = ANY(%s)", (motos,))
+    cur.close()
+
+
+def boletos_da(banco, locacao_id):
+    cur = banco.cursor()
+    cur.execute("SELECT count(*) FROM boletos WHERE locacao_id = %s", (locacao_id,))
+    total = cur.fetchone()[0]
+    cur.execute("SELECT boletos_sincronizados_em FROM locacoes WHERE id = %s", (locacao_id,))
+    sincronizado = cur.fetchone()[0]
+    cur.close()
+    return total, sincronizado
+
+
+class Interceptador:
+    """Conta as chamadas a /payments e devolve 503 (ou dorme) nas que `falhar` escolher."""
+
+    def __init__(self, falhar=None, dormir=0.0):
+        self.falhar = falhar or (lambda args: False)
+        self.dormir = dormir
+        self.chamadas = []
+
+    def __call__(self, request):
+        if request.path != "/api/v3/payments":
+            return None
+        args = request.args.to_dict()
+        self.chamadas.append(args)
+        if self.falhar(args):
+            if self.dormir:
+                time.sleep(self.dormir)
+                return None
+            return "indisponível", 503
+        return None
+
+
+# ==== Paginação ====
+def test_paginate_segue_hasmore_ate_o_fim(fake_asaas):
+    espiao = Interceptador()
+    fake_asaas.config["INTERCEPTAR"] = espiao
+    payments = list(sync_boletos.iter_payments("sub_paginas"))
+    assert len(payments) == 250
+    assert len({p["id"] for p in payments}) == 250
+    assert [int(c["offset"]) for c in espiao.chamadas] == [0, 100, 200]
+
+
+def test_sincronizar_locacao_grava_historico_alem_da_primeira_pagina(fake_asaas, banco, locacoes):
+    [(loc_id, _)] = locacoes()
+    resultado = sync_boletos.sincronizar_locacao(loc_id)
+    assert resultado.inseridos == 250
+    total, sincronizado = boletos_da(banco, loc_id)
+    assert total == 250 and sincronizado is not None
+
+    # Segunda passada não duplica nada
+    resultado = sync_boletos.sincronizar_locacao(loc_id)
+    assert resultado.inseridos == 0
+    assert boletos_da(banco, loc_id)[0] == 250
+
+
+# ==== Falhas no meio da sincronização ====
+def test_falha_numa_assinatura_nao_derruba_as_outras(fake_asaas, banco, locacoes):
+    criadas = locacoes(4)
+    loc_falha, sub_falha = criadas[1]
+    fake_asaas.config["INTERCEPTAR"] = Interceptador(lambda a: a.get("subscription") == sub_falha)
+
+    resultados = sync_boletos.sincronizar(criadas, max_workers=4)
+
+    assert isinstance(resultados[loc_falha], asaas_client.AsaasError)
+    assert boletos_da(banco, loc_falha) == (0, None)
+    for loc_id, _ in criadas:
+        if loc_id != loc_falha:
+            # Commitado por locação: visível de outra conexão
+            assert resultados[loc_id].inseridos == 250
+            total, sincronizado = boletos_da(banco, loc_id)
+            assert total == 250 and sincronizado is not None
+
+
+def test_5xx_numa_pagina_do_meio_nao_grava_pela_metade(fake_asaas, banco, locacoes):
+    [(loc_id, _)] = locacoes()
+    espiao = Interceptador(lambda a: a.get("offset") == "100")
+    fake_asaas.config["INTERCEPTAR"] = espiao
+
+    with pytest.raises(asaas_client.AsaasError) as exc:
+        sync_boletos.sincronizar_locacao(loc_id)
+    assert exc.value.status_code == 503
+    # A página que falhou foi tentada de novo (retries=2) antes de desistir
+    assert [c["offset"] for c in espiao.chamadas] == ["0", "100", "100", "100"]
+    assert boletos_da(banco, loc_id) == (0, None)
+
+
+def test_5xx_passageiro_e_recuperado_pelo_retry(fake_asaas, banco, locacoes):
+    [(loc_id, _)] = locacoes()
+    falhas = iter([True])
+    fake_asaas.config["INTERCEPTAR"] = Interceptador(lambda a: a.get("offset") == "100" and next(falhas, False))
+
+    assert sync_boletos.sincronizar_locacao(loc_id).inseridos == 250
+    assert boletos_da(banco, loc_id)[0] == 250
+
+
+def test_timeout_numa_pagina_do_meio_nao_grava_pela_metade(fake_asaas, banco, locacoes):
+    import requests
+
+    [(loc_id, _)] = locacoes()
+    # Leitura do cliente de teste expira em 0,5s
+    fake_asaas.config["INTERCEPTAR"] = Interceptador(lambda a: a.get("offset") == "200", dormir=1.0)
+
+    with pytest.raises(requests.Timeout):
+        sync_boletos.sincronizar_locacao(loc_id)
+    assert boletos_da(banco, loc_id) == (0, None)
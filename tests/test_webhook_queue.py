@@ -0,0 +1,176 @@
+import pytest
+
+import webhook_queue
+from config import Config
+
+
+def evento(evt_id, payment_id, subscription=None, tipo="PAYMENT_RECEIVED"):
+    payment = {"id": payment_id, "status": "RECEIVED"}
+    if subscription:
+        payment["subscription"] = subscription
+    return {"id": evt_id, "event": tipo, "payment": payment}
+
+
+def vencer_backoff(store):
+    """Simula a passagem do tempo: todo evento em backoff fica elegível."""
+    for e in store.eventos.values():
+        e["proxima"] = 0.0
+
+
+class Handler:
+    """Aplica eventos guardando a ordem; pagamentos em `falhar` levantam erro."""
+
+    def __init__(self, falhar=()):
+        self.falhar = set(falhar)
+        self.aplicados = []
+
+    def __call__(self, cur, payload):
+        pid = payload["payment"]["id"]
+        if pid in self.falhar:
+            raise RuntimeError(f"falha simulada em {pid}")
+        self.aplicados.append(payload["id"])
+
+
+@pytest.fixture
+def store():
+    return webhook_queue.MemoryStore()
+
+
+def test_enfileirar_e_processar(store):
+    assert store.enfileirar(evento("evt_1", "pay_1")) == 1
+    assert store.enfileirar(evento("evt_2", "pay_2")) == 2
+    handler = Handler()
+    assert webhook_queue.processar_lote(store, handler) == 2
+    assert handler.aplicados == ["evt_1", "evt_2"]
+    assert store.por_status("DONE") == [1, 2]
+    assert webhook_queue.processar_lote(store, handler) == 0
+
+
+def test_deduplicacao_por_id_e_por_conteudo(store):
+    assert store.enfileirar(evento("evt_1", "pay_1")) is not None
+    assert store.enfileirar(evento("evt_1", "pay_1")) is None
+
+    # Sem id do evento, vale o hash do JSON canônico (a ordem das chaves não importa)
+    sem_id = {"event": "PAYMENT_CREATED", "payment": {"id": "pay_9", "value": 10}}
+    mesma_coisa = {"payment": {"value": 10, "id": "pay_9"}, "event": "PAYMENT_CREATED"}
+    assert store.enfileirar(sem_id) is not None
+    assert store.enfileirar(mesma_coisa) is None
+    assert len(store.eventos) == 2
+
+
+def test_falha_volta_com_backoff_ate_dead(store, monkeypatch):
+    monkeypatch.setattr(Config, "WEBHOOK_MAX_TENTATIVAS", 3)
+    monkeypatch.setattr(Config, "WEBHOOK_BACKOFF_BASE", 10)
+    ev_id = store.enfileirar(evento("evt_1", "pay_1"))
+    handler = Handler(falhar={"pay_1"})
+
+    assert webhook_queue.processar_lote(store, handler) == 1
+    e = store.eventos[ev_id]
+    assert (e["status"], e["tentativas"]) == ("PENDING", 1)
+    assert "falha simulada" in e["erro"]
+    # Em backoff: não é elegível até o prazo vencer
+    assert webhook_queue.processar_lote(store, handler) == 0
+
+    vencer_backoff(store)
+    webhook_queue.processar_lote(store, handler)
+    assert (e["status"], e["tentativas"]) == ("PENDING", 2)
+
+    vencer_backoff(store)
+    webhook_queue.processar_lote(store, handler)
+    assert (e["status"], e["tentativas"]) == ("DEAD", 3)
+    vencer_backoff(store)
+    assert webhook_queue.processar_lote(store, handler) == 0
+
+
+def test_backoff_exponencial_com_teto(monkeypatch):
+    monkeypatch.setattr(Config, "WEBHOOK_BACKOFF_BASE", 10)
+    assert [webhook_queue.backoff(t) for t in (1, 2, 3, 4)] == [10, 20, 40, 80]
+    assert webhook_queue.backoff(30) == 3600
+
+
+def test_ordem_por_assinatura(store):
+    store.enfileirar(evento("evt_1", "pay_1", "sub_A", "PAYMENT_CREATED"))
+    store.enfileirar(evento("evt_2", "pay_1", "sub_A", "PAYMENT_RECEIVED"))
+    store.enfileirar(evento("evt_3", "pay_2", "sub_B"))
+
+    # Um lote só pega a cabeça de cada assinatura
+    handler = Handler()
+    assert webhook_queue.processar_lote(store, handler) == 2
+    assert handler.aplicados == ["evt_1", "evt_3"]
+    webhook_queue.processar_lote(store, handler)
+    assert handler.aplicados == ["evt_1", "evt_3", "evt_2"]
+
+
+def test_evento_em_backoff_segura_os_seguintes_da_mesma_assinatura(store):
+    store.enfileirar(evento("evt_1", "pay_1", "sub_A"))
+    store.enfileirar(evento("evt_2", "pay_2", "sub_A"))
+    store.enfileirar(evento("evt_3", "pay_3", "sub_B"))
+    handler = Handler(falhar={"pay_1"})
+
+    webhook_queue.processar_lote(store, handler)
+    webhook_queue.processar_lote(store, handler)
+    assert handler.aplicados == ["evt_3"]  # evt_2 espera evt_1
+
+    handler.falhar.clear()
+    vencer_backoff(store)
+    webhook_queue.processar_lote(store, handler)
+    webhook_queue.processar_lote(store, handler)
+    assert handler.aplicados == ["evt_3", "evt_1", "evt_2"]
+
+
+def test_reprocessar_ignora_eventos_superados(store):
+    store.enfileirar(evento("evt_1", "pay_1", "sub_A", "PAYMENT_CREATED"))
+    store.enfileirar(evento("evt_2", "pay_1", "sub_A", "PAYMENT_RECEIVED"))
+    webhook_queue.processar_lote(store, Handler())
+    webhook_queue.processar_lote(store, Handler())
+
+    assert store.reprocessar(simular=True) == {"reprocessados": 1, "superados": 1}
+    assert store.reprocessar() == {"reprocessados": 1, "superados": 1}
+    assert store.por_status("PENDING") == [2]
+
+
+def test_evento_ignorado_conclui_sem_retry(store):
+    def handler(cur, payload):
+        raise webhook_queue.EventoIgnorado("assinatura sub_X não pertence a nenhuma locação")
+
+    ev_id = store.enfileirar(evento("evt_1", "pay_1", "sub_X"))
+    assert webhook_queue.processar_lote(store, handler) == 1
+    e = store.eventos[ev_id]
+    assert (e["status"], e["tentativas"], e["erro"]) == ("DONE", 0, None)
+    assert "sub_X" in e["ignorado"]
+    assert store.por_status("DEAD") == []
+
+
+def test_chaves_legadas_usam_o_mesmo_hash_do_enfileiramento(banco):
+    from psycopg2.extras import Json
+
+    # Evento sem id, gravado antes da deduplicação (chave_dedup NULL), repetido
+    payload = {"event": "PAYMENT_RECEIVED", "payment": {"id": "pay_legado", "value": 99.9, "description": "Locação"}}
+    chave = webhook_queue.chave_dedup(payload)
+    cur = banco.cursor()
+    cur.execute("DELETE FROM webhook_eventos WHERE chave_dedup = %s", (chave,))
+    ids = []
+    for _ in range(2):
+        cur.execute("""
+            INSERT INTO webhook_eventos (payload, chave_ordem, status) VALUES (%s, 'pay_legado', 'DONE') RETURNING id
+        """, (Json(payload),))
+        ids.append(cur.fetchone()["id"])
+    try:
+        assert webhook_queue.preencher_chaves_legadas(cur) >= 1
+        cur.execute("SELECT chave_dedup FROM webhook_eventos WHERE id = ANY(%s) ORDER BY id", (ids,))
+        assert [r["chave_dedup"] for r in cur.fetchall()] == [chave, None]
+    finally:
+        cur.execute("DELETE FROM webhook_eventos WHERE id = ANY(%s)", (ids,))
+
+
+def test_dashboard_invalidado_depois_do_lote(store, monkeypatch):
+    import dashboard_metrics
+
+    # O lote da MemoryStore segura o lock até o fim (o "commit"); a invalidação vem depois
+    chamadas = []
+    monkeypatch.setattr(dashboard_metrics, "invalidate", lambda: chamadas.append(not store._lock.locked()))
+    store.enfileirar(evento("evt_1", "pay_1"))
+    webhook_queue.processar_lote(store, Handler())
+    assert chamadas == [True]
+    webhook_queue.processar_lote(store, Handler())
+    assert chamadas == [True]  # lote vazio não invalida
@@ -0,0 +1,48 @@
+import uuid
+
+import pytest
+
+import webhook_queue
+from routes.webhook_routes import _upsert_boleto
+
+
+@pytest.fixture
+def cur(banco):
+    """Cursor numa transação desfeita no fim do teste."""
+    banco.autocommit = False
+    cur = banco.cursor()
+    yield cur
+    banco.rollback()
+
+
+def criar_pendente(cur, customer):
+    """Locação ainda sem assinatura, com a criação pendente no outbox."""
+    marca = uuid.uuid4().hex[:8]
+    cur.execute("INSERT INTO clientes (nome, email, telefone, asaas_id) VALUES (%s, %s, '11999999999', %s) RETURNING id",
+                (f"Teste {marca}", f"wh_{marca}@teste.local", customer))
+    cliente_id = cur.fetchone()["id"]
+    cur.execute("INSERT INTO motos (placa, modelo) VALUES (%s, 'Teste') RETURNING id", (f"W{marca[:6]}".upper(),))
+    cur.execute("""
+        INSERT INTO locacoes (cliente_id, moto_id, data_inicio, frequencia_pagamento)
+        VALUES (%s, %s, CURRENT_DATE, 'WEEKLY') RETURNING id
+    """, (cliente_id, cur.fetchone()["id"]))
+    cur.execute("INSERT INTO asaas_outbox (locacao_id, operacao) VALUES (%s, 'CRIAR')", (cur.fetchone()["id"],))
+
+
+def pagamento(customer):
+    sufixo = uuid.uuid4().hex[:8]
+    return {"id": f"pay_{sufixo}", "subscription": f"sub_{sufixo}", "customer": customer,
+            "status": "PENDING", "value": 100.0, "dueDate": "2025-01-10"}
+
+
+def test_criacao_pendente_do_mesmo_cliente_tenta_de_novo(cur):
+    customer = f"cus_{uuid.uuid4().hex[:8]}"
+    criar_pendente(cur, customer)
+    with pytest.raises(LookupError):
+        _upsert_boleto(cur, pagamento(customer))
+
+
+def test_criacao_pendente_de_outro_cliente_nao_segura_o_evento(cur):
+    criar_pendente(cur, f"cus_{uuid.uuid4().hex[:8]}")
+    with pytest.raises(webhook_queue.EventoIgnorado, match="não pertence a nenhuma locação"):
+        _upsert_boleto(cur, pagamento(f"cus_{uuid.uuid4().hex[:8]}"))
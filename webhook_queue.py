@@ -0,0 +1,386 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2.extras import Json
+
+import consumidor
+import dashboard_metrics
+import metrics
+from config import Config
+from database import get_db_connection
+
+# Fila de eventos do webhook Asaas.
+#
+# O endpoint só grava o payload bruto em webhook_eventos e responde 200; um
+# consumidor em background processa os eventos em lotes. A ordem é garantida
+# por assinatura (chave_ordem): só o evento pendente mais antigo de cada
+# assinatura é elegível, então um evento em backoff segura os seguintes.
+# Falhas são reprocessadas com backoff exponencial e, depois de
+# WEBHOOK_MAX_TENTATIVAS, ficam com status DEAD (dead-letter) para análise.
+# Eventos que nunca teriam sucesso (pagamento que não é de nenhuma locação) o
+# handler recusa com EventoIgnorado: ficam DONE, com o motivo em `ignorado`,
+# sem tentativas nem dead-letter.
+#
+# Cada evento tem uma chave de deduplicação (id do evento no Asaas, ou hash do
+# payload quando não vem id) com índice único: reenvios do Asaas param no
+# INSERT ... ON CONFLICT DO NOTHING, sem fila nem trabalho em boletos. Eventos
+# DONE/DEAD ficam guardados e `flask webhook-replay` os devolve à fila.
+
+ENFILEIRADOS = metrics.counter("webhook_eventos_enfileirados_total", "Eventos do webhook gravados na fila")
+PROCESSADOS = metrics.counter(
+    "webhook_eventos_processados_total", "Eventos do webhook consumidos, por resultado", ("resultado",)
+)
+DUPLICADOS = metrics.counter("webhook_eventos_duplicados_total", "Reenvios do webhook descartados pela deduplicação")
+REPROCESSADOS = metrics.counter("webhook_eventos_reprocessados_total", "Eventos devolvidos à fila por webhook-replay")
+DURACAO_LOTE = metrics.histogram("webhook_lote_segundos", "Duração de cada lote do consumidor do webhook")
+
+
+class EventoIgnorado(Exception):
+    """O evento não se aplica a este sistema: é concluído sem efeito, não vai para retry/DEAD."""
+
+
+def chave_ordem(data):
+    payment = (data or {}).get("payment") or {}
+    return payment.get("subscription") or payment.get("id") or ""
+
+
+def chave_dedup(data):
+    """Id do evento no Asaas ("evt_..."); sem id, o hash do JSON canônico (mesmo conteúdo, mesma chave)."""
+    evento_id = (data or {}).get("id")
+    if evento_id:
+        return str(evento_id)[:255]
+    canonico = json.dumps(data or {}, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return "sha256:" + hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+def preencher_chaves_legadas(cur):
+    """chave_dedup dos eventos antigos sem id do Asaas, com o mesmo hash de chave_dedup.
+
+    O schema.sql preenche só os que têm id: o JSON canônico do json.dumps não
+    tem equivalente em SQL. Conteúdo repetido fica com a chave no evento mais
+    antigo e NULL nos demais. Retorna quantos eventos foram preenchidos.
+    """
+    cur.execute("""
+        SELECT id, payload FROM webhook_eventos
+        WHERE chave_dedup IS NULL AND COALESCE(payload->>'id', '') = ''
+        ORDER BY id
+    """)
+    preenchidos = 0
+    for ev in cur.fetchall():
+        cur.execute("""
+            UPDATE webhook_eventos SET chave_dedup = %(chave)s
+            WHERE id = %(id)s AND NOT EXISTS (SELECT 1 FROM webhook_eventos WHERE chave_dedup = %(chave)s)
+        """, {"id": ev["id"], "chave": chave_dedup(ev["payload"])})
+        preenchidos += cur.rowcount
+    return preenchidos
+
+
+def _payment_id(data):
+    return ((data or {}).get("payment") or {}).get("id")
+
+
+def backoff(tentativas):
+    return consumidor.backoff(tentativas, Config.WEBHOOK_BACKOFF_BASE)
+
+
+class Evento:
+    __slots__ = ("id", "payload", "tentativas")
+
+    def __init__(self, id, payload, tentativas=0):
+        self.id = id
+        self.payload = payload
+        self.tentativas = tentativas
+
+
+# ====
+# Armazenamento: PostgreSQL (produção) e memória (testes/desenvolvimento)
+# ====
+class PostgresStore:
+    def enfileirar(self, data):
+        """Grava o evento e retorna seu id, ou None se a mesma chave já foi recebida."""
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                INSERT INTO webhook_eventos (evento, chave_ordem, chave_dedup, payload)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (chave_dedup) DO NOTHING
+                RETURNING id
+            """, (data.get("event"), chave_ordem(data), chave_dedup(data), Json(data)))
+            row = cur.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+        if row is None:
+            DUPLICADOS.inc()
+            return None
+        ENFILEIRADOS.inc()
+        return row["id"]
+
+    def reprocessar(self, de=None, ate=None, falhos=False, evento=None, simular=False):
+        """Devolve à fila eventos DONE/DEAD recebidos em [de, ate) (ou só os DEAD, com falhos).
+
+        Um evento cujo pagamento já tem evento mais novo aplicado (ou na fila) é
+        "superado" e fica de fora: reaplicá-lo voltaria o boleto a um estado antigo.
+        Retorna {"reprocessados", "superados"}; com simular, nada muda.
+        """
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                WITH alvo AS (
+                    SELECT e.id, EXISTS (
+                               SELECT 1 FROM webhook_eventos p
+                               WHERE p.payload->'payment'->>'id' = e.payload->'payment'->>'id'
+                                 AND p.id > e.id AND p.status <> 'DEAD'
+                           ) AS superado
+                    FROM webhook_eventos e
+                    WHERE e.status = ANY(%(status)s)
+                      AND (%(de)s::timestamp IS NULL OR e.created_at >= %(de)s)
+                      AND (%(ate)s::timestamp IS NULL OR e.created_at < %(ate)s)
+                      AND (%(evento)s::text IS NULL OR e.evento = %(evento)s)
+                ),
+                marcados AS (
+                    UPDATE webhook_eventos w
+                       SET status = 'PENDING', tentativas = 0, proxima_tentativa = CURRENT_TIMESTAMP,
+                           ultimo_erro = NULL, processado_em = NULL, ignorado = NULL,
+                           reprocessamentos = w.reprocessamentos + 1
+                      FROM alvo
+                     WHERE alvo.id = w.id AND NOT alvo.superado AND NOT %(simular)s
+                    RETURNING w.id
+                )
+                SELECT COUNT(*) FILTER (WHERE NOT superado) AS reprocessados,
+                       COUNT(*) FILTER (WHERE superado) AS superados,
+                       (SELECT COUNT(*) FROM marcados) AS marcados
+                FROM alvo
+            """, {
+                "status": ["DEAD"] if falhos else ["DONE", "DEAD"],
+                "de": de, "ate": ate, "evento": evento, "simular": simular,
+            })
+            row = cur.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+        REPROCESSADOS.inc(row["marcados"])
+        return {"reprocessados": row["reprocessados"], "superados": row["superados"]}
+
+    @contextmanager
+    def lote(self, limite):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            # Cabeça de fila de cada assinatura; SKIP LOCKED deixa vários consumidores em paralelo
+            cur.execute("""
+                SELECT e.id, e.payload, e.tentativas
+                FROM webhook_eventos e
+                WHERE e.status = 'PENDING'
+                  AND e.proxima_tentativa <= CURRENT_TIMESTAMP
+                  AND NOT EXISTS (
+                      SELECT 1 FROM webhook_eventos a
+                      WHERE a.chave_ordem = e.chave_ordem
+                        AND a.status = 'PENDING'
+                        AND a.id < e.id
+                  )
+                ORDER BY e.id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (limite,))
+            lote = _LotePostgres(conn, cur, [Evento(r["id"], r["payload"], r["tentativas"]) for r in cur.fetchall()])
+            yield lote
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+
+
+class _LotePostgres:
+    def __init__(self, conn, cur, eventos):
+        self.conn = conn
+        self.cur = cur
+        self.eventos = eventos
+
+    @contextmanager
+    def savepoint(self):
+        self.cur.execute("SAVEPOINT webhook_evento")
+        try:
+            yield
+        except Exception:
+            self.cur.execute("ROLLBACK TO SAVEPOINT webhook_evento")
+            raise
+        self.cur.execute("RELEASE SAVEPOINT webhook_evento")
+
+    def concluir(self, ev, ignorado=None):
+        self.cur.execute("""
+            UPDATE webhook_eventos
+               SET status='DONE', processado_em=CURRENT_TIMESTAMP, ultimo_erro=NULL, ignorado=%s
+             WHERE id=%s
+        """, (ignorado, ev.id))
+
+    def falhar(self, ev, erro):
+        tentativas = ev.tentativas + 1
+        status = "DEAD" if tentativas >= Config.WEBHOOK_MAX_TENTATIVAS else "PENDING"
+        self.cur.execute("""
+            UPDATE webhook_eventos
+               SET status=%s, tentativas=%s, ultimo_erro=%s,
+                   proxima_tentativa = CURRENT_TIMESTAMP + make_interval(secs => %s)
+             WHERE id=%s
+        """, (status, tentativas, repr(erro)[:2000], backoff(tentativas), ev.id))
+        return status
+
+
+class MemoryStore:
+    """Substituto local da fila, sem banco: mesma interface do PostgresStore."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._chaves = set()
+        self.eventos = {}  # id -> dict(payload, chave, status, tentativas, proxima, erro, ignorado, recebido)
+
+    def enfileirar(self, data):
+        chave = chave_dedup(data)
+        with self._lock:
+            if chave in self._chaves:
+                DUPLICADOS.inc()
+                return None
+            self._chaves.add(chave)
+            self._seq += 1
+            self.eventos[self._seq] = {
+                "payload": data, "chave": chave_ordem(data), "status": "PENDING",
+                "tentativas": 0, "proxima": 0.0, "erro": None, "ignorado": None, "recebido": time.time(),
+            }
+        ENFILEIRADOS.inc()
+        return self._seq
+
+    def reprocessar(self, de=None, ate=None, falhos=False, evento=None, simular=False):
+        """Mesma regra do PostgresStore; de/ate em Unix time."""
+        status = ("DEAD",) if falhos else ("DONE", "DEAD")
+        reprocessados = superados = 0
+        with self._lock:
+            itens = sorted(self.eventos.items())
+            for i, e in itens:
+                if (e["status"] not in status or (de is not None and e["recebido"] < de)
+                        or (ate is not None and e["recebido"] >= ate)
+                        or (evento is not None and e["payload"].get("event") != evento)):
+                    continue
+                pid = _payment_id(e["payload"])
+                if pid and any(j > i and o["status"] != "DEAD" and _payment_id(o["payload"]) == pid for j, o in itens):
+                    superados += 1
+                    continue
+                reprocessados += 1
+                if not simular:
+                    e.update(status="PENDING", tentativas=0, proxima=0.0, erro=None, ignorado=None)
+        if not simular:
+            REPROCESSADOS.inc(reprocessados)
+        return {"reprocessados": reprocessados, "superados": superados}
+
+    def por_status(self, status):
+        return [i for i, e in sorted(self.eventos.items()) if e["status"] == status]
+
+    @contextmanager
+    def lote(self, limite):
+        with self._lock:
+            agora = time.monotonic()
+            vistos, eventos = set(), []
+            for i, e in sorted(self.eventos.items()):
+                if e["status"] != "PENDING" or e["chave"] in vistos:
+                    continue
+                vistos.add(e["chave"])
+                if e["proxima"] <= agora and len(eventos) < limite:
+                    eventos.append(Evento(i, e["payload"], e["tentativas"]))
+            yield _LoteMemoria(self, eventos)
+
+
+class _LoteMemoria:
+    cur = None
+
+    def __init__(self, store, eventos):
+        self.store = store
+        self.eventos = eventos
+
+    @contextmanager
+    def savepoint(self):
+        yield
+
+    def concluir(self, ev, ignorado=None):
+        self.store.eventos[ev.id].update(status="DONE", erro=None, ignorado=ignorado)
+
+    def falhar(self, ev, erro):
+        tentativas = ev.tentativas + 1
+        status = "DEAD" if tentativas >= Config.WEBHOOK_MAX_TENTATIVAS else "PENDING"
+        self.store.eventos[ev.id].update(
+            status=status, tentativas=tentativas, erro=repr(erro),
+            proxima=time.monotonic() + backoff(tentativas),
+        )
+        return status
+
+
+# ====
+# Consumidor
+# ====
+def processar_lote(store, handler, limite=None):
+    """Processa um lote de eventos. handler(cur, payload) aplica um evento. Retorna quantos foram lidos."""
+    limite = limite or Config.WEBHOOK_LOTE
+    inicio = time.perf_counter()
+    with store.lote(limite) as lote:
+        for ev in lote.eventos:
+            try:
+                with lote.savepoint():
+                    handler(lote.cur, ev.payload)
+                lote.concluir(ev)
+                PROCESSADOS.inc(resultado="ok")
+            except EventoIgnorado as e:
+                lote.concluir(ev, ignorado=str(e)[:2000])
+                PROCESSADOS.inc(resultado="ignorado")
+                logging.info("Evento do webhook id=%s ignorado: %s", ev.id, e)
+            except Exception as e:
+                status = lote.falhar(ev, e)
+                PROCESSADOS.inc(resultado="dead" if status == "DEAD" else "retry")
+                logging.exception("Falha ao processar evento do webhook id=%s (%s)", ev.id, status)
+        lidos = len(lote.eventos)
+    DURACAO_LOTE.observe(time.perf_counter() - inicio)
+    if lidos:
+        # Só depois do commit do lote: antes disso o dashboard recalcularia com os dados antigos
+        dashboard_metrics.invalidate()
+    return lidos
+
+
+class Worker(consumidor.Worker):
+    """Laço do consumidor. Roda numa thread do próprio worker web ou via `flask webhook-worker`."""
+
+    descricao = "consumidor do webhook"
+
+    def __init__(self, store, handler, intervalo=None):
+        super().__init__(lambda: processar_lote(store, handler),
+                         intervalo if intervalo is not None else Config.WEBHOOK_POLL_INTERVAL)
+        self.store = store
+        self.handler = handler
+
+
+_thread = None
+
+
+def garantir_worker_em_thread(handler):
+    """Sobe (uma vez por processo) a thread consumidora e a acorda."""
+    global _thread
+    if not Config.WEBHOOK_WORKER_THREAD:
+        return
+    if _thread is None:
+        # Fora de app context: cada lote pega e devolve sua própria conexão do pool
+        _thread = consumidor.ThreadPorProcesso("webhook-worker", lambda: Worker(PostgresStore(), handler))
+    _thread.garantir()